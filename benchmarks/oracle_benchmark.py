@@ -0,0 +1,204 @@
+"""
+Throughput benchmark for the membership oracles in delphi.oracle.
+
+Times every oracle class on the input shapes the gradient estimators in delphi.grad
+call them with, and writes one JSON record per (oracle, shape) with the median time,
+the elements (samples) per second and the peak memory of the call:
+
+    python -m benchmarks.oracle_benchmark --out oracle_benchmark.json
+"""
+
+from argparse import ArgumentParser
+import json
+import os
+import platform
+import statistics
+import threading
+import time
+import warnings
+import psutil
+import torch as ch
+
+from delphi import oracle
+from delphi import __version__
+
+
+# input layouts of the oracles in the gradient estimators
+REGRESSION = 'regression'  # num_samples x B x 1 noised predictions
+SAMPLES = 'samples'  # n x d samples of the multivariate normal estimators
+LOGITS = 'logits'  # num_samples x B x d noised logits of the classification estimators
+
+
+def make_unknown_gaussian(d, device):
+    eye, zeros = ch.eye(d, device=device), ch.zeros(d, device=device)
+    unknown = oracle.UnknownGaussian(zeros, eye, ch.randn(1000, d, device=device), 4)
+    unknown.dist = (zeros, eye)
+    return unknown
+
+
+def make_oracles(d, device):
+    """
+    Oracle cases for dimension d. The oracles are built lazily, so that an oracle that 
+    fails to construct is recorded as an error instead of stopping the benchmark.
+    Returns:
+        list of (name, layout, oracle constructor) tuples
+    """
+    cases = [
+        ('Interval', REGRESSION, lambda: oracle.Interval(-ch.ones(1), ch.ones(1))),
+        ('KIntervalUnion', REGRESSION, lambda: oracle.KIntervalUnion([(ch.Tensor([i]), ch.Tensor([i + .5])) for i in range(-50, 50)])),
+        ('Left', REGRESSION, lambda: oracle.Left(ch.zeros(1))),
+        ('Right', REGRESSION, lambda: oracle.Right(ch.zeros(1))),
+        ('Interval', SAMPLES, lambda: oracle.Interval(-ch.ones(d), ch.ones(d))),
+        ('KIntervalUnion', SAMPLES, lambda: oracle.KIntervalUnion([(ch.randn(d) - 1, ch.randn(d) + 1) for _ in range(10)])),
+        ('Lambda', SAMPLES, lambda: oracle.Lambda(lambda x: x.pow(2).sum() > .5)),
+        ('Sphere', SAMPLES, lambda: oracle.Sphere(ch.eye(d), ch.zeros(d), 1.0)),
+        ('UnknownGaussian', SAMPLES, lambda: make_unknown_gaussian(d, device)),
+        # UnknownGaussian returns the accepted samples, so the combinators query it through its mask
+        ('And[Left,UnknownGaussian]', SAMPLES, lambda: oracle.And(oracle.Left(ch.zeros(1)), make_unknown_gaussian(d, device))),
+        ('DNNLower', LOGITS, lambda: oracle.DNNLower(ch.zeros(1))),
+        ('LogitBall', LOGITS, lambda: oracle.LogitBall(1.0)),
+        ('LogitBallComplement', LOGITS, lambda: oracle.LogitBallComplement(1.0)),
+    ]
+    # the example lambdas use python control flow, which exercises the non-vectorized path
+    if d == 2:
+        cases.append(('Lambda[horseshoe]', SAMPLES, lambda: oracle.Lambda(oracle.horseshoe)))
+    return cases
+
+
+def make_input(layout, num_samples, B, d, device):
+    """
+    Random oracle input for a layout.
+    """
+    if layout == REGRESSION:
+        return ch.randn(num_samples, B, 1, device=device)
+    if layout == SAMPLES:
+        return ch.randn(num_samples * B, d, device=device)
+    return ch.randn(num_samples, B, d, device=device)
+
+
+class PeakMemory:
+    """
+    Measures the peak memory used while the context is open, above the memory in use when it
+    was entered. On CUDA devices this is the peak allocated memory, on CPU the peak resident set
+    size of the process, sampled by a background thread.
+    """
+    def __init__(self, device, interval=1e-3):
+        self.device = ch.device(device)
+        self.interval = interval
+        self.peak = 0
+
+    def __enter__(self):
+        if self.device.type == 'cuda':
+            ch.cuda.synchronize(self.device)
+            ch.cuda.reset_peak_memory_stats(self.device)
+            self._baseline = ch.cuda.memory_allocated(self.device)
+            return self
+        self._process = psutil.Process(os.getpid())
+        self._baseline = self._max = self._process.memory_info().rss
+        self._running = True
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def _poll(self):
+        while self._running:
+            self._max = max(self._max, self._process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __exit__(self, *exc):
+        if self.device.type == 'cuda':
+            ch.cuda.synchronize(self.device)
+            self.peak = ch.cuda.max_memory_allocated(self.device) - self._baseline
+        else:
+            self._running = False
+            self._thread.join()
+            self._max = max(self._max, self._process.memory_info().rss)
+            self.peak = self._max - self._baseline
+        return False
+
+
+def benchmark(oracle_, x, repeats, device):
+    """
+    Times an oracle on an input.
+    Returns:
+        Tuple with the median seconds per call and the peak memory in bytes
+    """
+    sync = ch.cuda.synchronize if ch.device(device).type == 'cuda' else lambda: None
+    # warm up, ie. vmap tracing and lazy initialization
+    oracle_(x)
+    sync()
+    times = []
+    with PeakMemory(device) as memory:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            oracle_(x)
+            sync()
+            times.append(time.perf_counter() - start)
+    return statistics.median(times), memory.peak
+
+
+def main(args):
+    records = []
+    for d in args.dims:
+        for name, layout, make_oracle in make_oracles(d, args.device):
+            if args.oracles and name.split('[')[0] not in args.oracles:
+                continue
+            # the regression oracles are one dimensional, so only run them once
+            if layout == REGRESSION and d != args.dims[0]:
+                continue
+            try:
+                oracle_, error = make_oracle(), None
+            except Exception as e:
+                oracle_, error = None, e
+            for num_samples in args.num_samples:
+                for B in args.batch_sizes:
+                    x = make_input(layout, num_samples, B, d, args.device)
+                    elements = x.numel() // x.size(-1)
+                    record = {'oracle': name, 'layout': layout, 'shape': list(x.size()), 'elements': elements}
+                    try:
+                        if error is not None:
+                            raise error
+                        with warnings.catch_warnings():
+                            warnings.simplefilter('ignore')
+                            seconds, peak = benchmark(oracle_, x, args.repeats, args.device)
+                        record.update({'seconds': seconds, 'elements_per_sec': elements / seconds, 'peak_memory_bytes': peak})
+                    except Exception as e:
+                        # record failures, so that broken oracles show up in the comparison
+                        record['error'] = '{}: {}'.format(type(e).__name__, e)
+                    records.append(record)
+                    if args.verbose:
+                        print(json.dumps(record))
+    results = {
+        'metadata': {
+            'delphi_version': __version__,
+            'torch_version': ch.__version__,
+            'python_version': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'num_threads': ch.get_num_threads(),
+            'device': args.device,
+            'repeats': args.repeats,
+        },
+        'results': records,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+parser = ArgumentParser(description='Membership oracle throughput benchmark')
+parser.add_argument('--out', type=str, default='oracle_benchmark.json', help='path of the JSON results file')
+parser.add_argument('--num-samples', type=int, nargs='+', default=[10, 100, 1000], help='number of noised copies per prediction')
+parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100], help='batch sizes')
+parser.add_argument('--dims', type=int, nargs='+', default=[2, 10], help='sample dimensions')
+parser.add_argument('--repeats', type=int, default=10, help='number of timed calls per case')
+parser.add_argument('--oracles', type=str, nargs='*', default=None, help='oracle classes to run, defaults to all')
+parser.add_argument('--device', type=str, default='cpu', help='device to run the oracles on')
+parser.add_argument('--seed', type=int, default=0, help='random seed')
+parser.add_argument('--verbose', action='store_true', help='print each record as it finishes')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    ch.manual_seed(args.seed)
+    main(args)
@@ -0,0 +1,145 @@
+"""
+Benchmark for the projection step of the truncated regression iteration hook.
+
+Compares the per-coordinate projection the hook used to run after every step, which
+clamps each weight coordinate with its own kernel and allocates new parameter tensors,
+with the fused in place projection of delphi.utils.helpers.project_regression_, for
+known and unknown noise variance, and writes one JSON record per (noise, dimension)
+with the median time of both projections, their speedup and the largest difference
+between their projected parameters:
+
+    python -m benchmarks.projection_benchmark --out projection_benchmark.json
+"""
+
+from argparse import ArgumentParser
+import json
+import platform
+import statistics
+import time
+import torch as ch
+
+from delphi import __version__
+from delphi.utils.helpers import Bounds, project_regression_
+
+
+class Regression(ch.nn.Module):
+    """
+    Regression parameters of the truncated regression model, with a 1 x d weight.
+    """
+    def __init__(self, d, device):
+        super().__init__()
+        self.weight = ch.nn.Parameter(3 * ch.randn(1, d, device=device))
+        self.bias = ch.nn.Parameter(3 * ch.randn(1, device=device))
+        self.lambda_ = ch.nn.Parameter(ch.rand(1, 1, device=device) * 4 + .05)
+
+
+def legacy_project(M, weight_bounds, bias_bounds, var_bounds, unknown):
+    """
+    Projection of the hook before it was fused, with float bias and variance bounds and (d,)
+    weight bounds.
+    """
+    if unknown:
+        var = M.lambda_.inverse()
+        weight = M.weight * var
+        M.lambda_.data = ch.clamp(var, var_bounds.lower, var_bounds.upper).inverse()
+        M.weight.data = ch.cat([ch.clamp(weight[:,i], weight_bounds.lower[i], weight_bounds.upper[i])
+            for i in range(weight.size(1))])[None,...] * M.lambda_
+        bias = M.bias * var
+        M.bias.data = (ch.clamp(bias, bias_bounds.lower, bias_bounds.upper) * M.lambda_).reshape(M.bias.size())
+    else:
+        M.weight.data = ch.cat([ch.clamp(M.weight[:,i], weight_bounds.lower[i], weight_bounds.upper[i])
+            for i in range(M.weight.size(1))])[None,...]
+        M.bias.data = ch.clamp(M.bias, bias_bounds.lower, bias_bounds.upper).reshape(M.bias.size())
+
+
+def make_bounds(d, device):
+    """
+    Projection set around random empirical estimates, as the hook's float bounds and as
+    the bound tensors of the fused projection.
+    """
+    emp_weight, radius = ch.randn(d, device=device), 2.0
+    weight_bounds = Bounds(emp_weight - radius, emp_weight + radius)
+    bias_bounds, var_bounds = Bounds(-radius, radius), Bounds(.5, 2.0)
+    tensors = (Bounds(weight_bounds.lower[None, :], weight_bounds.upper[None, :]),
+               Bounds(ch.full((1,), bias_bounds.lower, device=device), ch.full((1,), bias_bounds.upper, device=device)),
+               Bounds(ch.full((1, 1), var_bounds.lower, device=device), ch.full((1, 1), var_bounds.upper, device=device)))
+    return (weight_bounds, bias_bounds, var_bounds), tensors
+
+
+def fused_project(M, weight_bounds, bias_bounds, var_bounds, unknown):
+    project_regression_(M.weight, M.bias, weight_bounds, bias_bounds,
+                        lambda_=M.lambda_ if unknown else None, var_bounds=var_bounds)
+
+
+def benchmark(project, M, bounds, unknown, repeats, device):
+    """
+    Times a projection, restoring the unprojected parameters before each call.
+    Returns:
+        Tuple with the median seconds per call and the projected parameters
+    """
+    sync = ch.cuda.synchronize if ch.device(device).type == 'cuda' else lambda: None
+    params = [p.detach().clone() for p in M.parameters()]
+    times = []
+    for _ in range(repeats + 1):
+        with ch.no_grad():
+            for p, p_ in zip(M.parameters(), params):
+                p.data = p_.clone()
+        sync()
+        start = time.perf_counter()
+        project(M, *bounds, unknown)
+        sync()
+        times.append(time.perf_counter() - start)
+    # the first call warms up
+    return statistics.median(times[1:]), [p.detach().clone() for p in M.parameters()]
+
+
+def main(args):
+    records = []
+    for unknown in (False, True):
+        for d in args.dims:
+            M = Regression(d, args.device)
+            legacy_bounds, fused_bounds = make_bounds(d, args.device)
+            legacy_seconds, legacy_params = benchmark(legacy_project, M, legacy_bounds, unknown, args.repeats, args.device)
+            fused_seconds, fused_params = benchmark(fused_project, M, fused_bounds, unknown, args.repeats, args.device)
+            record = {
+                'noise': 'unknown' if unknown else 'known',
+                'd': d,
+                'legacy_seconds': legacy_seconds,
+                'fused_seconds': fused_seconds,
+                'speedup': legacy_seconds / fused_seconds,
+                'max_abs_diff': max(float((p - p_).abs().max()) for p, p_ in zip(legacy_params, fused_params)),
+            }
+            records.append(record)
+            if args.verbose:
+                print(json.dumps(record))
+    results = {
+        'metadata': {
+            'delphi_version': __version__,
+            'torch_version': ch.__version__,
+            'python_version': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'num_threads': ch.get_num_threads(),
+            'device': args.device,
+            'repeats': args.repeats,
+        },
+        'results': records,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+parser = ArgumentParser(description='Truncated regression projection benchmark')
+parser.add_argument('--out', type=str, default='projection_benchmark.json', help='path of the JSON results file')
+parser.add_argument('--dims', type=int, nargs='+', default=[1, 10, 100, 1000, 5000], help='number of covariates')
+parser.add_argument('--repeats', type=int, default=20, help='number of timed calls per case')
+parser.add_argument('--device', type=str, default='cpu', help='device to run the projections on')
+parser.add_argument('--seed', type=int, default=0, help='random seed')
+parser.add_argument('--verbose', action='store_true', help='print each record as it finishes')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    ch.manual_seed(args.seed)
+    main(args)
@@ -0,0 +1,127 @@
+"""
+Streaming convergence monitoring for projected stochastic gradient procedures.
+"""
+
+import torch as ch
+
+
+# default decay of the gradient's exponential moving average
+EMA_BETA = .9
+# default multiple of the tolerance below which the moving average triggers a full check
+CHECK_RATIO = 10.0
+# default number of checks after which the validation set is scored, whatever the moving average
+SCORE_EVERY = 10
+
+
+class ConvergenceMonitor:
+    """
+    Tracks an exponential moving average of the stochastic gradients that the training
+    steps already compute, so that convergence can be judged without scoring a validation
+    set. The average is kept for the gradient vector, rather than for its norm, so that
+    the minibatch noise averages out and the norm of the average estimates the norm of the
+    full gradient, instead of the (larger) expected minibatch gradient norm. The average
+    lives in one preallocated buffer and is bias corrected for its zero initialization.
+    """
+    def __init__(self, params, beta=EMA_BETA):
+        """
+        Args:
+            params (Iterable) : parameters whose gradients are monitored
+            beta (float) : decay of the moving average
+        """
+        self.params = list(params)
+        self.beta = beta
+        self.ema = ch.zeros(sum(p.numel() for p in self.params), dtype=self.params[0].dtype, device=self.params[0].device)
+        self.steps = 0
+
+    def update(self, grads=None):
+        """
+        Adds a stochastic gradient to the moving average.
+        Args:
+            grads (Iterable) : gradients of the monitored parameters, defaults to their .grad attributes
+        Returns:
+            the norm of the averaged gradient, None while there is no gradient yet
+        """
+        grads = [p.grad for p in self.params] if grads is None else list(grads)
+        if any(g is None for g in grads):
+            return self.norm
+        start = 0
+        with ch.no_grad():
+            for g in grads:
+                self.ema[start:start + g.numel()].mul_(self.beta).add_(g.flatten(), alpha=1 - self.beta)
+                start += g.numel()
+        self.steps += 1
+        return self.norm
+
+    @property
+    def norm(self):
+        """
+        Norm of the bias corrected moving average of the gradient.
+        """
+        if self.steps == 0:
+            return None
+        return float(self.ema.norm() / (1 - self.beta ** self.steps))
+
+    def reset(self):
+        self.ema.zero_()
+        self.steps = 0
+
+
+class StateSnapshot:
+    """
+    Snapshot of a model's state dict and its optimizer's state, copied into buffers that are
+    allocated on the first snapshot and reused after, instead of deep copies of the state dicts.
+    Optimizer hyperparameters (ie. the learning rate) are not part of the snapshot, so that
+    restoring it does not undo learning rate schedules.
+    """
+    def __init__(self):
+        self.model_state = None
+        self.optimizer_state = None
+
+    def save(self, model, optimizer=None):
+        """
+        Copies the current state of model and optimizer into the snapshot.
+        """
+        with ch.no_grad():
+            state = model.state_dict(keep_vars=True)
+            if self.model_state is None:
+                self.model_state = {k: ch.empty_like(v) for k, v in state.items()}
+            for k, v in state.items():
+                self.model_state[k].copy_(v)
+            if optimizer is None:
+                return
+            self.optimizer_state = {} if self.optimizer_state is None else self.optimizer_state
+            for i, p in enumerate(p for group in optimizer.param_groups for p in group['params']):
+                buffers = self.optimizer_state.setdefault(i, {})
+                for k, v in optimizer.state.get(p, {}).items():
+                    if isinstance(v, ch.Tensor):
+                        if k not in buffers or buffers[k].size() != v.size():
+                            buffers[k] = ch.empty_like(v)
+                        buffers[k].copy_(v)
+                    else:
+                        buffers[k] = v
+
+    def restore(self, model, optimizer=None):
+        """
+        Loads the snapshot back into model and optimizer.
+        """
+        if self.model_state is None:
+            return
+        with ch.no_grad():
+            for k, v in model.state_dict(keep_vars=True).items():
+                v.copy_(self.model_state[k])
+            if optimizer is None or self.optimizer_state is None:
+                return
+            for i, p in enumerate(p for group in optimizer.param_groups for p in group['params']):
+                state = optimizer.state[p]
+                for k, v in self.optimizer_state.get(i, {}).items():
+                    if isinstance(v, ch.Tensor):
+                        if isinstance(state.get(k), ch.Tensor) and state[k].size() == v.size():
+                            state[k].copy_(v)
+                        else:
+                            state[k] = v.clone()
+                    else:
+                        state[k] = v
+
+    @property
+    def empty(self):
+        return self.model_state is None
@@ -15,6 +15,43 @@ CYCLIC = 'cyclic'
 COSINE = 'cosine'
 LINEAR = 'linear'
 
+
+def make_schedule(optimizer, args, M=None):
+    '''
+    Create the learning rate scheduler (ch.nn.optim.lr_scheduler module) for an optimizer.
+    Args:
+        optimizer (torch.optim.Optimizer) : optimizer to schedule
+        args (cox.utils.Parameters) : hyperparameters (custom_lr_multiplier, lr_interpolation, step_lr, step_lr_gamma)
+        M (int) : number of steps the cyclic and cosine schedules span
+    Returns:
+        the scheduler, None for a constant learning rate
+    '''
+    # cyclic
+    if args.custom_lr_multiplier == CYCLIC and M is not None:
+        lr_func = lambda t: np.interp([t], [0, M*4//15, M], [0, 1, 0])[0]
+        return lr_scheduler.LambdaLR(optimizer, lr_func)
+    # cosine annealing scheduler
+    elif args.custom_lr_multiplier == COSINE and M is not None:
+        return lr_scheduler.CosineAnnealingLR(optimizer, M)
+    elif args.custom_lr_multiplier:
+        cs = args.custom_lr_multiplier
+        periods = eval(cs) if type(cs) is str else cs
+        # constant linear interpolation
+        if args.lr_interpolation == LINEAR:
+            lr_func = lambda t: np.interp([t], *zip(*periods))[0]
+        # custom lr interpolation
+        else:
+            def lr_func(ep):
+                for (milestone, lr) in reversed(periods):
+                    if ep >= milestone: return lr
+                return 1.0
+        return lr_scheduler.LambdaLR(optimizer, lr_func)
+    # step learning rate
+    elif args.step_lr:
+        return lr_scheduler.StepLR(optimizer, step_size=args.step_lr, gamma=args.step_lr_gamma)
+    return None
+
+
 class delphi(ch.nn.Module, ABC):
     '''
     Parent/abstract class for models to be passed into trainer.
@@ -52,29 +89,7 @@ class delphi(ch.nn.Module, ABC):
             self.optimizer = SGD(param_list, self.args.lr, momentum=self.args.momentum, weight_decay=self.args.weight_decay)
 
         # setup learning rate scheduler
-        if self.args.custom_lr_multiplier == CYCLIC and self.M is not None: # cyclic
-            lr_func = lambda t: np.interp([t], [0, self.M*4//15, self.M], [0, 1, 0])[0]
-            self.schedule = lr_scheduler.LambdaLR(self.optimizer, lr_func)
-        # cosine annealing scheduler
-        elif self.args.custom_lr_multiplier == COSINE and self.M is not None:
-            schedule = lr_scheduler.CosineAnnealingLR(self.optimizer, self.M)
-        elif self.args.custom_lr_multiplier:
-            cs = self.args.custom_lr_multiplier
-            periods = eval(cs) if type(cs) is str else cs
-            # constant linear interpolation
-            if self.args.lr_interpolation == LINEAR:
-                lr_func = lambda t: np.interp([t], *zip(*periods))[0]
-            # custom lr interpolation
-            else:
-                def lr_func(ep):
-                    for (milestone, lr) in reversed(periods):
-                        if ep >= milestone: return lr
-                    return 1.0
-            self.schedule = lr_scheduler.LambdaLR(self.optimizer, lr_func)
-        # step learning rate
-        elif self.args.step_lr:
-            self.schedule = lr_scheduler.StepLR(self.optimizer, step_size=self.args.step_lr, 
-            gamma=self.args.step_lr_gamma, verbose=self.args.verbose)
+        self.schedule = make_schedule(self.optimizer, self.args, self.M)
             
         # if checkpoint load  optimizer and scheduler
         if self.checkpoint:
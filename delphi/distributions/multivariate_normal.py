@@ -6,18 +6,22 @@ import torch as ch
 from torch import Tensor
 from torch.distributions.multivariate_normal import MultivariateNormal
 from cox.utils import Parameters
-import config
 
 from .stats import stats
-from ..oracle import oracle
+from ..oracle import oracle, Polytope
 from ..train import train_model
 from ..utils.datasets import DataSet, CENSORED_MULTIVARIATE_NORMAL_REQUIRED_ARGS,\
     CENSORED_MULTIVARIATE_NORMAL_OPTIONAL_ARGS, CensoredMultivariateNormal
 from ..grad import CensoredMultivariateNormalNLL
+from ..samplers import RejectionSampler, HitAndRunSampler
 from ..utils import defaults
 from ..utils.helpers import cov
 
 
+# survival probability below which polytope truncation sets are sampled by hit-and-run instead of rejection
+HIT_AND_RUN_ALPHA = .1
+
+
 class MultivariateNormal(stats):
     """
     Censored multivariate distribution class.
@@ -32,14 +36,23 @@ class MultivariateNormal(stats):
         """
         super(censored_multivariate_normal, self).__init__()
         # check that algorithm hyperparameters
-        config.args = defaults.check_and_fill_args(args, defaults.CENSOR_ARGS, CensoredMultivariateNormal)
+        # copy hyperparameters, so that estimators do not share state
+        self.args = defaults.check_and_fill_args(Parameters(dict(args.as_dict())), defaults.CENSOR_ARGS, CensoredMultivariateNormal)
         # add oracle and survival prob to parameters
-        config.args.__setattr__('phi', phi)
-        config.args.__setattr__('alpha', alpha)
+        self.args.__setattr__('phi', phi)
+        self.args.__setattr__('alpha', alpha)
         self._multivariate_normal = None
         # intialize loss function and add custom criterion to hyperparameters
         self.criterion = CensoredMultivariateNormalNLL.apply
-        config.args.__setattr__('custom_criterion', self.criterion)
+        self.args.__setattr__('custom_criterion', self.criterion)
+        # sampler for the gradient estimates; hit-and-run for polytopes with little mass, where most 
+        # rejection samples would be discarded, and otherwise a rejection sampler, which keeps acceptance statistics across steps
+        hit_and_run_alpha = self.args.hit_and_run_alpha if self.args.hit_and_run_alpha is not None else HIT_AND_RUN_ALPHA
+        if isinstance(phi, Polytope) and float(alpha) < hit_and_run_alpha:
+            self.sampler = HitAndRunSampler()
+        else:
+            self.sampler = RejectionSampler(self.args.num_samples)
+        self.args.__setattr__('rejection_sampler', self.sampler)
         # create instance variables for empirical estimates
         self.emp_loc, self.emp_covariance_matrix = None, None
         self.projection_set = None
@@ -57,17 +70,17 @@ class MultivariateNormal(stats):
             'label_mapping': None}
         ds = DataSet('censored_multivariate_normal', CENSORED_MULTIVARIATE_NORMAL_REQUIRED_ARGS,
                      CENSORED_MULTIVARIATE_NORMAL_OPTIONAL_ARGS, data_path=None, **ds_kwargs)
-        loaders = ds.make_loaders(workers=config.args.workers, batch_size=config.args.batch_size)
+        loaders = ds.make_loaders(workers=self.args.workers, batch_size=self.args.batch_size)
         # initialize model with empiricial estimates
         self._multivariate_normal = MultivariateNormal(loaders[0].dataset.loc, loaders[0].dataset.covariance_matrix)
         # keep track of gradients for mean and covariance matrix
         self._multivariate_normal.loc.requires_grad, self._multivariate_normal.covariance_matrix.requires_grad = True, True
         # initialize projection set and add iteration hook to hyperparameters
         self.projection_set = CensoredMultivariateNormalProjectionSet(self._multivariate_normal.loc,
-                                                                      self._multivariate_normal.covariance_matrix)
-        config.args.__setattr__('iteration_hook', self.projection_set)
+                                                                      self._multivariate_normal.covariance_matrix, self.args)
+        self.args.__setattr__('iteration_hook', self.projection_set)
         # run PGD to predict actual estimates
-        return train_model(config.args, self._multivariate_normal, loaders,
+        return train_model(self.args, self._multivariate_normal, loaders,
                            update_params=[self._multivariate_normal.loc, self._multivariate_normal.covariance_matrix])
 
 
@@ -75,16 +88,17 @@ class CensoredMultivariateNormalProjectionSet(CensoredNormalProjectionSet):
     """
     Censored multivariate normal projection set
     """
-    def __init__(self, emp_loc, emp_covariance_matrix):
+    def __init__(self, emp_loc, emp_covariance_matrix, args):
         """
         Args:
             emp_loc (torch.Tensor): empirical mean
             emp_covariance_matrix (torch.Tensor): empirical covariance
+            args (cox.utils.Parameters): estimator hyperparameters
         """
-        super().__init__(emp_loc, emp_covariance_matrix.svd()[1])
+        super().__init__(emp_loc, emp_covariance_matrix.svd()[1], args)
 
     def __call__(self, M, i, loop_type, inp, target):
-        if config.args.clamp:
+        if self.args.clamp:
             u, s, v = M.covariance_matrix.svd()  # decompose covariance estimate
             M.loc.data = ch.cat([ch.clamp(M.loc[i], self.loc_bounds.lower[i], self.loc_bounds.upper[i]).unsqueeze(0) for i in range(M.loc.shape[0])])
             M.covariance_matrix.data = u.matmul(ch.diag(ch.cat([ch.clamp(s[i], self.scale_bounds.lower[i], self.scale_bounds.upper[i]).unsqueeze(0) for i in range(s.shape[0])]))).matmul(v.t())
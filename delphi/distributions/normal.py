@@ -6,7 +6,6 @@ import torch as ch
 from torch import Tensor
 from torch.distributions.multivariate_normal import MultivariateNormal
 from cox.utils import Parameters
-import config
 
 from .stats import stats
 
@@ -15,6 +14,7 @@ from ..train import train_model
 from ..utils.datasets import DataSet, CENSORED_MULTIVARIATE_NORMAL_REQUIRED_ARGS,\
     CENSORED_MULTIVARIATE_NORMAL_OPTIONAL_ARGS, CensoredNormal
 from ..grad import CensoredMultivariateNormalNLL
+from ..samplers import RejectionSampler
 from ..utils import defaults
 from ..utils.helpers import Bounds, censored_sample_nll
 
@@ -34,14 +34,18 @@ class Normal(stats):
         """
         super(censored_normal, self).__init__()
         # check algorithm hyperparameters
-        config.args = defaults.check_and_fill_args(args, defaults.CENSOR_ARGS, CensoredNormal)
+        # copy hyperparameters, so that estimators do not share state
+        self.args = defaults.check_and_fill_args(Parameters(dict(args.as_dict())), defaults.CENSOR_ARGS, CensoredNormal)
         # add oracle and survival prob to parameters
-        config.args.__setattr__('phi', phi)
-        config.args.__setattr__('alpha', alpha)
+        self.args.__setattr__('phi', phi)
+        self.args.__setattr__('alpha', alpha)
         self._normal = None
         # intialize loss function and add custom criterion to hyperparameters
         self.criterion = CensoredMultivariateNormalNLL.apply
-        config.args.__setattr__('custom_criterion', self.criterion)
+        self.args.__setattr__('custom_criterion', self.criterion)
+        # rejection sampler for the gradient estimates, keeps acceptance statistics across steps
+        self.sampler = RejectionSampler(self.args.num_samples)
+        self.args.__setattr__('rejection_sampler', self.sampler)
         # create instance variables for empirical estimates
         self.emp_loc, self.emp_var = None, None
         # initialize projection set
@@ -60,16 +64,16 @@ class Normal(stats):
             'label_mapping': None}
         ds = DataSet('censored_normal', CENSORED_MULTIVARIATE_NORMAL_REQUIRED_ARGS,
                      CENSORED_MULTIVARIATE_NORMAL_OPTIONAL_ARGS, data_path=None, **ds_kwargs)
-        loaders = ds.make_loaders(workers=config.args.workers, batch_size=config.args.batch_size)
+        loaders = ds.make_loaders(workers=self.args.workers, batch_size=self.args.batch_size)
         # get empirical estimates from dataset and initialize distribution
         self._normal = MultivariateNormal(loaders[0].dataset.loc, loaders[0].dataset.var.unsqueeze(0))
         # initialize model with empirical estimates
         self._normal.loc.requires_grad, self._normal.covariance_matrix.requires_grad = True, True
         # initialize projection set and add iteration hook to hyperparameters
-        self.projection_set = CensoredNormalProjectionSet(self._normal.loc, self._normal.covariance_matrix)
-        config.args.__setattr__('iteration_hook', self.projection_set)
+        self.projection_set = CensoredNormalProjectionSet(self._normal.loc, self._normal.covariance_matrix, self.args)
+        self.args.__setattr__('iteration_hook', self.projection_set)
         # run PGD to predict actual estimates
-        return train_model(config.args, self._normal, loaders,
+        return train_model(self.args, self._normal, loaders,
                            update_params=[self._normal.loc, self._normal.covariance_matrix])
 
 
@@ -77,24 +81,26 @@ class CensoredNormalProjectionSet:
     """
     Censored normal distribution projection set
     """
-    def __init__(self, emp_loc, emp_scale):
+    def __init__(self, emp_loc, emp_scale, args):
         """
         Args:
             emp_loc (torch.Tensor): empirical mean
             emp_scale (torch.Tensor): empirical variance
+            args (cox.utils.Parameters): estimator hyperparameters
         """
+        self.args = args
         self.emp_loc = emp_loc.clone().detach()
         self.emp_scale = emp_scale.clone().detach()
-        self.radius = config.args.radius*(ch.log(1.0/config.args.alpha)/ch.square(config.args.alpha))
+        self.radius = self.args.radius*(ch.log(1.0/self.args.alpha)/ch.square(self.args.alpha))
         # parameterize projection set
-        if config.args.clamp:
+        if self.args.clamp:
             self.loc_bounds, self.scale_bounds = Bounds(self.emp_loc-self.radius, self.emp_loc+self.radius), \
-             Bounds(ch.max(ch.square(config.args.alpha/12.0), self.emp_scale - self.radius), self.emp_scale + self.radius)
+             Bounds(ch.max(ch.square(self.args.alpha/12.0), self.emp_scale - self.radius), self.emp_scale + self.radius)
         else:
             pass
 
     def __call__(self, M, i, loop_type, inp, target):
-        if config.args.clamp:
+        if self.args.clamp:
             M.loc.data = ch.clamp(M.loc.data, float(self.loc_bounds.lower), float(self.loc_bounds.upper))
             M.covariance_matrix.data = ch.clamp(M.covariance_matrix.data, float(self.scale_bounds.lower), float(self.scale_bounds.upper))
         else:
@@ -7,7 +7,6 @@ import torch as ch
 from torch import Tensor
 from torch.distributions.multivariate_normal import MultivariateNormal
 from cox.utils import Parameters
-import config
 
 from .stats import stats
 from .unknown_truncation_normal import TruncatedMultivariateNormalNLL, TruncatedNormalProjectionSet
@@ -33,14 +32,15 @@ class truncated_multivariate_normal(stats):
             **kwargs):
         super(truncated_multivariate_normal, self).__init__()
         # check algorithm hyperparameters
-        config.args = defaults.check_and_fill_args(args, defaults.HERMITE_ARGS, TruncatedMultivariateNormal)
+        # copy hyperparameters, so that estimators do not share state
+        self.args = defaults.check_and_fill_args(Parameters(dict(args.as_dict())), defaults.HERMITE_ARGS, TruncatedMultivariateNormal)
         # add oracle and survival prob to parameters
-        config.args.__setattr__('phi', phi)
-        config.args.__setattr__('alpha', alpha)
+        self.args.__setattr__('phi', phi)
+        self.args.__setattr__('alpha', alpha)
         self._multivariate_normal = None
         # intialize loss function and add custom criterion to hyperparameters
         self.criterion = TruncatedMultivariateNormalNLL.apply
-        config.args.__setattr__('custom_criterion', self.criterion)
+        self.args.__setattr__('custom_criterion', self.criterion)
 
     def fit(self, S: Tensor):
         # create dataset and dataloader
@@ -53,20 +53,20 @@ class truncated_multivariate_normal(stats):
             'label_mapping': None}
         ds = DataSet('truncated_normal', TRUNCATED_MULTIVARIATE_NORMAL_REQUIRED_ARGS,
                      TRUNCATED_MULTIVARIATE_NORMAL_OPTIONAL_ARGS, data_path=None, **ds_kwargs)
-        loaders = ds.make_loaders(workers=config.args.workers, batch_size=config.args.batch_size)
+        loaders = ds.make_loaders(workers=self.args.workers, batch_size=self.args.batch_size)
         # initialize model with empiricial estimates
         self._multivariate_normal = MultivariateNormal(loaders[0].dataset.loc, loaders[0].dataset.covariance_matrix)
         # keep track of gradients for mean and covariance matrix
         self._multivariate_normal.loc.requires_grad, self._multivariate_normal.covariance_matrix.requires_grad = True, True
         # initialize projection set and add iteration hook to hyperparameters
         self.projection_set = TruncatedMultivariateNormalProjectionSet(self._multivariate_normal.loc,
-                                                                       self._multivariate_normal.covariance_matrix)
-        config.args.__setattr__('iteration_hook', self.projection_set)
+                                                                       self._multivariate_normal.covariance_matrix, self.args)
+        self.args.__setattr__('iteration_hook', self.projection_set)
         # exponent class
         self.exp_h = Exp_h(self._multivariate_normal.loc, self._multivariate_normal.covariance_matrix)
-        config.args.__setattr__('exp_h', self.exp_h)
+        self.args.__setattr__('exp_h', self.exp_h)
         # run PGD to predict actual estimates
-        return train_model(config.args, self._multivariate_normal, loaders,
+        return train_model(self.args, self._multivariate_normal, loaders,
                            update_params=[self._multivariate_normal.loc, self._multivariate_normal.covariance_matrix])
 
 
@@ -75,7 +75,7 @@ class TruncatedMultivariateNormalProjectionSet(TruncatedNormalProjectionSet):
     Truncated multivariate normal distribution with unknown truncation projection set.
     """
 
-    def __init__(self, emp_loc, emp_covariance_matrix):
+    def __init__(self, emp_loc, emp_covariance_matrix, args):
         """
         Args:
             emp_loc (torch.Tensor): empirical mean
@@ -83,11 +83,12 @@ class TruncatedMultivariateNormalProjectionSet(TruncatedNormalProjectionSet):
             alpha (torch.Tensor): lower bound on survival probability for distribution
             r (float): projection set radius
             clamp (bool): boolean for clamp heuristic
+            args (cox.utils.Parameters): estimator hyperparameters
         """
-        super().__init__(emp_loc, emp_covariance_matrix.svd()[1])
+        super().__init__(emp_loc, emp_covariance_matrix.svd()[1], args)
 
     def __call__(self, M, i, loop_type, inp, target):
-        if config.args.clamp:
+        if self.args.clamp:
             u, s, v = M.covariance_matrix.svd()  # decompose covariance estimate
             M.loc.data = ch.cat(
                 [ch.clamp(M.loc[i], float(self.loc_bounds.lower[i]), float(self.loc_bounds.upper[i])).unsqueeze(0) for i in
@@ -6,7 +6,6 @@ import torch as ch
 from torch import Tensor
 from torch.distributions.multivariate_normal import MultivariateNormal
 from cox.utils import Parameters
-import config
 
 from .stats import stats
 from ..oracle import oracle
@@ -30,14 +29,15 @@ class truncated_normal(stats):
             **kwargs):
         super(truncated_normal, self).__init__()
         # check algorithm hyperparameters
-        config.args = defaults.check_and_fill_args(args, defaults.HERMITE_ARGS, TruncatedNormal)
+        # copy hyperparameters, so that estimators do not share state
+        self.args = defaults.check_and_fill_args(Parameters(dict(args.as_dict())), defaults.HERMITE_ARGS, TruncatedNormal)
         # add oracle and survival prob to parameters
-        config.args.__setattr__('phi', phi)
-        config.args.__setattr__('alpha', alpha)
+        self.args.__setattr__('phi', phi)
+        self.args.__setattr__('alpha', alpha)
         self._normal = None
         # intialize loss function and add custom criterion to hyperparameters
         self.criterion = TruncatedMultivariateNormalNLL.apply
-        config.args.__setattr__('custom_criterion', self.criterion)
+        self.args.__setattr__('custom_criterion', self.criterion)
 
     def fit(self, S: Tensor):
         """
@@ -54,19 +54,19 @@ class truncated_normal(stats):
             'label_mapping': None}
         ds = DataSet('truncated_normal', TRUNCATED_MULTIVARIATE_NORMAL_REQUIRED_ARGS,
                      TRUNCATED_MULTIVARIATE_NORMAL_OPTIONAL_ARGS, data_path=None, **ds_kwargs)
-        loaders = ds.make_loaders(workers=config.args.workers, batch_size=config.args.batch_size)
+        loaders = ds.make_loaders(workers=self.args.workers, batch_size=self.args.batch_size)
         # initialize model with empiricial estimates
         self._normal = MultivariateNormal(loaders[0].dataset.loc, loaders[0].dataset.var.unsqueeze(0))
         # keep track of gradients for mean and covariance matrix
         self._normal.loc.requires_grad, self._normal.covariance_matrix.requires_grad = True, True
         # initialize projection set and add iteration hook to hyperparameters
-        self.projection_set = TruncatedNormalProjectionSet(self._normal.loc, self._normal.covariance_matrix)
-        config.args.__setattr__('iteration_hook', self.projection_set)
+        self.projection_set = TruncatedNormalProjectionSet(self._normal.loc, self._normal.covariance_matrix, self.args)
+        self.args.__setattr__('iteration_hook', self.projection_set)
         # exponent class
         self.exp_h = Exp_h(self._normal.loc, self._normal.covariance_matrix)
-        config.args.__setattr__('exp_h', self.exp_h)
+        self.args.__setattr__('exp_h', self.exp_h)
         # run PGD to predict actual estimates
-        return train_model(config.args, self._normal, loaders,
+        return train_model(self.args, self._normal, loaders,
                            update_params=[self._normal.loc, self._normal.covariance_matrix])
 
 
@@ -75,28 +75,30 @@ class TruncatedNormalProjectionSet:
     Truncated normal distribution with unknown truncation projection set.
     """
 
-    def __init__(self, emp_loc, emp_scale):
+    def __init__(self, emp_loc, emp_scale, args):
         """
         Args:
             emp_loc (torch.Tensor): empirical mean
             emp_scale (torch.Tensor): empirical variance
+            args (cox.utils.Parameters): estimator hyperparameters
         """
+        self.args = args
         # projection set parameters
         self.emp_loc = emp_loc
         self.emp_scale = emp_scale
-        self.radius = config.args.radius * ch.sqrt(ch.log(1.0 / config.args.alpha))
+        self.radius = self.args.radius * ch.sqrt(ch.log(1.0 / self.args.alpha))
 
         # upper and lower bounds
-        if config.args.clamp:
+        if self.args.clamp:
             self.loc_bounds, self.scale_bounds = Bounds(self.emp_loc - self.radius, self.emp_loc + self.radius), \
-                                                 Bounds(ch.max(config.args.alpha.pow(2) / 12,
+                                                 Bounds(ch.max(self.args.alpha.pow(2) / 12,
                                                                self.emp_scale - self.radius),
                                                         self.emp_scale + self.radius)
         else:
             pass
 
     def __call__(self, M, i, loop_type, inp, target):
-        if config.args.clamp:
+        if self.args.clamp:
             M.loc.data = ch.clamp(M.loc.data, float(self.loc_bounds.lower), float(self.loc_bounds.upper))
             M.covariance_matrix.data = ch.clamp(M.covariance_matrix.data, float(self.scale_bounds.lower),
                                                 float(self.scale_bounds.upper))
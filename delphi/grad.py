@@ -4,12 +4,21 @@ Gradients for truncated and untruncated latent variable models.
 import torch as ch
 from torch import Tensor
 from torch import sigmoid as sig
-from torch.distributions import Uniform, Gumbel, Laplace
-from torch.distributions.transforms import SigmoidTransform
-from torch.distributions.transformed_distribution import TransformedDistribution
-import config
+from torch.special import log_ndtr
+import math
 
-from .utils.helpers import logistic
+from .noise import make_noise
+from .masks import pack_mask, pack_oracle, masked_sum, masked_count
+from . import samplers
+from .utils.helpers import censored_sample_nll
+
+# log(sqrt(2 * pi)), normalizing constant of the standard normal density
+LOG_SQRT_2PI = .5 * math.log(2 * math.pi)
+# number of sample sized tensors alive at once in the Monte Carlo loops (noise, noised copies, mask, product)
+MC_TEMPORARIES = 4
+# with packed masks only the noise and the noised copies are sample sized floats, the oracle's mask
+# is built and packed a few samples at a time (see delphi.masks.pack_oracle)
+PACKED_MC_TEMPORARIES = 2
 
 
 class CensoredMultivariateNormalNLL(ch.autograd.Function):
@@ -18,8 +27,9 @@ class CensoredMultivariateNormalNLL(ch.autograd.Function):
     """
 
     @staticmethod
-    def forward(ctx, loc, covariance_matrix, x):
+    def forward(ctx, loc, covariance_matrix, x, args):
         ctx.save_for_backward(loc, covariance_matrix, x)
+        ctx.args = args
         return ch.zeros(1)
 
     @staticmethod
@@ -29,14 +39,11 @@ class CensoredMultivariateNormalNLL(ch.autograd.Function):
         T = covariance_matrix.inverse()
         v = T.matmul(loc.unsqueeze(1)).flatten()
         # rejection sampling
-        y = Tensor([])
-        M = MultivariateNormal(v, T)
-        while y.size(0) < x.size(0):
-            s = M.sample(sample_shape=ch.Size([config.args.num_samples, ]))
-            y = ch.cat([y, s[config.args.phi(s).nonzero(as_tuple=False).flatten()]])
+        sampler = ctx.args.rejection_sampler if ctx.args.rejection_sampler is not None else samplers.RejectionSampler(ctx.args.num_samples)
+        y = sampler(v, T, ctx.args.phi, x.size(0), noise_=make_noise(ctx.args.noise))
         # calculate gradient
-        grad = (-x + censored_sample_nll(y[:x.size(0)])).mean(0)
-        return grad[loc.size(0) ** 2:], grad[:loc.size(0) ** 2].reshape(covariance_matrix.size()), None
+        grad = (-x + censored_sample_nll(y)).mean(0)
+        return grad[loc.size(0) ** 2:], grad[:loc.size(0) ** 2].reshape(covariance_matrix.size()), None, None
 
 
 class TruncatedMultivariateNormalNLL(ch.autograd.Function):
@@ -45,17 +52,18 @@ class TruncatedMultivariateNormalNLL(ch.autograd.Function):
     """
 
     @staticmethod
-    def forward(ctx, u, B, x, loc_grad, cov_grad):
+    def forward(ctx, u, B, x, loc_grad, cov_grad, args):
         ctx.save_for_backward(u, B, x, loc_grad, cov_grad)
+        ctx.args = args
         return ch.ones(1)
 
     @staticmethod
     def backward(ctx, grad_output):
         u, B, x, loc_grad, cov_grad = ctx.saved_tensors
-        exp = config.args.exp_h(u, B, x)
-        psi = config.args.phi.psi_k(x).unsqueeze(1)
+        exp = ctx.args.exp_h(u, B, x)
+        psi = ctx.args.phi.psi_k(x).unsqueeze(1)
         return (loc_grad * exp * psi).mean(0), ((cov_grad.flatten(1) * exp * psi).unflatten(1, B.size())).mean(
-            0), None, None, None
+            0), None, None, None, None
 
 
 class TruncatedMSE(ch.autograd.Function):
@@ -64,24 +72,27 @@ class TruncatedMSE(ch.autograd.Function):
     with known noise variance.
     """
     @staticmethod
-    def forward(ctx, pred, targ, phi):
+    def forward(ctx, pred, targ, phi, args):
         ctx.save_for_backward(pred, targ)
-        ctx.phi = phi
+        ctx.phi, ctx.args = phi, args
         return 0.5 * (pred.float() - targ.float()).pow(2).mean(0)
 
     @staticmethod
     def backward(ctx, grad_output):
-        # import pdb; pdb.set_trace()
         pred, targ = ctx.saved_tensors
-        # make args.num_samples copies of pred, N x B x 1
-        stacked = pred[None, ...].repeat(config.args.num_samples, 1, 1)
-        # add random noise to each copy
-        noised = stacked + ch.randn(stacked.size()).to(config.args.device)
-        # filter out copies where pred is in bounds
-        filtered = ctx.phi(noised)
-        # average across truncated indices
-        out = (filtered * noised).sum(dim=0) / (filtered.sum(dim=0) + config.args.eps)
-        return (out - targ) / pred.size(0), targ / pred.size(0), None
+        intervals = getattr(ctx.phi, 'intervals', None)
+        if ctx.args.analytic and intervals is not None:
+            # conditional mean of the truncated noise distribution in closed form
+            out, _ = truncated_normal_moments(pred, 1.0, intervals)
+        else:
+            # sample args.num_samples copies of pred from the truncated noise distribution, by inverse CDF for 
+            # one dimensional interval oracles, or else by adding noise and summing the copies that fall in the truncation set
+            moments = ctx.args.sampler if ctx.args.sampler is not None else samplers.inverse_cdf_moments
+            z, _, count = moments(pred, 1.0, ctx.phi, ctx.args.num_samples, ctx.args.max_memory, noise_=make_noise(ctx.args.noise), 
+                                  packed=bool(ctx.args.packed_masks))
+            # average across truncated indices
+            out = z / (count + ctx.args.eps)
+        return (out - targ) / pred.size(0), targ / pred.size(0), None, None
 
 
 class TruncatedUnknownVarianceMSE(ch.autograd.Function):
@@ -90,9 +101,9 @@ class TruncatedUnknownVarianceMSE(ch.autograd.Function):
     with unknown noise variance.
     """
     @staticmethod
-    def forward(ctx, pred, targ, lambda_, phi):
+    def forward(ctx, pred, targ, lambda_, phi, args):
         ctx.save_for_backward(pred, targ, lambda_)
-        ctx.phi = phi
+        ctx.phi, ctx.args = phi, args
         return 0.5 * (pred.float() - targ.float()).pow(2).mean(0)
 
     @staticmethod
@@ -100,118 +111,210 @@ class TruncatedUnknownVarianceMSE(ch.autograd.Function):
         pred, targ, lambda_ = ctx.saved_tensors
         # calculate std deviation of noise distribution estimate
         sigma = ch.sqrt(lambda_.inverse())
-        stacked = pred[None, ...].repeat(config.args.num_samples, 1, 1)
-        # add noise to regression predictions
-        noised = stacked + sigma * ch.randn(stacked.size()).to(config.args.device)
-        # filter out copies that fall outside of truncation set
-        filtered = ctx.phi(noised)
-        z = noised * filtered
-        lambda_grad = .5 * (targ.pow(2) - (z.pow(2).sum(dim=0) / (filtered.sum(dim=0) + config.args.eps)))
+        intervals = getattr(ctx.phi, 'intervals', None)
+        if ctx.args.analytic and intervals is not None:
+            # conditional first and second moments of the truncated noise distribution in closed form
+            out, out_sq = truncated_normal_moments(pred, sigma, intervals)
+        else:
+            # sample from the truncated noise distribution, by inverse CDF for one dimensional interval oracles,
+            # or else by adding noise to regression predictions and summing the copies that fall in the truncation set
+            moments = ctx.args.sampler if ctx.args.sampler is not None else samplers.inverse_cdf_moments
+            z, z_sq, count = moments(pred, sigma, ctx.phi, ctx.args.num_samples, ctx.args.max_memory, 
+                                     second_moment=True, noise_=make_noise(ctx.args.noise), packed=bool(ctx.args.packed_masks))
+            out, out_sq = z / (count + ctx.args.eps), z_sq / (count + ctx.args.eps)
+        lambda_grad = .5 * (targ.pow(2) - out_sq)
         """
         multiply the v gradient by lambda, because autograd computes 
         v_grad*x*variance, thus need v_grad*(1/variance) to cancel variance
         factor
         """
-        out = z.sum(dim=0) / (filtered.sum(dim=0) + config.args.eps)
-        return lambda_ * (out - targ) / pred.size(0), targ / pred.size(0), lambda_grad / pred.size(0), None
+        return lambda_ * (out - targ) / pred.size(0), targ / pred.size(0), lambda_grad / pred.size(0), None, None
 
 
 class LogisticBCE(ch.autograd.Function):
     @staticmethod
-    def forward(ctx, pred, targ):
+    def forward(ctx, pred, targ, args):
         ctx.save_for_backward(pred, targ)
+        ctx.args = args
         loss = ch.nn.BCEWithLogitsLoss()
         return loss(pred, targ)
 
     @staticmethod
     def backward(ctx, grad_output):
         pred, targ = ctx.saved_tensors
-        stacked = pred[None, ...].repeat(config.args.num_samples, 1, 1)
-        rand_noise = logistic.sample(stacked.size())
+        stacked = pred[None, ...].repeat(ctx.args.num_samples, 1, 1)
+        rand_noise = make_noise(ctx.args.noise).logistic(stacked.size(), pred.device)
         # add noise
         noised = stacked + rand_noise
         noised_labs = noised > 0
         # filter
-        mask = (noised_labs).eq(targ)
-        avg = 1 - 2*((sig(rand_noise)*mask).sum(0) / (mask.sum(0) + 1e-5))
-        return avg, None
+        mask = pack_mask((noised_labs).eq(targ), bool(ctx.args.packed_masks))
+        avg = 1 - 2*(masked_sum(sig(rand_noise), mask) / (masked_count(mask) + 1e-5))
+        return avg, None, None
 
 
 class TruncatedBCE(ch.autograd.Function):
     @staticmethod
-    def forward(ctx, pred, targ):
+    def forward(ctx, pred, targ, args):
         ctx.save_for_backward(pred, targ)
+        ctx.args = args
         loss = ch.nn.BCEWithLogitsLoss()
         return loss(pred, targ)
 
     @staticmethod
     def backward(ctx, grad_output):
         pred, targ = ctx.saved_tensors
-
-        # logistic distribution
-        base_distribution = Uniform(0, 1)
-        transforms_ = [SigmoidTransform().inv]
-        logistic = TransformedDistribution(base_distribution, transforms_)
-
-        stacked = pred[None, ...].repeat(config.args.num_samples, 1, 1)
-        # add noise
-        noised = stacked + logistic.sample(stacked.size())
-        # filter
-        filtered = config.args.phi(noised).unsqueeze(-1)
-        out = (noised * filtered).sum(dim=0) / (filtered.sum(dim=0) + 1e-5)
+        intervals = getattr(ctx.args.phi, 'intervals', None)
+        if intervals is not None:
+            # sample the truncated logistic noise by inverse CDF, so that every copy falls in the truncation set
+            u = make_noise(ctx.args.noise).uniform((ctx.args.num_samples,) + pred.size(), pred.device)
+            out = samplers.truncated_sample(pred, 1.0, intervals, u, 'logistic').mean(0)
+        else:
+            stacked = pred[None, ...].repeat(ctx.args.num_samples, 1, 1)
+            # add logistic noise
+            noised = stacked + make_noise(ctx.args.noise).logistic(stacked.size(), pred.device)
+            # filter
+            filtered = pack_oracle(lambda x: ctx.args.phi(x).unsqueeze(-1), noised, bool(ctx.args.packed_masks))
+            out = masked_sum(noised, filtered) / (masked_count(filtered) + 1e-5)
         grad = ch.where(ch.abs(out) > 1e-5, sig(out), targ) - targ
-        return grad / pred.size(0), -grad / pred.size(0)
+        return grad / pred.size(0), -grad / pred.size(0), None
 
 
 class GumbelCE(ch.autograd.Function):
     @staticmethod
-    def forward(ctx, pred, targ):
+    def forward(ctx, pred, targ, args):
         ctx.save_for_backward(pred, targ)
+        ctx.args = args
         ce_loss = ch.nn.CrossEntropyLoss()
         return ce_loss(pred, targ)
 
     @staticmethod
     def backward(ctx, grad_output):
         pred, targ = ctx.saved_tensors
-        # gumbel distribution
-        gumbel = Gumbel(0, 1)
         # make num_samples copies of pred logits
-        stacked = pred[None, ...].repeat(config.args.num_samples, 1, 1)
+        stacked = pred[None, ...].repeat(ctx.args.num_samples, 1, 1)
         # add gumbel noise to logits
-        rand_noise = gumbel.sample(stacked.size()).to(config.args.device)
+        rand_noise = make_noise(ctx.args.noise).gumbel(stacked.size(), ctx.args.device)
         noised = stacked + rand_noise 
         noised_labs = noised.argmax(-1)
         # remove the logits from the trials, where the kth logit is not the largest value
-        mask = noised_labs.eq(targ)[..., None]
+        mask = pack_mask(noised_labs.eq(targ)[..., None], bool(ctx.args.packed_masks))
         inner_exp = 1 - ch.exp(-rand_noise)
-        avg = (inner_exp * mask).sum(0) / (mask.sum(0) + 1e-5) / pred.size(0)
-        return -avg , None
+        avg = masked_sum(inner_exp, mask) / (masked_count(mask) + 1e-5) / pred.size(0)
+        return -avg , None, None
 
 
 class TruncatedCE(ch.autograd.Function):
     @staticmethod
-    def forward(ctx, pred, targ, phi):
+    def forward(ctx, pred, targ, phi, args):
         ctx.save_for_backward(pred, targ)
-        ctx.phi = phi
+        ctx.phi, ctx.args = phi, args
         ce_loss = ch.nn.CrossEntropyLoss()
         return ce_loss(pred, targ)
 
     @staticmethod
     def backward(ctx, grad_output):  
         pred, targ = ctx.saved_tensors
-        # initialize gumbel distribution
-        gumbel = Gumbel(0, 1)
         # make num_samples copies of pred logits
-        stacked = pred[None, ...].repeat(config.args.num_samples, 1, 1)
+        stacked = pred[None, ...].repeat(ctx.args.num_samples, 1, 1)
         # add gumbel noise to logits
-        rand_noise = gumbel.sample(stacked.size()).to(config.args.device)
+        rand_noise = make_noise(ctx.args.noise).gumbel(stacked.size(), ctx.args.device)
         noised = (stacked) + rand_noise 
         # truncate - if one of the noisy logits does not fall within the truncation set, remove it
-        # filtered = ctx.phi(noised)[..., None].to(config.args.device)
-        filtered = ctx.phi((stacked / 1.65))[..., None].to(config.args.device)
+        # filtered = ctx.phi(noised)[..., None].to(ctx.args.device)
+        filtered = pack_oracle(lambda x: ctx.phi(x)[..., None].to(ctx.args.device), stacked / 1.65, bool(ctx.args.packed_masks))
         noised_labs = noised.argmax(-1)
         # mask takes care of invalid logits and truncation set
-        mask = noised_labs.eq(targ)[..., None]
+        mask = pack_mask(noised_labs.eq(targ)[..., None], bool(ctx.args.packed_masks))
         inner_exp = (1 - ch.exp(-rand_noise))
-        avg = (((inner_exp * mask).sum(0) / ((mask).sum(0) + 1e-5)) - ((inner_exp * filtered).sum(0) / (filtered.sum(0) + 1e-5))) / pred.size(0)       
-        return -avg, None, None
+        avg = ((masked_sum(inner_exp, mask) / (masked_count(mask) + 1e-5)) - (masked_sum(inner_exp, filtered) / (masked_count(filtered) + 1e-5))) / pred.size(0)       
+        return -avg, None, None, None
+
+
+def truncated_moments(pred, scale, phi, num_samples, max_memory=None, second_moment=False, noise_=None, packed=False):
+    """
+    Monte Carlo sums for the truncated normal distribution centered at pred. Draws 
+    num_samples noised copies pred + scale * N(0, 1), filters them through the membership 
+    oracle and accumulates the masked sums into running buffers. When max_memory is given, 
+    the copies are drawn in chunks, so that the noise tensor and its temporaries 
+    never take up more than max_memory bytes.
+    Args: 
+        pred (torch.Tensor) : B x 1 predictions
+        scale (float or torch.Tensor) : standard deviation of the noise distribution
+        phi (delphi.oracle.oracle) : membership oracle 
+        num_samples (int) : number of noised copies per prediction 
+        max_memory (int) : memory budget in bytes for each chunk, None draws all samples at once
+        second_moment (bool) : also accumulate the masked sum of squares
+        noise_ (delphi.noise.noise) : noise source, defaults to i.i.d. pseudo-random noise
+        packed (bool) : pack the oracle's mask into bits and reduce with the fused masked sums, 
+            so that the noised copies are the only sample sized float tensor
+    Returns: 
+        Tuple with masked sum, masked sum of squares (None if second_moment is False) 
+        and the number of accepted copies for each prediction
+    """
+    chunk = num_samples
+    if max_memory is not None:
+        sample_bytes = pred.numel() * pred.element_size() * (PACKED_MC_TEMPORARIES if packed else MC_TEMPORARIES)
+        chunk = int(max(1, min(num_samples, max_memory // sample_bytes)))
+    noise_ = make_noise(noise_)
+    scale = ch.as_tensor(scale, dtype=pred.dtype, device=pred.device)
+    z, count = ch.zeros_like(pred), ch.zeros_like(pred)
+    z_sq = ch.zeros_like(pred) if second_moment else None
+    for start in range(0, num_samples, chunk):
+        noised = ch.addcmul(pred[None, ...], noise_.normal((min(chunk, num_samples - start),) + pred.size(), pred.device), scale)
+        filtered = pack_oracle(phi, noised, packed)
+        z += masked_sum(noised, filtered)
+        count += masked_count(filtered)
+        if second_moment:
+            z_sq += masked_sum(noised, filtered, power=2)
+    return z, z_sq, count
+
+
+def truncated_normal_moments(loc, scale, intervals):
+    """
+    Closed form conditional first and second moments of N(loc, scale^2) truncated 
+    to a union of disjoint one dimensional intervals. The interval masses are computed 
+    in log space, so predictions deep in the tails of the truncation set remain stable.
+    Args: 
+        loc (torch.Tensor) : B x 1 predictions
+        scale (float or torch.Tensor) : standard deviation of the noise distribution
+        intervals (delphi.utils.helpers.Bounds) : (k,) sorted, disjoint lower and upper bounds
+    Returns: 
+        Tuple with the B x 1 conditional means and second moments
+    """
+    # work in double precision, the tails cancel catastrophically in single precision
+    dtype, loc = loc.dtype, loc.double()
+    scale = scale.double() if isinstance(scale, Tensor) else scale
+    lower, upper = intervals.lower.to(loc), intervals.upper.to(loc)
+    # standardize interval endpoints, B x k
+    a, b = (lower - loc) / scale, (upper - loc) / scale
+    # log probability mass of each interval and of the whole truncation set
+    log_mass = log_ndtr_diff(a, b)
+    log_alpha = ch.logsumexp(log_mass, dim=-1, keepdim=True)
+    # standard normal densities at the endpoints, relative to the truncation set's mass
+    pdf_a = ch.exp(-.5 * a.pow(2) - LOG_SQRT_2PI - log_alpha)
+    pdf_b = ch.exp(-.5 * b.pow(2) - LOG_SQRT_2PI - log_alpha)
+    mean = loc + scale * (pdf_a - pdf_b).sum(dim=-1, keepdim=True)
+    # E[z^2] = scale^2 + loc * E[z] + scale * sum(lower * pdf_a - upper * pdf_b), written with the unstandardized 
+    # endpoints to avoid cancellation in the tails; infinite endpoints have zero density
+    lower, upper = lower.expand_as(a), upper.expand_as(b)
+    boundary = (ch.where(ch.isinf(lower), ch.zeros_like(a), lower * pdf_a) - ch.where(ch.isinf(upper), ch.zeros_like(b), upper * pdf_b)).sum(dim=-1, keepdim=True)
+    return mean.to(dtype), (scale ** 2 + loc * mean + scale * boundary).to(dtype)
+
+
+def log_ndtr_diff(a, b):
+    """
+    Computes log(Phi(b) - Phi(a)) for a <= b, where Phi is the standard normal CDF. Intervals in the 
+    right tail are reflected into the left tail, where log_ndtr is accurate.
+    """
+    flip = a > 0
+    lower, upper = ch.where(flip, -b, a), ch.where(flip, -a, b)
+    log_upper, log_lower = log_ndtr(upper), log_ndtr(lower)
+    return log_upper + log1mexp(log_lower - log_upper)
+
+
+def log1mexp(x):
+    """
+    Computes log(1 - exp(x)) for x <= 0.
+    """
+    return ch.where(x > -math.log(2), ch.log(-ch.expm1(x)), ch.log1p(-ch.exp(x)))
@@ -0,0 +1,136 @@
+"""
+Bit-packed membership masks for the Monte Carlo gradient estimators in delphi.grad.
+"""
+
+import torch as ch
+
+
+# number of samples (a multiple of 8) per oracle call when packing an oracle's mask
+PACK_CHUNK = 16
+
+
+class PackedMask:
+    """
+    Membership mask packed along its leading (sample) dimension into uint8 bitsets,
+    bit b of byte i holds sample 8 * i + b. A num_samples x ... mask takes up
+    ceil(num_samples / 8) x ... bytes, instead of num_samples x ... floats, and the
+    masked reductions over the samples work on one bit plane (every eighth sample) at
+    a time, so that they never allocate more than an eighth of the values' size.
+    """
+    def __init__(self, mask):
+        """
+        Args:
+            mask (torch.Tensor) : num_samples x ... bool or {0, 1} mask
+        """
+        self.num_samples = mask.size(0)
+        self.bits = ch.zeros(((self.num_samples + 7) // 8,) + mask.size()[1:], dtype=ch.uint8, device=mask.device)
+        for b in range(min(8, self.num_samples)):
+            plane = mask[b::8]
+            self.bits[:plane.size(0)] |= plane.bool().to(ch.uint8) << b
+
+    @classmethod
+    def zeros(cls, num_samples, size, device=None):
+        """
+        Empty num_samples x size mask.
+        """
+        out = cls.__new__(cls)
+        out.num_samples = num_samples
+        out.bits = ch.zeros(((num_samples + 7) // 8,) + tuple(size), dtype=ch.uint8, device=device)
+        return out
+
+    def plane(self, b):
+        """
+        Bool mask of samples b, b + 8, b + 16, ...
+        """
+        return ((self.bits[:(self.num_samples - b + 7) // 8] >> b) & 1).bool()
+
+    def sum(self, values, power=1):
+        """
+        Masked sum of values (or of their power) over the samples, fused per bit plane.
+        Args:
+            values (torch.Tensor) : num_samples x ... values, broadcastable with the mask
+            power (int) : power of the values to sum
+        """
+        out = None
+        for b in range(min(8, self.num_samples)):
+            values_ = values[b::8] if power == 1 else values[b::8].pow(power)
+            sum_ = ch.where(self.plane(b), values_, ch.zeros((), dtype=values.dtype, device=values.device)).sum(0)
+            out = sum_ if out is None else out.add_(sum_)
+        return out
+
+    def count(self):
+        """
+        Number of samples in the mask, ie. its popcount over the samples.
+        """
+        out = None
+        for b in range(min(8, self.num_samples)):
+            count_ = self.plane(b).sum(0)
+            out = count_ if out is None else out.add_(count_)
+        return out
+
+    def unpack(self):
+        """
+        num_samples x ... bool mask.
+        """
+        mask = ch.empty((self.num_samples,) + self.bits.size()[1:], dtype=ch.bool, device=self.bits.device)
+        for b in range(min(8, self.num_samples)):
+            mask[b::8] = self.plane(b)
+        return mask
+
+    @property
+    def nbytes(self):
+        return self.bits.numel() * self.bits.element_size()
+
+
+def pack_mask(mask, packed=True):
+    """
+    Packs a mask, if packed is set. The mask has already been built at full size (and at the 
+    oracle's dtype, ie. int64 for Interval or float for DNNLower), so the peak memory still 
+    includes it; pack_oracle never builds the full mask.
+    """
+    return PackedMask(mask) if packed else mask
+
+
+def pack_oracle(oracle_, x, packed=True, chunk_size=PACK_CHUNK):
+    """
+    Membership mask of the num_samples x ... samples x, packed if packed is set. A packed mask is 
+    built from chunks of chunk_size samples along the leading dimension, each evaluated by the 
+    oracle, converted to bool and packed before the next one, so that the peak memory is the 
+    samples plus one chunk's mask at the oracle's dtype (chunk_size / num_samples of the full 
+    mask) and the ceil(num_samples / 8) x ... packed bits.
+    Args:
+        oracle_ (Callable) : membership oracle
+        x (torch.Tensor) : num_samples x ... samples
+        packed (bool) : pack the mask
+        chunk_size (int) : number of samples per oracle call, rounded up to a multiple of 8
+    """
+    if not packed:
+        return oracle_(x)
+    chunk_size = max(8, -(-chunk_size // 8) * 8)
+    out = None
+    for start in range(0, x.size(0), chunk_size):
+        chunk = PackedMask(oracle_(x[start:start + chunk_size]).bool())
+        if out is None:
+            out = PackedMask.zeros(x.size(0), chunk.bits.size()[1:], x.device)
+        out.bits[start // 8:start // 8 + chunk.bits.size(0)] = chunk.bits
+    return out
+
+
+def masked_sum(values, mask, power=1):
+    """
+    Sum of values (or of their power) over the leading dimension where mask is set, for
+    full or packed masks.
+    """
+    if isinstance(mask, PackedMask):
+        return mask.sum(values, power)
+    values = values if power == 1 else values.pow(power)
+    return (values * mask).sum(0)
+
+
+def masked_count(mask):
+    """
+    Number of set entries over the leading dimension, for full or packed masks.
+    """
+    if isinstance(mask, PackedMask):
+        return mask.count()
+    return mask.sum(0)
@@ -0,0 +1,214 @@
+"""
+Noise sources for the Monte Carlo gradient estimators in delphi.grad.
+"""
+
+import torch as ch
+from torch import Tensor
+from torch.distributions import Gumbel
+from torch.quasirandom import SobolEngine
+from torch.special import ndtri
+from scipy.stats import qmc
+from abc import ABC, abstractmethod
+
+from .utils.helpers import logistic
+
+
+class noise(ABC):
+    """
+    Noise source for the gradient estimators. Subclasses generate uniform samples
+    that are mapped through the inverse CDFs of the noise distributions.
+    """
+    @abstractmethod
+    def uniform(self, size, device=None):
+        """
+        Uniform samples on (0, 1).
+        Args:
+            size (torch.Size) : num_samples x ... size of the samples
+            device (str) : device to put the samples on
+        """
+        pass
+
+    def normal(self, size, device=None):
+        """
+        Standard normal samples.
+        """
+        return ndtri(self.uniform(size, device))
+
+    def gumbel(self, size, device=None):
+        """
+        Standard gumbel samples.
+        """
+        return -ch.log(-ch.log(self.uniform(size, device)))
+
+    def logistic(self, size, device=None):
+        """
+        Standard logistic samples.
+        """
+        u = self.uniform(size, device)
+        return ch.log(u) - ch.log1p(-u)
+
+
+class PseudoRandom(noise):
+    """
+    I.i.d. pseudo-random noise, the default noise source.
+    """
+    def uniform(self, size, device=None):
+        return ch.rand(size, device=device)
+
+    def normal(self, size, device=None):
+        return ch.randn(size, device=device)
+
+    def gumbel(self, size, device=None):
+        return Gumbel(0, 1).sample(size).to(device)
+
+    def logistic(self, size, device=None):
+        return logistic.sample(size).to(device)
+
+    def __str__(self):
+        return 'iid'
+
+
+class QuasiRandom(noise):
+    """
+    Randomized quasi-Monte Carlo noise. The num_samples draws for each element of a
+    batch are a low discrepancy point set over the last dimension (ie. the logits for
+    the multi-class estimators), randomly shifted modulo 1 (Cranley-Patterson rotation),
+    so that every element gets an independent, unbiased point set.
+    """
+    def uniform(self, size, device=None):
+        size = ch.Size(size)
+        num_samples, trailing = size[0], size[-1:] if len(size) > 1 else ch.Size([])
+        points = self.points(num_samples, trailing.numel()).reshape((num_samples,) + (1,) * (len(size) - 2) + trailing)
+        shift = ch.rand(size[1:])
+        u = ch.frac(points + shift[None, ...])
+        # keep away from 0 and 1, where the inverse CDFs diverge
+        eps = ch.finfo(u.dtype).eps
+        return ch.clamp(u, eps, 1 - eps).to(device)
+
+    @abstractmethod
+    def points(self, n, d):
+        """
+        Scrambled low discrepancy point set.
+        Args:
+            n (int) : number of points
+            d (int) : dimension of the points
+        Returns:
+            n x d tensor in [0, 1)
+        """
+        pass
+
+
+class Sobol(QuasiRandom):
+    """
+    Scrambled Sobol sequence noise.
+    """
+    def points(self, n, d):
+        return SobolEngine(d, scramble=True, seed=int(ch.randint(2 ** 31, (1,)))).draw(n)
+
+    def __str__(self):
+        return 'sobol'
+
+
+class Halton(QuasiRandom):
+    """
+    Scrambled Halton sequence noise.
+    """
+    def points(self, n, d):
+        return Tensor(qmc.Halton(d, scramble=True, seed=int(ch.randint(2 ** 31, (1,)))).random(n))
+
+    def __str__(self):
+        return 'halton'
+
+
+class NoiseBank(noise):
+    """
+    Reusable bank of noise draws. The bank keeps one pool of draws for every distribution,
+    event size (the last dimension of the samples) and device, that holds rotations x
+    num_samples draws for each element of the batch, and serves consecutive slices of the
+    pool along the sample dimension, wrapping around at its end, so the hot loop does not
+    generate fresh noise every step. The pool grows by appending draws when a call needs more
+    samples or more elements than it holds, so that the draws it already holds are kept, and
+    every batch size gets a prefix of the same draws. Rewinding the bank before an evaluation
+    serves the same draws to every evaluation, ie. common random numbers, so that estimates
+    at different iterates are comparable. The samples may be views into the pool and must not
+    be modified in place.
+    """
+    def __init__(self, noise_=None, rotations=8):
+        """
+        Args:
+            noise_ (str or delphi.noise.noise) : noise source that fills the pools
+            rotations (int) : number of num_samples sized slices held in each pool
+        """
+        self.noise_ = make_noise(noise_)
+        self.rotations = rotations
+        self._pools, self._offsets = {}, {}
+
+    def _draw(self, dist, size, device):
+        size = ch.Size(size)
+        event = size[-1:] if len(size) > 1 else ch.Size([])
+        elements = size[1:len(size) - len(event)].numel()
+        key = (dist, event, str(device))
+        sample = getattr(self.noise_, dist)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = sample(ch.Size([self.rotations * size[0], elements]) + event, device)
+        # append draws for new elements, and then for new samples of every element
+        if pool.size(1) < elements:
+            pool = ch.cat([pool, sample(ch.Size([pool.size(0), elements - pool.size(1)]) + event, device)], 1)
+        if pool.size(0) < self.rotations * size[0]:
+            pool = ch.cat([pool, sample(ch.Size([self.rotations * size[0] - pool.size(0), pool.size(1)]) + event, device)], 0)
+        self._pools[key] = pool
+        offset = self._offsets.get(key, 0)
+        # wrap around to the start of the pool
+        if offset + size[0] > pool.size(0):
+            offset = 0
+        self._offsets[key] = offset + size[0]
+        return pool[offset:offset + size[0], :elements].reshape(size)
+
+    def rewind(self):
+        """
+        Serve the pools from their start again.
+        """
+        self._offsets = {key: 0 for key in self._offsets}
+
+    def refresh(self):
+        """
+        Discard the pools, so that the next calls draw fresh noise.
+        """
+        self._pools, self._offsets = {}, {}
+
+    def uniform(self, size, device=None):
+        return self._draw('uniform', size, device)
+
+    def normal(self, size, device=None):
+        return self._draw('normal', size, device)
+
+    def gumbel(self, size, device=None):
+        return self._draw('gumbel', size, device)
+
+    def logistic(self, size, device=None):
+        return self._draw('logistic', size, device)
+
+    def __str__(self):
+        return 'bank({})'.format(self.noise_)
+
+
+NOISE = {
+    'iid': PseudoRandom,
+    'sobol': Sobol,
+    'halton': Halton,
+}
+
+
+def make_noise(noise_):
+    """
+    Returns a noise source from its name ('iid', 'sobol', or 'halton') or
+    a noise instance; None defaults to i.i.d. pseudo-random noise.
+    """
+    if noise_ is None:
+        return PseudoRandom()
+    if isinstance(noise_, noise):
+        return noise_
+    if noise_ not in NOISE:
+        raise ValueError("noise must be one of {}, or a delphi.noise.noise instance".format(list(NOISE.keys())))
+    return NOISE[noise_]()
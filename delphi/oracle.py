@@ -1,19 +1,28 @@
 import warnings
 import torch as ch
 from torch import Tensor
-from torch.distributions.multivariate_normal import MultivariateNormal, _batch_mahalanobis
+from torch.distributions.multivariate_normal import MultivariateNormal
+from torch.func import vmap
 from abc import ABC
-from decimal import Decimal
-from orthnet import Hermite
+from concurrent.futures import ThreadPoolExecutor
 import math
+import os
+import io
+import dill
 
 from .utils.helpers import Bounds
 
 
+# relative evaluation cost of an oracle per sample, the combinators evaluate cheaper oracles first
+DEFAULT_COST = 1.0
+
+
 class oracle(ABC):
     """
     Oracle for data sets.
     """
+    cost = DEFAULT_COST
+
     def __call__(self, x):
         """
         Membership oracle.
@@ -22,6 +31,15 @@ class oracle(ABC):
         """
         pass
 
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
 
 class Interval:
     """
@@ -32,22 +50,61 @@ class Interval:
         self.bounds = Bounds(lower, upper)
 
     def __call__(self, x):
-        return ((self.bounds.lower < x).prod(-1) * (x < self.bounds.upper).prod(-1))
+        lower, upper = constant(self.bounds.lower, x), constant(self.bounds.upper, x)
+        return ((lower < x).prod(-1) * (x < upper).prod(-1))
+
+    @property
+    def intervals(self):
+        """
+        Truncation set as sorted disjoint one dimensional intervals, None for vector intervals.
+        """
+        lower, upper = ch.as_tensor(self.bounds.lower, dtype=ch.float).flatten(), ch.as_tensor(self.bounds.upper, dtype=ch.float).flatten()
+        if lower.nelement() != 1 or upper.nelement() != 1:
+            return None
+        return Bounds(lower, upper)
 
 
 class KIntervalUnion(oracle):
     """
     Receives an iterable of tuples that contain a lower, upper bound tensor.
+    One dimensional unions are merged into sorted disjoint intervals at construction, 
+    so that membership is one torch.searchsorted call. Unions of vector intervals (boxes) 
+    are checked with one broadcast against the stacked bounds.
     """
+    # one searchsorted or broadcast over the stacked bounds
+    cost = 2.0
 
     def __init__(self, intervals):
         self.oracles = [Interval(int_[0], int_[1]) for int_ in intervals]
+        # merge one dimensional unions into sorted disjoint intervals
+        bounds = [oracle_.intervals for oracle_ in self.oracles]
+        self._intervals, self.bounds = None, None
+        if len(bounds) > 0 and all(bounds_ is not None for bounds_ in bounds):
+            self._intervals = merge_intervals(ch.cat([bounds_.lower for bounds_ in bounds]),
+                                              ch.cat([bounds_.upper for bounds_ in bounds]))
+        elif len(self.oracles) > 0:
+            # k x d stacked box bounds
+            self.bounds = Bounds(ch.stack(ch.broadcast_tensors(*[ch.as_tensor(oracle_.bounds.lower, dtype=ch.float) for oracle_ in self.oracles])),
+                                 ch.stack(ch.broadcast_tensors(*[ch.as_tensor(oracle_.bounds.upper, dtype=ch.float) for oracle_ in self.oracles])))
 
     def __call__(self, x):
-        result = Tensor([])
-        for oracle_ in self.oracles:
-            result = ch.logical_or(result, oracle_(x)) if result.nelement() > 0 else oracle_(x)
-        return result[..., None]
+        if self._intervals is not None:
+            lower, upper = self._intervals.lower.to(x), self._intervals.upper.to(x)
+            # index of the last interval that starts below each sample
+            idx = ch.searchsorted(lower, x.contiguous()) - 1
+            return (idx >= 0) & (x < upper[idx.clamp(min=0)])
+        if self.bounds is None:
+            return ch.zeros(x.size()[:-1] + (1,), dtype=ch.bool, device=x.device)
+        lower, upper = self.bounds.lower.to(x), self.bounds.upper.to(x)
+        x = x[..., None, :]
+        return ((lower < x) & (x < upper)).all(-1).any(-1)[..., None]
+
+    @property
+    def intervals(self):
+        """
+        Truncation set as sorted disjoint one dimensional intervals, None for unions of vector intervals.
+        """
+        return self._intervals
 
     def __str__(self): 
         return 'k-interval union'
@@ -66,7 +123,15 @@ class Left(oracle):
         self.left = left
 
     def __call__(self, x): 
-        return x > self.left
+        return x > constant(self.left, x)
+
+    @property
+    def intervals(self):
+        """
+        Truncation set as a one dimensional interval, None for vector truncation.
+        """
+        left = ch.as_tensor(self.left, dtype=ch.float).flatten()
+        return Bounds(left, ch.full_like(left, float('inf'))) if left.nelement() == 1 else None
 
     def __str__(self): 
         return 'left'
@@ -85,7 +150,15 @@ class Right(oracle):
         self.right = right
 
     def __call__(self, x): 
-        return x < self.right
+        return x < constant(self.right, x)
+
+    @property
+    def intervals(self):
+        """
+        Truncation set as a one dimensional interval, None for vector truncation.
+        """
+        right = ch.as_tensor(self.right, dtype=ch.float).flatten()
+        return Bounds(ch.full_like(right, float('-inf')), right) if right.nelement() == 1 else None
 
     def __str__(self): 
         return 'right'
@@ -93,13 +166,58 @@ class Right(oracle):
 
 class Lambda(oracle):   
     """
-    Lambda function oracle. Takes in a lambda function/callable that can be applied to one [n,] sized sample as pytorch tensor
+    Lambda function oracle. Takes in a lambda function/callable that can be applied to one [n,] sized sample as pytorch tensor.
+    The lambda is first vectorized over the samples with torch.func.vmap, so that it runs as one batched op. Lambdas 
+    that can not be vectorized (ie. python control flow on tensor values, like the horseshoe and triangle lambdas below) 
+    fall back to evaluating chunks of samples in a thread pool. The path taken is recorded in path ('vmap' or 'threads').
     """
-    def __init__(self, lambda_): 
+    # python function, possibly evaluated row by row
+    cost = 10.0
+
+    def __init__(self, lambda_, chunk_size=None, workers=None): 
+        """
+        Args: 
+            lambda_ (callable) : membership function for one sample
+            chunk_size (int) : number of samples evaluated at once by vmap and by each thread, None evaluates 
+                all samples at once with vmap and splits them evenly between the threads
+            workers (int) : number of threads for the fallback path, defaults to the thread pool's default
+        """
         self.lambda_ = lambda_
+        self.chunk_size = chunk_size
+        self.workers = workers
+        # evaluation path, None until the first call
+        self.path = None
     
     def __call__(self, x):
-        return ch.cat([self.lambda_(x[i]).unsqueeze(0) for i in range(x.size(0))])
+        if self.path != 'threads':
+            try:
+                result = vmap(self.lambda_, chunk_size=self.chunk_size)(x)
+                self.path = 'vmap'
+                return result
+            except Exception as e:
+                # only fall back, if the lambda has never been vectorized
+                if self.path == 'vmap':
+                    raise e
+                self.path = 'threads'
+                warnings.warn("lambda can not be vectorized with vmap ({}), falling back to threads".format(type(e).__name__))
+        return self._threaded(x)
+
+    def __getstate__(self):
+        # serialize the lambda by value, standard pickle can only serialize named module level functions
+        state = self.__dict__.copy()
+        state['lambda_'] = dill.dumps(self.lambda_, recurse=True)
+        return state
+
+    def __setstate__(self, state):
+        state['lambda_'] = dill.loads(state['lambda_'])
+        self.__dict__.update(state)
+
+    def _threaded(self, x):
+        workers = self.workers or min(32, (os.cpu_count() or 1) + 4)
+        chunk_size = self.chunk_size or max(1, math.ceil(x.size(0) / workers))
+        with ThreadPoolExecutor(workers) as executor:
+            chunks = executor.map(lambda chunk: ch.stack([ch.as_tensor(self.lambda_(x_)) for x_ in chunk]), x.split(chunk_size))
+            return ch.cat(list(chunks))
 
     def __str__(self): 
         return 'lambda'
@@ -107,52 +225,389 @@ class Lambda(oracle):
 
 class Sphere(oracle):
     """
-    Spherical truncation
+    Spherical truncation. The covariance matrices' inverse Cholesky factors are computed 
+    once, so that membership is a matmul against the whitened centroids and a comparison 
+    of squared distances. Stacked centroids and radii truncate to the union of the ellipsoids, 
+    which are all checked at once.
     """
+    # matmul per sample and ellipsoid
+    cost = 4.0
+
     def __init__(self, covariance_matrix, centroid, radius):
-        self._unbroadcasted_scale_tril = covariance_matrix.cholesky()
-        self.centroid = centroid
+        """
+        Args: 
+            covariance_matrix (torch.Tensor) : d x d covariance matrix, or m x d x d covariance matrices of m ellipsoids
+            centroid (torch.Tensor) : (d,) centroid, or m x d centroids of m ellipsoids
+            radius (float or torch.Tensor) : radius, or (m,) radii of m ellipsoids
+        A single centroid, covariance matrix or radius is broadcast to the m ellipsoids.
+        """
+        self.centroid = ch.as_tensor(centroid, dtype=ch.float)
         self.radius = radius
+        centroids = self.centroid.reshape(-1, self.centroid.size(-1))
+        scale_tril = ch.linalg.cholesky(ch.as_tensor(covariance_matrix, dtype=ch.float)).reshape(-1, centroids.size(-1), centroids.size(-1))
+        radii = ch.as_tensor(radius, dtype=ch.float).flatten()
+        # a single centroid, covariance matrix or radius is shared by all of the m ellipsoids
+        m, = ch.broadcast_shapes(centroids.size()[:1], scale_tril.size()[:1], radii.size())
+        # m x d x d inverse Cholesky factors, whitening x is (x - centroid) @ inv_scale_tril^T
+        eye = ch.eye(scale_tril.size(-1)).expand_as(scale_tril)
+        self._inv_scale_tril = ch.linalg.solve_triangular(scale_tril, eye, upper=False).expand(m, -1, -1)
+        # m x d whitened centroids and (m,) squared radii
+        self._whitened_centroid = (self._inv_scale_tril @ centroids.expand(m, -1)[..., None]).squeeze(-1)
+        self._radius_sq = radii.pow(2).expand(m)
 
     def __call__(self, x):
-        diff = x - self.centroid
-        dist = ch.sqrt(_batch_mahalanobis(self._unbroadcasted_scale_tril, diff))
-        return (dist < self.radius).float().flatten()
+        inv_scale_tril, whitened_centroid = self._inv_scale_tril.to(x), self._whitened_centroid.to(x)
+        # ... x m x d whitened differences to each centroid
+        diff = ch.einsum('mij,...j->...mi', inv_scale_tril, x) - whitened_centroid
+        return (diff.pow(2).sum(-1) < self._radius_sq.to(x)).any(-1).float().flatten()
 
     def __str__(self): 
         return 'sphere'
 
 
+class Polytope(oracle):
+    """
+    Polytope truncation, the set of samples x with Ax <= b. Membership is one matmul 
+    against the stacked constraints.
+    """
+    # matmul per sample and constraint
+    cost = 2.0
+
+    def __init__(self, A, b):
+        """
+        Args: 
+            A (torch.Tensor) : m x d constraint matrix
+            b (torch.Tensor) : (m,) constraint bounds
+        """
+        self.A = ch.as_tensor(A, dtype=ch.float)
+        self.b = ch.as_tensor(b, dtype=ch.float).flatten()
+
+    def __call__(self, x):
+        return (x @ self.A.T.to(x) <= self.b.to(x)).all(-1)
+
+    def __str__(self): 
+        return 'polytope'
+
+
+class Grid(oracle):
+    """
+    Lookup table oracle for low dimensional truncation sets. Rasterizes the membership of another 
+    oracle once onto a voxel grid over a bounding box, by checking each cell's corners and center, 
+    so that membership is a floor and an integer index into the table. Cells where the checks 
+    disagree straddle the truncation set's boundary; with exact_boundary, samples in those cells 
+    (and outside of the box) are passed to the original oracle, so that the answers are exact for 
+    sets whose features are larger than a cell. Otherwise, boundary cells take their majority vote, 
+    so that errors are confined to within one cell diagonal of the boundary, and samples outside 
+    of the box are rejected.
+    """
+    # floor and index per sample
+    cost = 1.5
+    # table code of the cells that straddle the boundary
+    BOUNDARY = 2
+
+    def __init__(self, oracle_, lower, upper, resolution=64, exact_boundary=True, chunk_size=2 ** 20):
+        """
+        Args: 
+            oracle_ (delphi.oracle.oracle) : oracle to rasterize, which must check samples row-wise, ie. Lambda(horseshoe)
+            lower (torch.Tensor) : (d,) lower corner of the grid's bounding box
+            upper (torch.Tensor) : (d,) upper corner of the grid's bounding box
+            resolution (int or tuple) : number of cells along each dimension
+            exact_boundary (bool) : pass the samples in boundary cells and outside of the box to oracle_
+            chunk_size (int) : number of grid points rasterized at once
+        """
+        self.oracle = oracle_
+        self.lower, self.upper = ch.as_tensor(lower, dtype=ch.float).flatten(), ch.as_tensor(upper, dtype=ch.float).flatten()
+        d = self.lower.size(0)
+        self.resolution = ch.as_tensor(resolution, dtype=ch.long).expand(d).clone()
+        self.cell = (self.upper - self.lower) / self.resolution
+        self.exact_boundary = exact_boundary
+        # row major strides into the flattened table
+        self.strides = ch.cat([ch.cumprod(self.resolution.flip(0), 0).flip(0)[1:], ch.ones(1, dtype=ch.long)])
+
+        # memberships of the cell corners and centers
+        corners = self._rasterize(self.resolution + 1, self.lower, chunk_size)
+        centers = self._rasterize(self.resolution, self.lower + self.cell / 2, chunk_size)
+        # sum of the memberships of each cell's 2^d corners
+        votes, count = corners.to(ch.int32), 2 ** d
+        for dim in range(d):
+            votes = votes.narrow(dim, 0, votes.size(dim) - 1) + votes.narrow(dim, 1, votes.size(dim) - 1)
+        votes, count = votes + centers.to(ch.int32), count + 1
+        # 0 outside, 1 inside, BOUNDARY if the checks disagree
+        self.table = ch.where(votes == count, 1, 0).to(ch.uint8)
+        boundary = (votes > 0) & (votes < count)
+        self.table[boundary] = Grid.BOUNDARY if exact_boundary else (2 * votes[boundary] > count).to(ch.uint8)
+        self.table = self.table.flatten()
+
+    def _rasterize(self, size, start, chunk_size):
+        """
+        Membership of the size[0] x ... x size[d - 1] grid of points start + i * cell.
+        """
+        n = int(size.prod())
+        out = ch.empty(n, dtype=ch.bool)
+        strides = ch.cat([ch.cumprod(size.flip(0), 0).flip(0)[1:], ch.ones(1, dtype=ch.long)])
+        for begin in range(0, n, chunk_size):
+            idx = ch.arange(begin, min(begin + chunk_size, n))
+            points = start + ((idx[:, None] // strides) % size) * self.cell
+            out[begin:begin + idx.size(0)] = row_mask(self.oracle, points)
+        return out.reshape(tuple(size.tolist()))
+
+    def __call__(self, x):
+        rows = x.reshape(-1, x.size(-1))
+        lower, cell = self.lower.to(rows), self.cell.to(rows)
+        idx = ch.floor((rows - lower) / cell).long()
+        inside = ((idx >= 0) & (idx < self.resolution.to(idx.device))).all(-1)
+        codes = self.table.to(idx.device)[(idx.clamp(min=0) * self.strides.to(idx.device)).sum(-1).clamp(max=self.table.size(0) - 1)]
+        codes = ch.where(inside, codes, ch.full_like(codes, Grid.BOUNDARY if self.exact_boundary else 0))
+        result = codes == 1
+        if self.exact_boundary:
+            undecided = (codes == Grid.BOUNDARY).nonzero(as_tuple=True)[0]
+            if undecided.nelement() > 0:
+                result[undecided] = row_mask(self.oracle, rows[undecided])
+        return result.reshape(x.size()[:-1])
+
+    def __str__(self): 
+        return 'grid'
+
+
+class And(oracle):
+    """
+    Intersection of truncation sets. The oracles are evaluated from cheapest to most 
+    expensive (by their cost attribute), and each oracle only checks the samples that 
+    all of the previous oracles accepted. The oracles must check each sample (row along 
+    the last dimension) independently of the others, and return a membership mask, or have 
+    a mask method if they do not (see row_mask).
+    """
+    def __init__(self, *oracles):
+        """
+        Args: 
+            oracles (delphi.oracle.oracle) : oracles to intersect
+        """
+        self.oracles = sorted(oracles, key=lambda oracle_: getattr(oracle_, 'cost', DEFAULT_COST))
+        self.cost = sum(getattr(oracle_, 'cost', DEFAULT_COST) for oracle_ in self.oracles)
+
+    def __call__(self, x):
+        return short_circuit(self.oracles, x, False)
+
+    def __str__(self): 
+        return '(' + ' and '.join(str(oracle_) for oracle_ in self.oracles) + ')'
+
+
+class Or(oracle):
+    """
+    Union of truncation sets. The oracles are evaluated from cheapest to most 
+    expensive (by their cost attribute), and each oracle only checks the samples that 
+    all of the previous oracles rejected. The oracles must check each sample (row along 
+    the last dimension) independently of the others, and return a membership mask, or have 
+    a mask method if they do not (see row_mask).
+    """
+    def __init__(self, *oracles):
+        """
+        Args: 
+            oracles (delphi.oracle.oracle) : oracles to unite
+        """
+        self.oracles = sorted(oracles, key=lambda oracle_: getattr(oracle_, 'cost', DEFAULT_COST))
+        self.cost = sum(getattr(oracle_, 'cost', DEFAULT_COST) for oracle_ in self.oracles)
+
+    def __call__(self, x):
+        return short_circuit(self.oracles, x, True)
+
+    def __str__(self): 
+        return '(' + ' or '.join(str(oracle_) for oracle_ in self.oracles) + ')'
+
+
+class Not(oracle):
+    """
+    Complement of a truncation set. The oracle must return a membership mask, or have a 
+    mask method if it does not (see row_mask).
+    """
+    def __init__(self, oracle_):
+        """
+        Args: 
+            oracle_ (delphi.oracle.oracle) : oracle to complement
+        """
+        self.oracle = oracle_
+        self.cost = getattr(oracle_, 'cost', DEFAULT_COST)
+
+    def __call__(self, x):
+        return ~row_mask(self.oracle, x.reshape(-1, x.size(-1))).reshape(x.size()[:-1] + (1,))
+
+    def __str__(self): 
+        return 'not ' + str(self.oracle)
+
+
+class Compiled(oracle):
+    """
+    TorchScript compiled oracle. Traces an oracle on an example input into a TorchScript module, 
+    which runs without the python interpreter and serializes with torch.jit.save, so that the 
+    compiled oracle can be pickled and shipped to worker processes. Only oracles without python 
+    control flow on tensor values can be traced; the trace is checked against the original oracle 
+    on the reordered example input.
+    """
+    def __init__(self, oracle_, example):
+        """
+        Args: 
+            oracle_ (delphi.oracle.oracle) : oracle to compile
+            example (torch.Tensor) : example input with the layout of the inputs the oracle will be called on
+        """
+        self.oracle = oracle_
+        self.cost = getattr(oracle_, 'cost', DEFAULT_COST)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', ch.jit.TracerWarning)
+            self.module = ch.jit.trace(OracleModule(oracle_), example, check_trace=False)
+        # values that the trace baked in as constants show up on a reordered input
+        check = example[ch.randperm(example.size(0), device=example.device)]
+        if not ch.equal(self.module(check), ch.as_tensor(oracle_(check))):
+            raise ValueError("traced oracle does not match {}, it can not be compiled".format(oracle_))
+
+    def __call__(self, x):
+        return self.module(x)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        buffer = io.BytesIO()
+        ch.jit.save(self.module, buffer)
+        state['module'] = buffer.getvalue()
+        return state
+
+    def __setstate__(self, state):
+        state['module'] = ch.jit.load(io.BytesIO(state['module']), map_location='cpu')
+        self.__dict__.update(state)
+
+    def __str__(self): 
+        return 'compiled ' + str(self.oracle)
+
+
+class OracleModule(ch.nn.Module):
+    """
+    Module wrapper of an oracle, for tracing.
+    """
+    def __init__(self, oracle_):
+        super().__init__()
+        self.oracle = oracle_
+
+    def forward(self, x):
+        return ch.as_tensor(self.oracle(x))
+
+
+def constant(value, x):
+    """
+    Oracle constant on the device of the samples x, so that oracles built on one device 
+    can be evaluated on any other.
+    """
+    return value.to(x.device) if isinstance(value, Tensor) else value
+
+
+def row_mask(oracle_, rows):
+    """
+    Membership of each row of a n x d tensor as a (n,) bool tensor. Oracles that return 
+    more than one value per row (ie. elementwise truncation) accept a row if they accept 
+    all of its entries. Oracles whose call does not return a mask, ie. UnknownGaussian, 
+    which returns the accepted rows, must have a mask method, which is used instead; any 
+    other oracle whose call does not return one value (or one per entry) per row is rejected.
+    """
+    mask = getattr(oracle_, 'mask', None)
+    if callable(mask):
+        return mask(rows).reshape(rows.size(0)).bool()
+    out = oracle_(rows)
+    if out.dim() == 0 or out.size(0) != rows.size(0):
+        raise ValueError("oracle {} does not return a membership mask for each row, give it a mask method".format(oracle_))
+    return out.reshape(rows.size(0), -1).bool().all(-1)
+
+
+def short_circuit(oracles, x, decided):
+    """
+    Evaluates the oracles in order on the undecided samples, a sample is decided once an 
+    oracle returns decided for it.
+    Args: 
+        oracles (list) : oracles in evaluation order
+        x (torch.Tensor) : ... x d samples
+        decided (bool) : value that decides a sample, True for unions and False for intersections
+    Returns: 
+        ... x 1 bool membership mask
+    """
+    rows = x.reshape(-1, x.size(-1))
+    result = ch.full((rows.size(0),), not decided, dtype=ch.bool, device=x.device)
+    undecided = ch.arange(rows.size(0), device=x.device)
+    for oracle_ in oracles:
+        if undecided.nelement() == 0:
+            break
+        done = row_mask(oracle_, rows[undecided]) == decided
+        result[undecided[done]] = decided
+        undecided = undecided[~done]
+    return result.reshape(x.size()[:-1] + (1,))
+
+
+def merge_intervals(lower, upper):
+    """
+    Sorts one dimensional intervals and merges the overlapping ones. The intervals are open, 
+    so intervals that only touch, ie. (0, 1) and (1, 2), stay disjoint and their shared 
+    endpoint stays outside of the union.
+    Args: 
+        lower (torch.Tensor) : (k,) lower bounds
+        upper (torch.Tensor) : (k,) upper bounds
+    Returns: 
+        delphi.utils.helpers.Bounds with the sorted, disjoint intervals
+    """
+    order = lower.argsort()
+    lower, upper = lower[order], upper[order]
+    reach = upper.cummax(0).values
+    # an interval starts a new group if it begins at or after the end of all of the previous intervals
+    start = ch.ones_like(lower, dtype=ch.bool)
+    start[1:] = lower[1:] >= reach[:-1]
+    end = ch.cat([start[1:], ch.ones(1, dtype=ch.bool)])
+    return Bounds(lower[start], reach[end])
+
+
 # LAMBDA FUNCTIONS TRIED
+# defined as functions, so that they pickle by reference
 #  2D DIMENSIONAL GAUSSIAN LAMBDA FUNCTIONS
-set_two_d = lambda x: (x[1].pow(2) + x[0].pow(2) > .5)
-horseshoe = lambda x: x[0] > 0 and x[0] ** 2 + x[1] ** 2 > 1 and x[0] ** 2 + x[1] ** 2 < 2
-horseshoe_dot = lambda x: x[0] > 0 and 1 < x.pow(2).sum() < 2 or ((x[0] - .5).pow(2) + x[1].pow(2)) < (1 / 6)
-triangle = lambda x: x[1] >= 0 and x[1] <= +x[0] + 1 and x[1] <= 1 - x[0] and not (
+def set_two_d(x):
+    return (x[1].pow(2) + x[0].pow(2) > .5)
+
+
+def horseshoe(x):
+    return x[0] > 0 and x[0] ** 2 + x[1] ** 2 > 1 and x[0] ** 2 + x[1] ** 2 < 2
+
+
+def horseshoe_dot(x):
+    return x[0] > 0 and 1 < x.pow(2).sum() < 2 or ((x[0] - .5).pow(2) + x[1].pow(2)) < (1 / 6)
+
+
+def triangle(x):
+    return x[1] >= 0 and x[1] <= +x[0] + 1 and x[1] <= 1 - x[0] and not (
             (x[0] / 2) ** 2 + (x[1] - 0.52) ** 2 <= 0.02)
+
+
 # 3D DIMENSIONAL GAUSSIAN LAMBDA FUNCTIONS
-three_d_union_check = lambda x: x[0] > 0 and x[2] > 0 or x.pow(2).sum() < 1.0
+def three_d_union_check(x):
+    return x[0] > 0 and x[2] > 0 or x.pow(2).sum() < 1.0
 
 
 class UnknownGaussian(oracle):
     """
     Oracle that learns truncation set
     """
+    # two log densities and a degree d hermite expansion per sample
+    cost = 50.0
 
-    def __init__(self, emp_loc, emp_covariance_matrix, S, d):
+    def __init__(self, emp_loc, emp_covariance_matrix, S, d, chunk_size=None, dtype=ch.double):
+        """
+        Args: 
+            emp_loc (torch.Tensor) : empirical mean of the truncated samples
+            emp_covariance_matrix (torch.Tensor) : empirical covariance matrix of the truncated samples
+            S (torch.Tensor) : n x dim truncated samples
+            d (int) : degree of the hermite expansion
+            chunk_size (int) : number of samples per chunk of the hermite features, None evaluates all samples at once
+            dtype (torch.dtype) : precision of the hermite features, ch.float halves their memory
+        """
         # empirical estimates used for membership oracle
         self._emp_dist = MultivariateNormal(emp_loc, emp_covariance_matrix)
 
         self._d = d
-        # calculate the normalizing hermite polynomial constant for degree d
-        self._norm_const = Tensor([])
-        for i in range(self._d + 1):
-            try:
-                self._norm_const = ch.cat([self._norm_const, ch.sqrt(Tensor([math.factorial(i)]))])
-            except OverflowError:
-                self._norm_const = ch.cat([self._norm_const, Tensor([Decimal(math.factorial(i)) ** Decimal(.5)])])
-                warnings.warn("Overflow error: converting floats to Decimal")
-        self._norm_const = self._norm_const.unsqueeze(1)
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        # log of the normalizing hermite polynomial constants sqrt(j!) for j = 0, ..., d
+        self._log_norm_const = .5 * ch.lgamma(ch.arange(self._d + 1, dtype=ch.double) + 1)
 
         # truncation coefficient
         self._C_v = self.H_v(S).mean(0)
@@ -160,14 +615,45 @@ class UnknownGaussian(oracle):
         self._dist = None
 
     def __call__(self, x):
+        return x[self.mask(x).nonzero(as_tuple=False).flatten()]
+
+    def mask(self, x):
+        """
+        Membership of the n x dim samples as a (n,) bool mask. Unlike the oracle's call, which 
+        returns the accepted samples, the mask keeps one entry per sample, so the combinators 
+        (And, Or, Not) and row_mask query the oracle through it.
+        """
         if self.dist is None:
             raise Exception("must learn underlying distribution for membership oracle")
-        return x[((ch.exp(self.emp_dist.log_prob(x)) / ch.exp(self.dist.log_prob(x))) * self.psi_k(
-            x) > .5).flatten().nonzero(as_tuple=False).flatten()]
+        return ((ch.exp(self.emp_dist.log_prob(x)) / ch.exp(self.dist.log_prob(x))) * self.psi_k(x) > .5).flatten()
 
     # x - (n, d) matrix
     def H_v(self, x):
-        return ch.div(Hermite(x.unsqueeze(1).double(), self._d).tensor, self._norm_const).prod(2)
+        """
+        Normalized hermite features prod_k He_j(x_k) / sqrt(j!) for j = 0, ..., d, where He_j are the 
+        probabilists' hermite polynomials. The normalized polynomials h_j = He_j / sqrt(j!) follow the 
+        three term recurrence h_{j+1} = (x h_j - sqrt(j) h_{j-1}) / sqrt(j + 1), which never forms the 
+        factorials and only keeps two n x dim polynomials in memory at a time.
+        Args: 
+            x (torch.Tensor) : n x dim samples
+        Returns: 
+            n x (d + 1) features
+        """
+        x = x.to(self.dtype)
+        out = ch.empty(x.size(0), self._d + 1, dtype=self.dtype, device=x.device)
+        sqrt_j = ch.arange(self._d + 2, dtype=self.dtype).sqrt().tolist()
+        step = self.chunk_size or max(x.size(0), 1)
+        for start in range(0, x.size(0), step):
+            x_ = x[start:start + step]
+            out_ = out[start:start + x_.size(0)]
+            prev, curr = ch.ones_like(x_), x_
+            out_[:, 0] = 1.0
+            if self._d > 0:
+                out_[:, 1] = curr.prod(1)
+            for j in range(1, self._d):
+                prev, curr = curr, (x_ * curr - sqrt_j[j] * prev) / sqrt_j[j + 1]
+                out_[:, j + 1] = curr.prod(1)
+        return out
 
     def psi_k(self, x):
         """
@@ -193,7 +679,7 @@ class UnknownGaussian(oracle):
 
     @property
     def norm_const(self):
-        return self._norm_const
+        return ch.exp(self._log_norm_const).unsqueeze(1)
 
     @property
     def d(self):
@@ -211,7 +697,7 @@ class DNNLower(oracle):
         self.lower = lower
         
     def __call__(self, x): 
-        return (x > self.lower).float()
+        return (x > constant(self.lower, x)).float()
 
     def __str__(self): 
         return 'dnn lower'
@@ -222,7 +708,7 @@ class Identity(oracle):
     Identity membership oracle for DNNs. All logits are accepted within the truncation set.
     """
     def __call__(self, x): 
-        return ch.ones(x.size()).prod(-1, keepdim=True)
+        return ch.ones(x.size(), device=x.device).prod(-1, keepdim=True)
 
     def __str__(self): 
         return 'identity'
@@ -252,10 +738,10 @@ class LogitBallComplement:
     """
     def __init__(self, bound, temperature=ch.ones(1)): 
         self.bound = bound
-        self.temperature = temperature.cuda()
+        self.temperature = temperature
         
     def __call__(self, x): 
-        x_ = x / self.temperature
+        x_ = x / constant(self.temperature, x)
         return (x_.norm(dim=-1) >= self.bound)
 
     def __str__(self): 
@@ -0,0 +1,368 @@
+"""
+Samplers for the Monte Carlo gradient estimators in delphi.grad.
+"""
+
+import torch as ch
+from torch.nn.functional import logsigmoid
+from torch.special import log_ndtr, ndtri
+from scipy.optimize import linprog
+import numpy as np
+import math
+
+from . import grad
+from .noise import make_noise
+from .utils.helpers import Bounds
+
+
+class AdaptiveSampler:
+    """
+    Adaptive rejection sampler for the truncated regression gradients. Instead
+    of drawing a fixed number of noised copies for every prediction, the sampler
+    draws rounds of num_samples copies and keeps drawing only for the predictions
+    that have not yet reached target accepted copies, up to max_samples draws per
+    prediction. One dimensional interval oracles (those with intervals) are sampled
+    by inverse CDF instead, where every draw is accepted, so that target copies take
+    one round, however tight the intervals. Has the same signature as
+    delphi.grad.truncated_moments, so it can be passed to the criteria as the
+    sampler hyperparameter.
+    """
+    def __init__(self, target, max_samples):
+        """
+        Args:
+            target (int) : number of accepted copies to reach for each prediction
+            max_samples (int) : maximum number of copies drawn for each prediction
+        """
+        self.target = target
+        self.max_samples = max_samples
+        # realized acceptance counts and draws per prediction of the last call
+        self.counts, self.draws = None, None
+
+    def __call__(self, pred, scale, phi, num_samples, max_memory=None, second_moment=False, noise_=None, packed=False):
+        """
+        Args:
+            pred (torch.Tensor) : B x 1 predictions
+            scale (float or torch.Tensor) : standard deviation of the noise distribution
+            phi (delphi.oracle.oracle) : membership oracle
+            num_samples (int) : number of copies drawn per round for each unfinished prediction
+            max_memory (int) : memory budget in bytes for each chunk, None draws each round at once
+            second_moment (bool) : also accumulate the masked sum of squares
+            noise_ (delphi.noise.noise) : noise source, defaults to i.i.d. pseudo-random noise
+            packed (bool) : reduce with bit-packed masks
+        Returns:
+            Tuple with masked sum, masked sum of squares (None if second_moment is False)
+            and the number of accepted copies for each prediction
+        """
+        if getattr(phi, 'intervals', None) is not None:
+            # every inverse CDF draw is accepted, so one round reaches the target
+            num_samples = max(num_samples, min(self.target, self.max_samples))
+            z, z_sq, count = inverse_cdf_moments(pred, scale, phi, num_samples, max_memory, second_moment, noise_, packed)
+            self.counts = count.detach().clone()
+            self.draws = ch.full((pred.size(0),), num_samples, dtype=ch.long, device=pred.device)
+            return z, z_sq, count
+        z, count = ch.zeros_like(pred), ch.zeros_like(pred)
+        z_sq = ch.zeros_like(pred) if second_moment else None
+        draws = ch.zeros(pred.size(0), dtype=ch.long, device=pred.device)
+        # indices of the predictions that are still sampling
+        active = ch.arange(pred.size(0), device=pred.device)
+        while active.nelement() > 0:
+            z_, z_sq_, count_ = grad.truncated_moments(pred[active], scale, phi, num_samples, max_memory, second_moment, noise_, packed)
+            z.index_add_(0, active, z_)
+            count.index_add_(0, active, count_.to(count))
+            if second_moment:
+                z_sq.index_add_(0, active, z_sq_)
+            draws[active] += num_samples
+            done = (count[active] >= self.target).flatten(1).all(1) | (draws[active] >= self.max_samples)
+            active = active[~done]
+        self.counts, self.draws = count.detach().clone(), draws
+        return z, z_sq, count
+
+    def __str__(self):
+        return 'adaptive'
+
+
+class RejectionSampler:
+    """
+    Vectorized rejection sampler for a multivariate normal distribution truncated to the 
+    set of a membership oracle. The sampler keeps a running estimate of the acceptance 
+    rate and sizes each round, so that it fills the requested number of samples in about 
+    one pass. Rounds are capped at max_round samples, and a call stops with a ValueError 
+    once it has drawn max_num_samples samples without filling the request, ie. when the 
+    truncation set has (almost) no mass. Accepted samples are written into a preallocated 
+    buffer and the Cholesky factor of the covariance matrix is computed once per call.
+    """
+    def __init__(self, num_samples, slack=1.1, max_memory=None, max_round=None, max_num_samples=None):
+        """
+        Args: 
+            num_samples (int) : minimum number of samples drawn per round
+            slack (float) : multiplies each round's size, so that the round fills the buffer despite 
+                sampling variability in the number of accepted samples
+            max_memory (int) : memory budget in bytes for each round
+            max_round (int) : maximum number of samples drawn per round, defaults to 100 * num_samples
+            max_num_samples (int) : maximum number of samples drawn per call, defaults to 10000 * num_samples
+        """
+        self.num_samples = num_samples
+        self.slack = slack
+        self.max_memory = max_memory
+        self.max_round = max_round if max_round is not None else 100 * num_samples
+        self.max_num_samples = max_num_samples if max_num_samples is not None else 10000 * num_samples
+        # acceptance statistics accumulated across calls
+        self.accepted, self.drawn, self.rounds = 0, 0, 0
+
+    def __call__(self, loc, covariance_matrix, phi, n, noise_=None):
+        """
+        Args: 
+            loc (torch.Tensor) : (d,) mean of the normal distribution
+            covariance_matrix (torch.Tensor) : d x d covariance matrix of the normal distribution
+            phi (delphi.oracle.oracle) : membership oracle 
+            n (int) : number of samples to return
+            noise_ (delphi.noise.noise) : noise source, defaults to i.i.d. pseudo-random noise
+        Returns: 
+            n x d tensor of samples that fall within the truncation set
+        """
+        noise_ = make_noise(noise_)
+        scale_tril = ch.linalg.cholesky(covariance_matrix)
+        out = ch.empty(n, loc.size(0), dtype=loc.dtype, device=loc.device)
+        max_size = self.max_round
+        if self.max_memory is not None:
+            max_size = min(max_size, max(1, self.max_memory // (loc.numel() * loc.element_size() * grad.MC_TEMPORARIES)))
+        filled, drawn = 0, 0
+        while filled < n:
+            if drawn >= self.max_num_samples:
+                raise ValueError("accepted {} of {} samples after drawing {}, the truncation set has a survival probability of "
+                                 "about {:.2e} or less; increase max_num_samples if it is not empty".format(filled, n, drawn, max(filled, 1) / drawn))
+            size = max(self.num_samples, math.ceil(self.slack * (n - filled) / self.acceptance_rate)) if self.drawn > 0 else self.num_samples
+            size = min(size, max_size, self.max_num_samples - drawn)
+            s = loc + noise_.normal(ch.Size([size, loc.size(0)]), loc.device).matmul(scale_tril.T)
+            s = s[phi(s).flatten().bool()]
+            k = min(s.size(0), n - filled)
+            out[filled:filled + k] = s[:k]
+            filled += k
+            self.accepted, self.drawn, self.rounds = self.accepted + s.size(0), self.drawn + size, self.rounds + 1
+            drawn += size
+        return out
+
+    @property
+    def acceptance_rate(self):
+        """
+        Estimated acceptance rate, ie. the survival probability of the truncation set under the 
+        distributions sampled so far. Floored at one accepted sample, so that rounds stay finite.
+        """
+        if self.drawn == 0:
+            return None
+        return max(self.accepted, 1) / self.drawn
+
+    def reset(self):
+        """
+        Reset the acceptance statistics.
+        """
+        self.accepted, self.drawn, self.rounds = 0, 0, 0
+
+    def __str__(self):
+        return 'rejection'
+
+
+class HitAndRunSampler:
+    """
+    Hit-and-run sampler for a multivariate normal distribution truncated to a polytope 
+    (delphi.oracle.Polytope). Runs one chain per requested sample, all in one batch: each step 
+    draws a random direction in the whitened space and moves the chain to an exact sample of the 
+    distribution along that line, which is a one dimensional truncated normal on the segment that 
+    stays within the polytope. Unlike rejection sampling, the cost does not grow as the polytope's 
+    mass shrinks. The chains persist across calls, so that after the first call's burn in, each call 
+    only takes a few steps from where the previous call left off. When the number of samples changes, 
+    the first n chains are reused, and only the chains that are added for a larger n burn in.
+    """
+    def __init__(self, steps=10, burn_in=100):
+        """
+        Args: 
+            steps (int) : number of hit-and-run steps per call
+            burn_in (int) : number of steps from the polytope's center before the first call returns
+        """
+        self.steps = steps
+        self.burn_in = burn_in
+        # chain states in the original (not whitened) space
+        self.states = None
+
+    def __call__(self, loc, covariance_matrix, phi, n, noise_=None):
+        """
+        Args: 
+            loc (torch.Tensor) : (d,) mean of the normal distribution
+            covariance_matrix (torch.Tensor) : d x d covariance matrix of the normal distribution
+            phi (delphi.oracle.Polytope) : polytope membership oracle 
+            n (int) : number of samples to return
+            noise_ (delphi.noise.noise) : noise source, defaults to i.i.d. pseudo-random noise
+        Returns: 
+            n x d tensor of samples that fall within the polytope
+        """
+        if not hasattr(phi, 'A') or not hasattr(phi, 'b'):
+            raise ValueError("hit-and-run sampling requires a delphi.oracle.Polytope membership oracle")
+        noise_ = make_noise(noise_)
+        scale_tril = ch.linalg.cholesky(covariance_matrix)
+        # constraints in the whitened space x = loc + scale_tril @ w
+        A, b = phi.A.to(loc) @ scale_tril, phi.b.to(loc) - phi.A.to(loc) @ loc
+        # reuse the first n chains, and start chains from the polytope's center only for the rows 
+        # beyond the existing ones, ie. when the batch size grows
+        kept = 0 if self.states is None else min(n, self.states.size(0))
+        w = ch.linalg.solve_triangular(scale_tril, (self.states[:kept].to(loc) - loc).T, upper=False).T if kept > 0 else ch.zeros(0, loc.size(0), dtype=loc.dtype, device=loc.device)
+        if kept < n:
+            center = chebyshev_center(A, b)[None, ...].repeat(n - kept, 1)
+            w = ch.cat([w, self._run(center, A, b, self.burn_in, noise_)])
+        w = self._run(w, A, b, self.steps, noise_)
+        states = loc + w @ scale_tril.T
+        # chains beyond n, ie. after a short last batch, are kept as they were for the next call
+        self.states = states if self.states is None or self.states.size(0) <= n else ch.cat([states, self.states[n:].to(states)])
+        return states.clone()
+
+    def _run(self, w, A, b, steps, noise_):
+        """
+        Takes steps hit-and-run steps from the whitened chain states w.
+        """
+        n = w.size(0)
+        for _ in range(steps if n > 0 else 0):
+            direction = noise_.normal((n, w.size(1)), w.device)
+            direction = direction / direction.norm(dim=-1, keepdim=True)
+            # the line w + t * direction stays in the polytope for t_lower <= t <= t_upper
+            Ad, slack = direction @ A.T, ch.clamp(b - w @ A.T, min=0)
+            t = slack / Ad
+            inf = ch.full_like(t, float('inf'))
+            t_upper = ch.where(Ad > 0, t, inf).min(-1, keepdim=True).values
+            t_lower = ch.where(Ad < 0, t, -inf).max(-1, keepdim=True).values
+            # along the line, t is normal with mean -<w, direction> and unit variance
+            u = noise_.uniform((1, n, 1), w.device)
+            t = truncated_sample(-(w * direction).sum(-1, keepdim=True), 1.0, Bounds(t_lower, t_upper), u)[0]
+            w = w + t * direction
+        return w
+
+    def reset(self):
+        """
+        Discard the chains, so that the next call starts from the polytope's center again.
+        """
+        self.states = None
+
+    def __str__(self):
+        return 'hit and run'
+
+
+def chebyshev_center(A, b, max_radius=10.0):
+    """
+    Center of the largest ball within the polytope Ax <= b, capped at max_radius for unbounded polytopes.
+    """
+    norms = A.norm(dim=-1, keepdim=True)
+    # maximize the radius r subject to A_i x + ||A_i|| r <= b_i
+    c = np.zeros(A.size(1) + 1)
+    c[-1] = -1.0
+    result = linprog(c, A_ub=ch.cat([A, norms], dim=-1).cpu().double().numpy(), b_ub=b.cpu().double().numpy(),
+                     bounds=[(None, None)] * A.size(1) + [(0, max_radius)])
+    if not result.success:
+        raise ValueError("polytope is empty: {}".format(result.message))
+    return ch.as_tensor(result.x[:-1], dtype=A.dtype, device=A.device)
+
+
+def inverse_cdf_moments(pred, scale, phi, num_samples, max_memory=None, second_moment=False, noise_=None, packed=False):
+    """
+    Monte Carlo sums for the normal distribution centered at pred and truncated to the set of a one 
+    dimensional interval oracle (Left, Right, Interval, KIntervalUnion), drawn directly from the truncated 
+    distribution by inverse CDF, so that every draw is accepted. Oracles without intervals fall back to 
+    rejection sampling with delphi.grad.truncated_moments. Has the same signature as 
+    delphi.grad.truncated_moments.
+    Args: 
+        pred (torch.Tensor) : B x 1 predictions
+        scale (float or torch.Tensor) : standard deviation of the noise distribution
+        phi (delphi.oracle.oracle) : membership oracle 
+        num_samples (int) : number of samples per prediction 
+        max_memory (int) : memory budget in bytes for each chunk, None draws all samples at once
+        second_moment (bool) : also accumulate the sum of squares
+        noise_ (delphi.noise.noise) : noise source, defaults to i.i.d. pseudo-random noise
+        packed (bool) : reduce with bit-packed masks when falling back to rejection sampling
+    Returns: 
+        Tuple with sum, sum of squares (None if second_moment is False) and the number of samples for each prediction
+    """
+    intervals = getattr(phi, 'intervals', None)
+    if intervals is None:
+        return grad.truncated_moments(pred, scale, phi, num_samples, max_memory, second_moment, noise_, packed)
+    chunk = num_samples
+    if max_memory is not None:
+        sample_bytes = pred.numel() * intervals.lower.numel() * 8 * grad.MC_TEMPORARIES
+        chunk = int(max(1, min(num_samples, max_memory // sample_bytes)))
+    noise_ = make_noise(noise_)
+    z = ch.zeros_like(pred)
+    z_sq = ch.zeros_like(pred) if second_moment else None
+    for start in range(0, num_samples, chunk):
+        u = noise_.uniform((min(chunk, num_samples - start),) + pred.size(), pred.device)
+        samples = truncated_sample(pred, scale, intervals, u)
+        z += samples.sum(0)
+        if second_moment:
+            z_sq += samples.pow(2).sum(0)
+    return z, z_sq, ch.full_like(pred, num_samples)
+
+
+def truncated_sample(loc, scale, intervals, u, dist='normal'):
+    """
+    Inverse CDF samples of a location-scale distribution truncated to a union of disjoint one 
+    dimensional intervals. Each uniform first picks an interval in proportion to its mass and 
+    is then rescaled to a uniform within that interval, so that one uniform gives one sample 
+    and quasi-random uniforms stay stratified. Intervals in the right tail are reflected into 
+    the left tail and inverted in log space, so that samples far in the tails stay finite.
+    Args: 
+        loc (torch.Tensor) : B x 1 locations
+        scale (float or torch.Tensor) : scale of the distribution
+        intervals (delphi.utils.helpers.Bounds) : (k,) sorted, disjoint lower and upper bounds
+        u (torch.Tensor) : num_samples x B x 1 uniforms
+        dist (str) : 'normal' or 'logistic'
+    Returns: 
+        num_samples x B x 1 samples
+    """
+    log_cdf, inverse_log_cdf = LOG_CDFS[dist]
+    dtype, loc, u = loc.dtype, loc.double(), u.double()
+    scale = scale.double() if isinstance(scale, ch.Tensor) else scale
+    lower, upper = intervals.lower.to(loc), intervals.upper.to(loc)
+    # standardized endpoints and log masses of the intervals, B x k
+    a, b = (lower - loc) / scale, (upper - loc) / scale
+    flip = a > 0
+    a_, b_ = ch.where(flip, -b, a), ch.where(flip, -a, b)
+    log_lower, log_upper = log_cdf(a_), log_cdf(b_)
+    log_mass = log_upper + grad.log1mexp(ch.clamp(log_lower - log_upper, max=0))
+    # pick an interval by the cumulative normalized masses
+    cdf = ch.softmax(log_mass, dim=-1).cumsum(-1)
+    idx = (u > cdf[None, ..., :-1]).sum(-1, keepdim=True)
+    expand = lambda t: t[None, ...].expand(u.size()[:-1] + t.size()[-1:]).gather(-1, idx)
+    cdf_start = expand(ch.cat([ch.zeros_like(cdf[..., :1]), cdf[..., :-1]], dim=-1))
+    prob = expand(cdf - ch.cat([ch.zeros_like(cdf[..., :1]), cdf[..., :-1]], dim=-1))
+    # uniform within the interval, and its log CDF value in the (reflected) interval
+    v = ch.clamp((u - cdf_start) / prob, 0, 1)
+    lp = ch.logaddexp(expand(log_lower), ch.log(v) + expand(log_mass))
+    lp = ch.minimum(lp, expand(log_upper))
+    x = inverse_log_cdf(lp)
+    flip, a, b = expand(flip), expand(a.expand_as(log_mass)), expand(b.expand_as(log_mass))
+    x = ch.minimum(ch.maximum(ch.where(flip, -x, x), a), b)
+    return (loc + scale * x).to(dtype)
+
+
+def ndtri_exp(y):
+    """
+    Inverse of log_ndtr, ie. the standard normal quantile of exp(y). Far in the left tail, 
+    where exp(y) underflows, the quantile is refined with Newton steps on log_ndtr from its 
+    asymptotic expansion.
+    """
+    tail = y < -20
+    y_ = ch.where(tail, y, -ch.ones_like(y))
+    # asymptotic expansion of log_ndtr(x) ~ -x^2 / 2 - log(-x) - log(sqrt(2 pi))
+    x = -ch.sqrt(-2 * y_ - ch.log(-2 * y_) - math.log(2 * math.pi))
+    for _ in range(4):
+        log_ndtr_x = log_ndtr(x)
+        x = x - (log_ndtr_x - y_) * ch.exp(log_ndtr_x + .5 * x.pow(2) + grad.LOG_SQRT_2PI)
+    return ch.where(tail, x, ndtri(ch.exp(ch.where(tail, ch.zeros_like(y), y))))
+
+
+def logit_exp(y):
+    """
+    Inverse of logsigmoid, ie. the standard logistic quantile of exp(y).
+    """
+    return y - grad.log1mexp(ch.clamp(y, max=-1e-300))
+
+
+# log CDFs and their inverses of the standard noise distributions
+LOG_CDFS = {
+    'normal': (log_ndtr, ndtri_exp),
+    'logistic': (logsigmoid, logit_exp),
+}
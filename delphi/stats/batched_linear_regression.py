@@ -0,0 +1,254 @@
+"""
+Batched truncated linear regression, fits many small truncated regressions at once.
+"""
+
+import torch as ch
+from torch import Tensor
+from cox.utils import Parameters
+import warnings
+
+from ..noise import make_noise
+from ..grad import truncated_moments, truncated_normal_moments
+from ..utils.helpers import Bounds
+
+
+class BatchedTruncatedRegression:
+    '''
+    Fits a stack of independent truncated linear regression problems with one
+    tensor program. Each parameter carries a leading problem dimension, so that
+    every projected stochastic gradient step updates all of the problems at once.
+    Every n steps, the problems whose gradient norm on their own data falls below
+    tol are marked converged and stop taking steps. The problems may either share
+    one membership oracle, or each have its own one dimensional interval oracle
+    (Left, Right, Interval, KIntervalUnion), in which case the gradients are computed
+    in closed form. The estimator runs its own loop instead of the delphi trainer,
+    since the trainer steps one model at a time.
+    '''
+    def __init__(
+            self,
+            phi,
+            alpha,
+            steps: int=1000,
+            unknown: bool=True,
+            clamp: bool=True,
+            n: int=10,
+            tol: float=1e-2,
+            r: float=2.0,
+            num_samples: int=100,
+            bs: int=10,
+            lr: float=1e-1,
+            var_lr: float=1e-1,
+            step_lr: int=100,
+            step_lr_gamma: float=.9,
+            eps: float=1e-5,
+            max_memory: int=None,
+            noise: str='iid',
+            **kwargs):
+        '''
+        Args:
+            phi (delphi.oracle.oracle or list) : membership oracle shared by all of the problems, or a list
+                with one interval oracle per problem
+            alpha (float or torch.Tensor) : survival probability, shared or (P,) with one per problem
+            steps (int) : maximum number of projected SGD steps
+            unknown (bool) : unknown noise variance
+            clamp (bool) : project the parameters into a box around the OLS estimates
+            n (int) : number of steps between convergence checks
+            tol (float) : gradient norm tolerance, below which a problem is converged
+            r (float) : projection set radius multiplier
+            num_samples (int) : number of noised copies per prediction for the Monte Carlo gradients
+            bs (int) : number of rows sampled per problem for each step
+            lr (float) : learning rate for the regression parameters
+            var_lr (float) : learning rate for the inverse noise variance
+            step_lr (int) : number of steps between learning rate decays
+            step_lr_gamma (float) : learning rate decay
+            eps (float) : added to the accepted copy counts of the Monte Carlo gradients
+            max_memory (int) : memory budget in bytes for the Monte Carlo gradients
+            noise (str or delphi.noise.noise) : noise source for the Monte Carlo gradients
+        '''
+        self.phi = phi
+        self.alpha = alpha
+        self.unknown = unknown
+        self.clamp = clamp
+        self.tol = tol
+        self.r = r
+        self.args = Parameters({
+            'steps': steps,
+            'n': n,
+            'num_samples': num_samples,
+            'bs': bs,
+            'lr': lr,
+            'var_lr': var_lr,
+            'step_lr': step_lr,
+            'step_lr_gamma': step_lr_gamma,
+            'eps': eps,
+            'max_memory': max_memory,
+            'noise': make_noise(noise),
+        })
+        # per problem interval bounds for the closed form gradients, P x 1 x k
+        self.intervals = None
+        # parameters, P x d x 1 weights and P x 1 x 1 biases and inverse variances
+        self._weight, self._bias, self._lambda = None, None, None
+        self.converged, self.steps_taken = None, None
+
+    def fit(self, X, y, lengths: Tensor=None):
+        """
+        Args:
+            X (torch.Tensor or list) : P x n x d padded covariates, or a list of P (n_p, d) covariates
+            y (torch.Tensor or list) : P x n x 1 padded dependent variables, or a list of P (n_p, 1) dependent variables
+            lengths (torch.Tensor) : (P,) number of rows of each padded problem, defaults to n
+        """
+        if isinstance(X, (list, tuple)):
+            lengths = ch.LongTensor([X_.size(0) for X_ in X])
+            X, y = pad(X), pad([y_.reshape(y_.size(0), 1) for y_ in y])
+        P, N, d = X.size()
+        self.lengths = lengths if lengths is not None else ch.full((P,), N, dtype=ch.long)
+        self.mask = (ch.arange(N)[None, :] < self.lengths[:, None]).unsqueeze(-1).to(X)
+        self.X, self.y = X * self.mask, y * self.mask
+
+        if isinstance(self.phi, (list, tuple)):
+            bounds = [phi_.intervals for phi_ in self.phi]
+            if any(bounds_ is None for bounds_ in bounds):
+                raise ValueError("per problem oracles must be one dimensional interval oracles (Left, Right, Interval, KIntervalUnion)")
+            self.intervals = stack_intervals(bounds)
+
+        # batched OLS estimates from the normal equations, P x (d + 1) x 1
+        X_ = ch.cat([self.X, self.mask], dim=-1)
+        coef = ch.linalg.lstsq(X_.transpose(1, 2) @ X_, X_.transpose(1, 2) @ self.y).solution
+        self.emp_weight, self.emp_bias = coef[:, :d], coef[:, d:]
+        resid = (self.y - X_ @ coef) * self.mask
+        self.emp_var = (resid.pow(2).sum(1, keepdim=True) / (self.lengths.view(P, 1, 1) - 1).clamp(min=1))
+
+        # projection set
+        alpha = ch.as_tensor(self.alpha, dtype=X.dtype).expand(P).view(P, 1, 1)
+        radius = self.r * (12.0 + 4.0 * ch.log(2.0 / alpha)) if self.unknown else self.r * (4.0 * ch.log(2.0 / alpha) + 7.0)
+        self.weight_bounds = Bounds(self.emp_weight - radius, self.emp_weight + radius)
+        self.bias_bounds = Bounds(self.emp_bias - radius, self.emp_bias + radius)
+        self.var_bounds = Bounds(self.emp_var / self.r, self.emp_var / alpha.pow(2))
+
+        # initialize with the empirical estimates, reparameterized by the inverse variance if unknown
+        self._lambda = self.emp_var.reciprocal() if self.unknown else ch.ones(P, 1, 1)
+        self._weight, self._bias = self.emp_weight * self._lambda, self.emp_bias * self._lambda
+        self.converged = ch.zeros(P, dtype=ch.bool)
+        self.steps_taken = ch.zeros(P, dtype=ch.long)
+
+        active = ch.arange(P)
+        lr, var_lr = self.args.lr, self.args.var_lr
+        for step in range(1, self.args.steps + 1):
+            # sample a minibatch of valid rows for each active problem
+            rows = (ch.rand(active.size(0), self.args.bs) * self.lengths[active, None]).long()
+            X_b, y_b = self.X[active[:, None], rows], self.y[active[:, None], rows]
+            weight_grad, bias_grad, lambda_grad = self._grad(active, X_b, y_b, ch.ones_like(y_b))
+            self._weight[active] -= lr * weight_grad
+            self._bias[active] -= lr * bias_grad
+            if self.unknown:
+                self._lambda[active] -= var_lr * lambda_grad
+            self._project(active)
+            self.steps_taken[active] += 1
+            if step % self.args.step_lr == 0:
+                lr, var_lr = lr * self.args.step_lr_gamma, var_lr * self.args.step_lr_gamma
+            # check for convergence every n steps, converged problems stop taking steps
+            if step % self.args.n == 0:
+                self.converged[active] = self.score(active) < self.tol
+                active = active[~self.converged[active]]
+                if active.nelement() == 0:
+                    break
+        return self
+
+    def _moments(self, active, pred, scale):
+        """
+        Conditional first and second moments of the truncated noise distribution for the active problems.
+        """
+        if self.intervals is not None:
+            bounds = Bounds(self.intervals.lower[active], self.intervals.upper[active])
+            return truncated_normal_moments(pred, scale, bounds)
+        z, z_sq, count = truncated_moments(pred, scale, self.phi, self.args.num_samples, self.args.max_memory,
+                                           second_moment=self.unknown, noise_=self.args.noise)
+        count = count + self.args.eps
+        return z / count, z_sq / count if self.unknown else None
+
+    def _grad(self, active, X, y, mask):
+        """
+        Gradients of the truncated negative log likelihood for the active problems, averaged over
+        the rows where mask is one.
+        """
+        lambda_ = self._lambda[active]
+        pred = (X @ self._weight[active] + self._bias[active]) / lambda_
+        out, out_sq = self._moments(active, pred, lambda_.rsqrt() if self.unknown else 1.0)
+        count = mask.sum(1, keepdim=True)
+        resid = (out - y) * mask / count
+        lambda_grad = (.5 * (y.pow(2) - out_sq) * mask / count).sum(1, keepdim=True) if self.unknown else None
+        return X.transpose(1, 2) @ resid, resid.sum(1, keepdim=True), lambda_grad
+
+    def _project(self, active):
+        """
+        Projects the parameters of the active problems back into the projection set.
+        """
+        if not self.clamp:
+            return
+        lambda_ = self._lambda[active]
+        if self.unknown:
+            lambda_ = ch.minimum(ch.maximum(lambda_.reciprocal(), self.var_bounds.lower[active]), self.var_bounds.upper[active]).reciprocal()
+        weight = ch.minimum(ch.maximum(self._weight[active] / self._lambda[active], self.weight_bounds.lower[active]), self.weight_bounds.upper[active])
+        bias = ch.minimum(ch.maximum(self._bias[active] / self._lambda[active], self.bias_bounds.lower[active]), self.bias_bounds.upper[active])
+        self._lambda[active], self._weight[active], self._bias[active] = lambda_, weight * lambda_, bias * lambda_
+
+    def score(self, active=None):
+        """
+        Gradient norm of each problem on all of its rows.
+        Args:
+            active (torch.Tensor) : indices of the problems to score, defaults to all of the problems
+        Returns:
+            gradient norm for each scored problem
+        """
+        active = active if active is not None else ch.arange(self.X.size(0))
+        y, mask = self.y[active], self.mask[active]
+        _, bias_grad, lambda_grad = self._grad(active, self.X[active], y, mask)
+        grad = ch.cat([bias_grad, lambda_grad], dim=-1) if self.unknown else bias_grad
+        return grad.flatten(1).norm(dim=-1)
+
+    @property
+    def weight(self):
+        """
+        P x d regression weights.
+        """
+        return (self._weight / self._lambda).squeeze(-1).clone()
+
+    @property
+    def intercept(self):
+        """
+        (P,) regression intercepts.
+        """
+        return (self._bias / self._lambda).flatten().clone()
+
+    @property
+    def variance(self):
+        """
+        (P,) noise variance predictions for regression with unknown noise variance.
+        """
+        if self.unknown:
+            return self._lambda.reciprocal().flatten().clone()
+        else:
+            warnings.warn("no variance prediction because regression with known variance was run")
+
+
+def pad(tensors):
+    """
+    Stacks tensors with different numbers of rows into one zero padded tensor.
+    """
+    out = ch.zeros((len(tensors), max(t.size(0) for t in tensors)) + tensors[0].size()[1:], dtype=tensors[0].dtype)
+    for i, t in enumerate(tensors):
+        out[i, :t.size(0)] = t
+    return out
+
+
+def stack_intervals(bounds):
+    """
+    Stacks one dimensional interval bounds with different numbers of intervals into P x 1 x k
+    bounds. Problems with less than k intervals are padded with empty intervals, which
+    have no probability mass.
+    """
+    k = max(bounds_.lower.size(0) for bounds_ in bounds)
+    lower, upper = ch.zeros(len(bounds), 1, k), ch.zeros(len(bounds), 1, k)
+    for i, bounds_ in enumerate(bounds):
+        lower[i, 0, :bounds_.lower.size(0)], upper[i, 0, :bounds_.upper.size(0)] = bounds_.lower, bounds_.upper
+    return Bounds(lower, upper)
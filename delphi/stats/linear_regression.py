@@ -7,20 +7,23 @@ from torch import Tensor
 import torch.nn as nn
 from torch.nn import Linear
 from torch.utils.data import TensorDataset, DataLoader
-from sklearn.linear_model import LinearRegression
 from cox.utils import Parameters
 from cox.store import Store
-import config
-import copy
 import warnings
+from abc import abstractmethod
 
-from .delphi.delphi import delphi
+from ..delphi import delphi
 from .stats import stats
 from ..oracle import oracle
+from ..noise import make_noise, NoiseBank
+from ..samplers import AdaptiveSampler
 from ..train import train_model
 from ..grad import TruncatedMSE, TruncatedUnknownVarianceMSE
+from ..sufficient_statistics import SufficientStatistics
+from .newton import TruncatedRegressionNewton
+from ..convergence import ConvergenceMonitor, StateSnapshot, EMA_BETA, CHECK_RATIO, SCORE_EVERY
 from ..utils import constants as consts
-from ..utils.helpers import Bounds, LinearUnknownVariance, setup_store_with_metadata, ProcedureComplete
+from ..utils.helpers import Bounds, LinearUnknownVariance, setup_store_with_metadata, ProcedureComplete, project_regression_
 
 
 class TruncatedRegression(stats):
@@ -52,10 +55,50 @@ class TruncatedRegression(stats):
             custom_lr_multiplier: str=None,
             step_lr_gamma: float=.9,
             eps: float=1e-5, 
+            max_memory: int=None,
+            analytic: bool=True,
+            noise: str='iid',
+            num_accepted: int=None,
+            max_num_samples: int=None,
+            noise_bank: int=None,
+            packed_masks: bool=False,
+            ema: float=.9,
+            check_ratio: float=10.0,
+            score_every: int=10,
+            solver: str='sgd',
+            solver_bs: int=None,
+            newton_steps: int=50,
+            partial_fit_decay: float=.6,
             **kwargs):
         '''
         Args: 
             phi (delphi.oracle.oracle) : `
+            max_memory (int) : memory budget in bytes for the Monte Carlo gradient estimates; 
+                if given, the noised samples are drawn in chunks that fit within the budget
+            analytic (bool) : compute the gradient in closed form when phi is a one dimensional 
+                interval oracle (Left, Right, Interval, KIntervalUnion), instead of by inverse CDF sampling
+            noise (str or delphi.noise.noise) : noise source for the Monte Carlo gradient estimates; 
+                'iid' (pseudo-random), or the quasi-random 'sobol' or 'halton'
+            num_accepted (int) : if given, sample adaptively; draw rounds of num_samples noised copies 
+                only for the predictions with less than num_accepted copies in the truncation set
+            max_num_samples (int) : maximum number of noised copies per prediction when sampling adaptively, 
+                defaults to 10 * num_samples
+            noise_bank (int) : if given, reuse noise across steps from a bank of noise_bank rotations of draws, 
+                and score the validation set with the same draws every time (common random numbers)
+            packed_masks (bool) : reduce the Monte Carlo gradient estimates with bit-packed membership masks, 
+                which cuts their peak memory to about the size of the noise
+            ema (float) : decay of the moving average of the training gradients, which is checked every n steps 
+            check_ratio (float) : the validation set is scored once the averaged training gradient's 
+                norm falls below check_ratio * tol
+            score_every (int) : the validation set is also scored every score_every checks, since the averaged 
+                gradient may stay above check_ratio * tol from the noise of the minibatches
+            solver (str) : 'sgd' for projected stochastic gradient descent, or 'newton' for a full batch 
+                damped Newton-CG solver (see delphi.stats.newton)
+            solver_bs (int) : number of rows sampled for each Newton iteration, defaults to the whole train set
+            newton_steps (int) : maximum number of Newton iterations, each of which costs about as much as 
+                a pass over the train set
+            partial_fit_decay (float) : partial fits decay the learning rates as (1 + t / step_lr)^-partial_fit_decay 
+                over their t steps so far, a Robbins-Monro schedule for decays in (.5, 1]
         '''
         super(TruncatedRegression).__init__()
         # instance variables
@@ -80,9 +123,29 @@ class TruncatedRegression(stats):
         self.custom_lr_multiplier = custom_lr_multiplier
         self.step_lr_gamma = step_lr_gamma
         self.eps = eps 
+        self.max_memory = max_memory
+        self.analytic = analytic
+        self.packed_masks = packed_masks
+        if solver not in ('sgd', 'newton'):
+            raise ValueError("solver must be 'sgd' or 'newton', not {}".format(solver))
+        self.solver = solver
+        self.solver_bs = solver_bs
+        self.newton_steps = newton_steps
+        self.partial_fit_decay = partial_fit_decay
+        self.noise = make_noise(noise)
+        # training noise rotates through a bank, validation noise is held fixed
+        self.val_noise = None
+        if noise_bank is not None:
+            self.noise, self.val_noise = NoiseBank(self.noise, rotations=noise_bank), NoiseBank(self.noise, rotations=noise_bank)
+        # adaptive sampler, keeps the realized acceptance counts of the last gradient estimate
+        self.sampler = AdaptiveSampler(num_accepted, max_num_samples if max_num_samples is not None else 10 * num_samples) if num_accepted is not None else None
         self.ds = None
+        # running state of partial fits
+        self.suff_stats, self.train_stats = None, None
+        self._update_params, self._optimizer, self._scheduler = None, None, None
 
-        config.args = Parameters({ 
+        # algorithm hyperparameters, owned by this estimator and passed to the criterion and trainer
+        self.args = Parameters({ 
             'steps': self.steps,
             'momentum': 0.0, 
             'weight_decay': 0.0,   
@@ -90,14 +153,22 @@ class TruncatedRegression(stats):
             'lr': self.lr,  
             'var_lr': self.var_lr,
             'eps': self.eps,
+            'max_memory': self.max_memory,
+            'analytic': self.analytic,
+            'noise': self.noise,
+            'sampler': self.sampler,
+            'packed_masks': self.packed_masks,
+            'ema': ema,
+            'check_ratio': check_ratio,
+            'score_every': score_every,
         })
 
         # ste attribute for learning rate scheduler
         if self.custom_lr_multiplier: 
-            config.args.__setattr__('custom_lr_multiplier', self.custom_lr_multiplier)
+            self.args.__setattr__('custom_lr_multiplier', self.custom_lr_multiplier)
         else: 
-            config.args.__setattr__('step_lr', self.step_lr)
-            config.args.__setattr__('step_lr_gamma', self.step_lr_gamma)
+            self.args.__setattr__('step_lr', self.step_lr)
+            self.args.__setattr__('step_lr_gamma', self.step_lr_gamma)
 
 
     def fit(self, X: Tensor, y: Tensor):
@@ -111,33 +182,119 @@ class TruncatedRegression(stats):
 
         self.ds = TensorDataset(self.X_train, self.y_train)
         loader = DataLoader(self.ds, batch_size=self.bs, num_workers=self.workers)
-        self.emp_lin_reg = LinearRegression().fit(X, y)
-        self.emp_weight = Tensor(self.emp_lin_reg.coef_)
-        self.emp_bias = Tensor(self.emp_lin_reg.intercept_)
-        self.emp_var = ch.var(Tensor(self.emp_lin_reg.predict(X)) - y, dim=0)[..., None]
+        # one pass over the data for the OLS estimates, the training set's statistics are the rest's
+        self.suff_stats = SufficientStatistics(X, y)
+        self.train_stats = self.suff_stats - SufficientStatistics(self.X_val, self.y_val)
+        self.emp_weight, self.emp_bias = self.suff_stats.ols()
+        self.emp_var = self.suff_stats.variance(self.emp_weight, self.emp_bias)
         
+        update_params = self._init_lin_reg(X.size(1), y.size(1))
+
+        self.iter_hook = TruncatedRegressionIterationHook(self.train_stats, self.X_val, self.y_val, self.phi, self.tol, self.r, self.alpha, self.clamp, self.unknown, self.n, self.criterion, self.args, val_noise=self.val_noise)
+        self.args.__setattr__('iteration_hook', self.iter_hook)
+        # run PGD for parameter estimation
+        if self.score() > self.tol: # first check regression's empirical score
+            if self.solver == 'newton':
+                newton = TruncatedRegressionNewton(self.phi, self.unknown, self.args, steps=self.newton_steps, tol=self.tol, bs=self.solver_bs)
+                self._lin_reg = newton.fit(self._lin_reg, self.X_train, self.y_train, project=self.iter_hook.project if self.clamp else None)
+                # the solver only accepts steps that decrease the train gradient, so its last iterate is its best; 
+                # report it on the validation set, as the iteration hook does for SGD, but judge convergence on 
+                # the train gradient, since the validation gradient of a converged fit keeps the validation set's noise
+                val_grad_norm = self.score()
+                print("Iteration {} | Empirical Gradient Estimate: {}".format(newton.steps_taken, val_grad_norm))
+                print("Final Score: {}".format(val_grad_norm))
+                if newton.grad_norm >= self.tol:
+                    warnings.warn("newton solver stalled at train gradient norm {} above tol {} after {} steps".format(newton.grad_norm, self.tol, newton.steps_taken))
+            else:
+                self._lin_reg = train_model(self.args, self._lin_reg, (loader, None), phi=self.phi, criterion=self.criterion, update_params=update_params)
+        # a later partial fit continues from the fitted regression with a new optimizer, since the trainer's is not returned
+        self._update_params, self._optimizer = update_params, None
+        # remove linear regression from computation graph
+
+        with ch.no_grad():
+            return self._lin_reg
+
+    def _init_lin_reg(self, in_features, out_features):
+        """
+        Initializes the regression with the empirical estimates.
+        Returns:
+            the optimizer's parameter groups, None for the default groups
+        """
         if self.unknown: # known variance
-            self._lin_reg = LinearUnknownVariance(in_features=X.size(1), out_features=y.size(1), bias=True)
+            self._lin_reg = LinearUnknownVariance(in_features=in_features, out_features=out_features, bias=True)
             # assign empirical estimates
             self._lin_reg.lambda_.data = self.emp_var.inverse()
             self._lin_reg.weight.data = self.emp_weight * self._lin_reg.lambda_ 
             self._lin_reg.bias.data = (self.emp_bias * self._lin_reg.lambda_).flatten()
-            update_params = [{'params': [self._lin_reg.weight, self._lin_reg.bias]},
+            return [{'params': [self._lin_reg.weight, self._lin_reg.bias]},
                 {'params': self._lin_reg.lambda_, 'lr': self.var_lr}]
-        else:  # unknown variance
-            self._lin_reg = Linear(in_features=X.size(1), out_features=y.size(1), bias=True)
-            # assign empirical estimates
-            self._lin_reg.weight.data = self.emp_weight
-            self._lin_reg.bias.data = self.emp_bias
-            update_params = None
-
-        self.iter_hook = TruncatedRegressionIterationHook(self.X_train, self.y_train, self.X_val, self.y_val, self.phi, self.tol, self.r, self.alpha, self.clamp, self.unknown, self.n, self.criterion)
-        config.args.__setattr__('iteration_hook', self.iter_hook)
-        # run PGD for parameter estimation
-        if self.score() > self.tol: # first check regression's empirical score
-            self._lin_reg = train_model(config.args, self._lin_reg, (loader, None), phi=self.phi, criterion=self.criterion, update_params=update_params)
-        # remove linear regression from computation graph
-
+        # unknown variance
+        self._lin_reg = Linear(in_features=in_features, out_features=out_features, bias=True)
+        # assign empirical estimates
+        self._lin_reg.weight.data = self.emp_weight
+        self._lin_reg.bias.data = self.emp_bias
+        return None
+
+    def partial_fit(self, X: Tensor, y: Tensor, steps: int=None):
+        """
+        Updates the regression with a chunk of new samples. The estimator keeps running sufficient 
+        statistics of every training sample seen so far, and recenters the projection set on their OLS 
+        estimates, but keeps the current regression estimates and optimizer state, and takes a 
+        bounded number of projected SGD steps on the chunk, so that an update costs O(chunk). The 
+        regression is initialized with the OLS estimates once there are at least d + 2 samples, so 
+        that the residual variance has a degree of freedom; until then, the chunks only add to the 
+        statistics. The learning rates decay with a Robbins-Monro schedule over all of the partial 
+        fits' steps (see partial_fit_decay), instead of fit's schedule. The trainer does not return 
+        its optimizer, so the first partial fit after a fit continues from the fitted regression 
+        with a new optimizer and learning rate schedule.
+        Args:
+            X (torch.Tensor) : n x d covariates of the chunk
+            y (torch.Tensor) : n x 1 dependent variables of the chunk
+            steps (int) : number of projected SGD steps, defaults to one pass over the chunk in 
+                batches of bs, and at most steps
+        Returns:
+            the regression, None while it is not initialized
+        """
+        chunk = SufficientStatistics(X, y)
+        self.suff_stats = chunk if self.suff_stats is None else self.suff_stats + chunk
+        # after a fit, the validation set stays out of the projection set
+        self.train_stats = chunk if self.train_stats is None else self.train_stats + chunk
+        if self._lin_reg is None:
+            if self.train_stats.n < X.size(1) + 2:
+                return None
+            self.emp_weight, self.emp_bias = self.train_stats.ols()
+            self.emp_var = self.train_stats.variance(self.emp_weight, self.emp_bias)
+            self._update_params = self._init_lin_reg(X.size(1), y.size(1))
+        if self.iter_hook is None:
+            self.iter_hook = TruncatedRegressionIterationHook(self.train_stats, None, None, self.phi, self.tol, self.r, self.alpha, self.clamp, self.unknown, self.n, self.criterion, self.args, val_noise=self.val_noise)
+        else:
+            self.iter_hook.update_projection_set(self.train_stats)
+        if self._optimizer is None:
+            params = self._update_params if self._update_params is not None else self._lin_reg.parameters()
+            self._optimizer = ch.optim.SGD(params, lr=self.lr, momentum=self.args.momentum, weight_decay=self.args.weight_decay)
+            # the step and custom schedules of fit decay too fast or restart, for a stream of chunks
+            self._scheduler = ch.optim.lr_scheduler.LambdaLR(self._optimizer, lambda t: (1 + t / self.step_lr) ** -self.partial_fit_decay)
+
+        # passes over the chunk in random order, without replacement within a pass
+        bs = min(self.bs, X.size(0))
+        batches = -(-X.size(0) // bs)
+        steps = min(steps if steps is not None else batches, self.steps)
+        for step in range(steps):
+            if step % batches == 0:
+                order = ch.randperm(X.size(0), device=X.device)
+            rows = order[(step % batches) * bs:(step % batches + 1) * bs]
+            pred = self._lin_reg(X[rows])
+            if self.unknown:
+                loss = self.criterion(pred, y[rows], self._lin_reg.lambda_, self.phi, self.args)
+            else:
+                loss = self.criterion(pred, y[rows], self.phi, self.args)
+            self._optimizer.zero_grad()
+            loss.sum().backward()
+            self._optimizer.step()
+            if self._scheduler is not None:
+                self._scheduler.step()
+            if self.clamp:
+                self.iter_hook.project(self._lin_reg)
         with ch.no_grad():
             return self._lin_reg
 
@@ -150,18 +307,10 @@ class TruncatedRegression(stats):
         """
         Check the score of the validation set. Passes validation 
         set through regression and then returns the gradient with 
-        respect to y and in the unknown setting with respect to lambda.
+        respect to y and in the unknown setting with respect to lambda, 
+        scored by the iteration hook, as in the convergence checks.
         """
-        pred = self._lin_reg(self.X_val)
-        if self.unknown:
-            loss = self.criterion(pred, self.y_val, self._lin_reg.lambda_, self.phi)
-            grad, lambda_grad = ch.autograd.grad(loss, [pred, self._lin_reg.lambda_])
-            grad = ch.cat([(grad.sum(0) / self._lin_reg.lambda_).flatten(), lambda_grad.flatten()])
-        else: 
-            loss = self.criterion(pred, self.y_val, self.phi)
-            grad, = ch.autograd.grad(loss, [pred])
-            grad = grad.sum(0)
-        return grad.norm(dim=-1)
+        return self.iter_hook.score(self._lin_reg)
 
     @property
     def weight(self): 
@@ -199,14 +348,14 @@ class TruncatedRegressionIterationHook:
     Hook does two things. First it projects the current model estimates back into the 
     projection set. For the known case, we only project the regression parameters into 
     the domain. For the unknown case, we project both the model parameter and variance 
-    estimates. Further, every n steps we check to check the gradient against our validation 
-    set of samples. If the gradient for the samples is less than our tolerance, then 
-    we terminate the procedure.
+    estimates. Further, it keeps a moving average of the training steps' gradients, and every 
+    n steps, once the average's norm falls below check_ratio * tol, or else every score_every 
+    checks, it checks the gradient against our validation set of samples. If the gradient for 
+    the samples is less than our tolerance, then we terminate the procedure.
     """
-    def __init__(self, X_train, y_train, X_val, y_val, phi, tol, r, alpha, clamp, unknown, n, criterion):
+    def __init__(self, train_stats, X_val, y_val, phi, tol, r, alpha, clamp, unknown, n, criterion, args, val_noise=None):
         """
-        :param X_train: train covariates - torch.Tensor
-        :param y_train: train dependent variable - torch.Tensor
+        :param train_stats: sufficient statistics of the train set - delphi.sufficient_statistics.SufficientStatistics
         :param X_val: val covariates - torch.Tensor
         :param y_val: val dependent variable - torch.Tensor
         :param phi: membership oracle - delphi.oracle
@@ -216,6 +365,8 @@ class TruncatedRegressionIterationHook:
         :param unknown: boolean for known or unknown noise variance - bool
         :param n: number of steps to check gradient - int 
         :param criterion: criterion to determine convergence - torch.autograd.Function 
+        :param args: estimator hyperparameters passed to the criterion - cox.utils.Parameters
+        :param val_noise: noise bank that the validation set is scored with, instead of the args' noise - delphi.noise.NoiseBank
         """
         # use OLS as empirical estimate to define projection set
         self.r = r
@@ -225,67 +376,131 @@ class TruncatedRegressionIterationHook:
 
         # initialize projection set
         self.clamp = clamp
-        self.emp_lin_reg = LinearRegression().fit(X_train, y_train)
-        self.emp_weight = Tensor(self.emp_lin_reg.coef_) 
-        self.emp_bias = Tensor(self.emp_lin_reg.intercept_)
-        self.emp_var = ch.var(Tensor(self.emp_lin_reg.predict(X_train)) - y_train, dim=0)[..., None]
-        self.radius = r * (12.0 + 4.0 * ch.log(2.0 / self.alpha)) if self.unknown else r * (4.0 * ch.log(2.0 / self.alpha) + 7.0)
-
-        if self.clamp:
-            self.weight_bounds = Bounds(self.emp_weight.flatten() - self.radius,
-                                        self.emp_weight.flatten() + self.radius)
-            # generate noise variance radius bounds if unknown 
-            self.var_bounds = Bounds(float(self.emp_var.flatten() / self.r), float(self.emp_var.flatten() / self.alpha.pow(2))) if self.unknown else None
-            self.bias_bounds = Bounds(float(self.emp_bias.flatten() - self.radius),
-                                      float(self.emp_bias.flatten() + self.radius))
-        else:
-            pass
+        self.update_projection_set(train_stats)
 
         # validation set
         # use steps counter to keep track of steps taken
         self.n, self.steps = n, 0
         self.X_val, self.y_val = X_val, y_val
         self.criterion = criterion
+        self.args = args
+        self.val_noise = val_noise
         self.tol = tol
-        # track best estimates based off of gradient norm
+        # track best estimates based off of the validation gradient's norm, the moving average 
+        # only decides when to score, its monitor is built on the first step, once the model is known
+        self.monitor, self.checks = None, 0
         self.best_grad_norm = None
-        self.best_state_dict = None
-        self.best_opt = None
-        # calculate empirical score
-        emp = LinearUnknownVariance(in_features=X_train.size(0), out_features=1, bias=True) if self.unknown else ch.nn.Linear(in_features = X_train.size(1), out_features=1, bias=True) 
-        if self.unknown: 
-            emp.lambda_.data = self.emp_var.inverse()
-        emp.weight.data = self.emp_weight * emp.lambda_ if self.unknown else self.emp_weight
-        emp.bias.data = (self.emp_bias * emp.lambda_).flatten() if self.unknown else self.emp_bias
+        self.best_state = StateSnapshot()
+
+    def update_projection_set(self, train_stats):
+        """
+        Centers the projection set on the OLS estimates of the train set's sufficient statistics, 
+        ie. again after new samples were added to them.
+        :param train_stats: sufficient statistics of the train set - delphi.sufficient_statistics.SufficientStatistics
+        """
+        self.emp_weight, self.emp_bias = train_stats.ols()
+        self.emp_var = train_stats.variance(self.emp_weight, self.emp_bias)
+
+        if self.clamp:
+            self.weight_bounds, self.bias_bounds, self.var_bounds = train_stats.projection_set(self.alpha, self.r, self.unknown)
+            # bound tensors on the model's device, built by projection_bounds
+            self._bounds = None
+        else:
+            pass
+
+    def projection_bounds(self, M):
+        """
+        Projection set bounds as tensors of the same size, device and dtype as the
+        model's parameters, built on the first projection and whenever the model moves.
+        :param M: truncated regression model - torch.nn.Module
+        """
+        key = (M.weight.device, M.weight.dtype, M.weight.size())
+        if self._bounds is None or self._bounds[0] != key:
+            weight_bounds = Bounds(self.weight_bounds.lower.to(M.weight).view_as(M.weight),
+                                   self.weight_bounds.upper.to(M.weight).view_as(M.weight))
+            bias_bounds = Bounds(ch.full_like(M.bias, self.bias_bounds.lower), ch.full_like(M.bias, self.bias_bounds.upper))
+            var_bounds = Bounds(ch.full_like(M.lambda_, self.var_bounds.lower), ch.full_like(M.lambda_, self.var_bounds.upper)) if self.unknown else None
+            self._bounds = (key, weight_bounds, bias_bounds, var_bounds)
+        return self._bounds[1:]
+
+    def project(self, M):
+        """
+        Projects the model's parameters into the projection set in place.
+        :param M: truncated regression model - torch.nn.Module
+        """
+        weight_bounds, bias_bounds, var_bounds = self.projection_bounds(M)
+        project_regression_(M.weight, M.bias, weight_bounds, bias_bounds,
+                            lambda_=M.lambda_ if self.unknown else None, var_bounds=var_bounds)
 
-    
     def __call__(self, M, optimizer, i, loop_type, inp, target): 
         # increase number of steps taken
         self.steps += 1
         # project model parameters back to domain 
         if self.clamp: 
-            if self.unknown: 
-                var = M.lambda_.inverse()
-                weight = M.weight * var
-
-                M.lambda_.data = ch.clamp(var, self.var_bounds.lower, self.var_bounds.upper).inverse()
-                # project weights
-                M.weight.data = ch.cat([ch.clamp(weight[:,i], self.weight_bounds.lower[i], self.weight_bounds.upper[i])
-                    for i in range(weight.size(1))])[None,...] * M.lambda_
-                # project bias
-                bias = M.bias * var
-                M.bias.data = (ch.clamp(bias, self.bias_bounds.lower, self.bias_bounds.upper) * M.lambda_).reshape(M.bias.size())
-            else: 
-                M.weight.data = ch.cat([ch.clamp(M.weight[:,i], self.weight_bounds.lower[i], self.weight_bounds.upper[i]) 
-                    for i in range(M.weight.size(1))])[None,...]
-                # project bias
-                M.bias.data = ch.clamp(M.bias, self.bias_bounds.lower, self.bias_bounds.upper).reshape(M.bias.size())
-        else: 
-            pass
+            self.project(M)
 
+        # average the training step's gradient
+        if self.monitor is None:
+            self.monitor = ConvergenceMonitor([M.bias, M.lambda_] if self.unknown else [M.bias],
+                                              beta=self.args.ema if self.args.ema is not None else EMA_BETA)
+        self.monitor.update()
         # check for convergence every n steps
         if self.steps % self.n == 0: 
-            self.score(M, optimizer)
+            self.check(M, optimizer)
+
+    def check(self, M, optimizer):
+        """
+        Scores the validation set once the averaged training gradient's norm falls below 
+        check_ratio * tol, and at least every score_every checks, since in the unknown variance 
+        case the average keeps the noise of the lambda_ gradients. The best estimates are tracked 
+        on the validation gradient's norm, and the procedure ends once it is less than the tolerance.
+        :param M: truncated regression model - torch.nn.Module
+        :param optimizer: model's optimizer - torch.optim.Optimizer
+        """
+        grad_norm = self.monitor.norm
+        if grad_norm is None:
+            return
+        self.checks += 1
+        print("Iteration {} | Averaged Gradient Estimate: {}".format(int(self.steps / self.n), grad_norm))
+        check_ratio = self.args.check_ratio if self.args.check_ratio is not None else CHECK_RATIO
+        score_every = self.args.score_every if self.args.score_every is not None else SCORE_EVERY
+        if grad_norm >= check_ratio * self.tol and self.checks % score_every != 0:
+            return
+        val_grad_norm = self.score(M)
+        print("Iteration {} | Empirical Gradient Estimate: {}".format(int(self.steps / self.n), val_grad_norm))
+        # if smaller gradient norm, update best
+        if self.best_grad_norm is None or val_grad_norm < self.best_grad_norm: 
+            self.best_grad_norm = val_grad_norm
+            self.best_state.save(M, optimizer)
+        elif 1e-1 <= val_grad_norm - self.best_grad_norm: 
+            # load in the best model state and optimizer state
+            self.best_state.restore(M, optimizer)
+            self.monitor.reset()
+        # check that gradient magnitude is less than tolerance
+        if val_grad_norm < self.tol:
+            print("Final Score: {}".format(val_grad_norm))
+            raise ProcedureComplete()
+
+    def score(self, M):
+        """
+        Gradient norm of the current regression estimates on the validation set.
+        :param M: truncated regression model - torch.nn.Module
+        """
+        args = self.args
+        # score every iterate against the same validation noise
+        if self.val_noise is not None: 
+            self.val_noise.rewind()
+            args = Parameters(dict(self.args.as_dict(), noise=self.val_noise))
+        pred = M(self.X_val)
+        if self.unknown:
+            loss = self.criterion(pred, self.y_val, M.lambda_, self.phi, args)
+            grad, lambda_grad = ch.autograd.grad(loss, [pred, M.lambda_])
+            grad = ch.cat([(grad.sum(0) / M.lambda_).flatten(), lambda_grad.flatten()])
+        else: 
+            loss = self.criterion(pred, self.y_val, self.phi, args)
+            grad, = ch.autograd.grad(loss, [pred])
+            grad = grad.sum(0)
+        return grad.norm(dim=-1).detach().item()
 
 
 
@@ -303,38 +518,6 @@ class TruncatedRegressionModel(delphi):
         self.unknown = unknown
         # truncated regression model components
         self.linear, self.lambda_ = None, None
-   
-   def calc_emp_grad_est(self): 
-        """
-        Calculates the score of the current regression estimates of the validation set. It 
-        then updates the best estimates accordingly based off of the score's norm.
-        """
-        pred = M(self.X_val)
-        if self.unknown:
-            loss = self.criterion(pred, self.y_val, M.lambda_, self.phi)
-            grad, lambda_grad = ch.autograd.grad(loss, [pred, M.lambda_])
-            grad = ch.cat([(grad.sum(0) / M.lambda_).flatten(), lambda_grad.flatten()])
-        else: 
-            loss = self.criterion(pred, self.y_val, self.phi)
-            grad, = ch.autograd.grad(loss, [pred])
-            grad = grad.sum(0)
-
-        grad_norm = grad.norm(dim=-1)
-        # check that gradient magnitude is less than tolerance
-        if self.steps != 0 and grad_norm < self.tol: 
-            print("Final Score: {}".format(grad_norm))
-            raise ProcedureComplete()
-        
-        print("Iteration {} | Empirical Gradient Estimate: {}".format(int(self.steps / self.n), grad_norm))
-        # if smaller gradient norm, update best
-        if self.best_grad_norm is None or grad_norm < self.best_grad_norm: 
-            self.best_grad_norm = grad_norm
-            # keep track of state dict
-            self.best_state_dict, self.best_opt = copy.deepcopy(M.state_dict()), copy.deepcopy(optimizer.state_dict())
-        elif 1e-1 <= grad_norm - self.best_grad_norm: 
-            # load in the best model state and optimizer dictionaries
-            M.load_state_dict(self.best_state_dict)
-            optimizer.load_state_dict(self.best_opt)
 
     @abstractmethod
     def pretrain_hook(self):
@@ -354,8 +537,6 @@ class TruncatedRegressionModel(delphi):
         '''
         inp, targ = batch
 
-        self.model = 
-
     @abstractmethod
     def val_step(self, i, batch):
         '''
@@ -13,12 +13,12 @@ from torch.distributions.transforms import SigmoidTransform
 from torch.distributions.transformed_distribution import TransformedDistribution
 from cox.utils import Parameters
 from cox.store import Store
-import config
 from typing import Any
 from sklearn.linear_model import LogisticRegression
 
 from .stats import stats
 from ..oracle import oracle
+from ..noise import make_noise
 from ..grad import TruncatedBCE, TruncatedCE
 from ..train import train_model
 from ..utils.helpers import Bounds
@@ -38,6 +38,8 @@ class TruncatedLogisticRegression(stats):
             scale: float = None,
             device: str="cpu",
             multi_class='ovr',
+            noise: str='iid',
+            packed_masks: bool=False,
             store: Store=None,
             table: str=None,
             **kwargs):
@@ -52,13 +54,20 @@ class TruncatedLogisticRegression(stats):
         self.scale = scale
         self.device = device
         self.multi_class = multi_class
+        # noise source for the gradient estimates ('iid', 'sobol', or 'halton')
+        self.noise = make_noise(noise)
+        # reduce the Monte Carlo gradient estimates with bit-packed membership masks
+        self.packed_masks = packed_masks
         self.store, self.table = store, table
 
+        # copy hyperparameters, so that estimators do not share state
+        self.args = defaults.check_and_fill_args(Parameters(dict(args.as_dict())), defaults.LOGISTIC_ARGS, TensorDataset)
         # add membership oracle to algorithm hyperparameters
-        args.__setattr__('phi', self.phi)
-        args.__setattr__('alpha', self.alpha)
-        args.__setattr__('device', self.device)
-        config.args = defaults.check_and_fill_args(args, defaults.LOGISTIC_ARGS, TensorDataset)
+        self.args.__setattr__('phi', self.phi)
+        self.args.__setattr__('alpha', self.alpha)
+        self.args.__setattr__('device', self.device)
+        self.args.__setattr__('noise', self.noise)
+        self.args.__setattr__('packed_masks', self.packed_masks)
 
     def fit(self, X: Tensor, y: Tensor):
         """
@@ -73,7 +82,7 @@ class TruncatedLogisticRegression(stats):
         }
         ds = DataSet('tensor', TENSOR_REQUIRED_ARGS, TENSOR_OPTIONAL_ARGS, data_path=None,
                      **ds_kwargs)
-        loaders = ds.make_loaders(workers=config.args.workers, batch_size=config.args.batch_size)
+        loaders = ds.make_loaders(workers=self.args.workers, batch_size=self.args.batch_size)
 
         # empirical estimates for logistic regression
         # standard_log_reg = LogisticRegression_(penalty='none', fit_intercept=self.bias, multi_class=self.multi_class)
@@ -88,10 +97,10 @@ class TruncatedLogisticRegression(stats):
         #     self._log_reg.bias = ch.nn.Parameter(Tensor(standard_log_reg.intercept_))
 
         # intialize loss function & iteration hook and add to hyperparameters
-        config.args.__setattr__('custom_criterion', TruncatedCE.apply if self.multi_class == 'multinomial' else TruncatedBCE.apply)
-        # config.args.__setattr__('iteration_hook', TruncLogRegIterationHook(self._log_reg, config.args.alpha, config.args.radius))
+        self.args.__setattr__('custom_criterion', TruncatedCE.apply if self.multi_class == 'multinomial' else TruncatedBCE.apply)
+        # self.args.__setattr__('iteration_hook', TruncLogRegIterationHook(self._log_reg, self.args.alpha, self.args.radius))
         # run PGD to predict actual estimates
-        train_model(config.args, self.model, loaders, store=self.store, table=self.table)
+        train_model(self.args, self.model, loaders, store=self.store, table=self.table)
 
 
 
@@ -117,13 +126,13 @@ class TruncLogRegIterationHook:
         self.clamp = clamp
 
         # projection set radius
-        self.radius = config.args.radius * (ch.sqrt(2.0 * ch.log(Tensor([1.0 / self.alpha]))))
+        self.radius = self.r * (ch.sqrt(2.0 * ch.log(Tensor([1.0 / self.alpha]))))
         if self.clamp:
             self.weight_bounds = Bounds((self.emp_log_reg.weight.data - self.r).flatten(),
                                         (self.emp_log_reg.weight.data + self.r).flatten())
             if self.emp_log_reg.bias:
-                self.bias_bounds = Bounds(float(self.emp_log_reg.bias.data - config.args.radius),
-                                          float(self.emp_log_reg.bias.data + config.args.radius))
+                self.bias_bounds = Bounds(float(self.emp_log_reg.bias.data - self.r),
+                                          float(self.emp_log_reg.bias.data + self.r))
 
     def __call__(self, model, i, loop_type, inp, target):
         if self.clamp:
@@ -0,0 +1,248 @@
+"""
+Full batch Newton solver for truncated linear regression.
+"""
+
+import torch as ch
+from torch import Tensor
+import math
+
+from ..noise import make_noise, NoiseBank
+from ..masks import pack_oracle, masked_sum, masked_count
+from ..grad import log_ndtr_diff, LOG_SQRT_2PI, MC_TEMPORARIES, PACKED_MC_TEMPORARIES
+from ..samplers import truncated_sample
+
+
+# damping above which the solver stops, since no step decreases the gradient norm
+MAX_DAMPING = 1e8
+
+
+class TruncatedRegressionNewton:
+    '''
+    Damped Newton-CG solver for the truncated regression negative log likelihood, as an
+    alternative to projected SGD. In the natural parameters of the truncated normal
+    (v = w * lambda_, c = b * lambda_ and the inverse variance lambda_, or w and b for known
+    noise variance) the negative log likelihood is convex, and its Hessian for each sample is
+    the covariance of the sufficient statistics (z, -z^2 / 2) under the truncated noise
+    distribution. The gradient and the Hessian come from the same truncated moments, in closed
+    form for one dimensional interval oracles (if args.analytic), by inverse CDF for the other
+    interval oracles, or else from the same Monte Carlo draws filtered through the oracle.
+    Each iteration solves the damped Newton system (H + mu * I) p = -g with conjugate
+    gradients, using Hessian-vector products over the samples, and projects the step into the
+    projection set. A step is accepted if it decreases the gradient norm, after which the
+    damping mu shrinks; otherwise mu grows and the step is resolved, so that far from the
+    optimum the steps fall back towards (scaled) gradient steps. The Monte Carlo estimates
+    draw their noise from a bank that is rewound for every gradient and redrawn with every
+    new batch of rows, so that the accept test compares the gradients before and after a step
+    with the same draws (common random numbers), and for the full batch the solver works on
+    one fixed sample average of the likelihood.
+    '''
+    def __init__(self, phi, unknown, args, steps: int=100, tol: float=1e-2, bs: int=None,
+                 damping: float=1e-3, cg_steps: int=None):
+        '''
+        Args:
+            phi (delphi.oracle.oracle) : membership oracle
+            unknown (bool) : unknown noise variance
+            args (cox.utils.Parameters) : estimator hyperparameters (num_samples, max_memory, analytic, noise, eps, packed_masks)
+            steps (int) : maximum number of Newton iterations
+            tol (float) : gradient norm tolerance, below which the solver stops
+            bs (int) : number of rows sampled for each iteration, defaults to all of the rows
+            damping (float) : initial damping of the Newton system
+            cg_steps (int) : maximum number of conjugate gradient iterations, defaults to the number of parameters
+        '''
+        self.phi = phi
+        self.unknown = unknown
+        self.args = args
+        self.steps = steps
+        self.tol = tol
+        self.bs = bs
+        self.damping = damping
+        self.cg_steps = cg_steps
+        self.grad_norm, self.steps_taken = None, 0
+        self.noise = None
+
+    def fit(self, M, X: Tensor, y: Tensor, project=None):
+        '''
+        Runs the solver on the model's parameters in place.
+        Args:
+            M (torch.nn.Module) : truncated regression model, with 1 x d weight, (1,) bias and, for unknown
+                noise variance, 1 x 1 inverse variance lambda_
+            X (torch.Tensor) : n x d covariates
+            y (torch.Tensor) : n x 1 dependent variable
+            project (Callable) : projects the model's parameters into the projection set in place
+        '''
+        params = [M.weight, M.bias, M.lambda_] if self.unknown else [M.weight, M.bias]
+        X_, y_ = self._batch(X, y)
+        # enough draws in the bank for every chunk of one gradient's Monte Carlo estimate
+        self.noise = NoiseBank(make_noise(self.args.noise), rotations=-(-self.args.num_samples // self._chunk(X_.size(0))))
+        with ch.no_grad():
+            grad, curv = self._grad(params, X_, y_)
+            mu = self.damping
+            for step in range(self.steps):
+                self.grad_norm = float(_norm(grad))
+                if self.grad_norm < self.tol:
+                    break
+                # solve the damped Newton system to the forcing tolerance
+                hvp = lambda u: [h + mu * u_ for h, u_ in zip(self._hvp(curv, X_, u), u)]
+                p = _cg(hvp, [-g for g in grad], min(.5, math.sqrt(self.grad_norm)) * self.grad_norm,
+                        self.cg_steps if self.cg_steps is not None else sum(p_.numel() for p_ in params))
+                old = [p_.clone() for p_ in params]
+                for p_, step_ in zip(params, p):
+                    p_.add_(step_)
+                if project is not None:
+                    project(M)
+                # judge the step on the same rows and noise draws, so that neither decides it
+                grad_, curv_ = self._grad(params, X_, y_)
+                if _norm(grad_) < self.grad_norm:
+                    grad, curv, mu = grad_, curv_, max(mu / 3, 1e-8)
+                    if self.bs is not None:
+                        X_, y_ = self._batch(X, y)
+                        grad, curv = self._grad(params, X_, y_)
+                else:
+                    for p_, old_ in zip(params, old):
+                        p_.copy_(old_)
+                    mu *= 4
+                    # no step decreases the gradient norm any more, ie. it is at the Monte Carlo noise floor
+                    if mu > MAX_DAMPING:
+                        break
+                self.steps_taken = step + 1
+            # the gradient norm of the last iterate, also when the steps ran out
+            self.grad_norm = float(_norm(grad))
+        return M
+
+    def _batch(self, X, y):
+        if self.bs is None or self.bs >= X.size(0):
+            return X, y
+        # new rows get new noise draws
+        if self.noise is not None:
+            self.noise.refresh()
+        rows = ch.randint(X.size(0), (self.bs,), device=X.device)
+        return X[rows], y[rows]
+
+    def _grad(self, params, X, y):
+        '''
+        Mean gradient of the negative log likelihood, and the per row curvature of the sufficient statistics.
+        '''
+        lambda_ = params[2] if self.unknown else ch.ones(1, 1, dtype=X.dtype, device=X.device)
+        eta = X @ params[0].T + params[1]
+        loc, scale = eta / lambda_, lambda_.rsqrt()
+        m1, m2, m3, m4 = self._moments(loc, scale)
+        # conditional moments of z = loc + scale * u, from the moments of the standardized noise u
+        loc, scale = loc.double(), scale.double()
+        var_u = (m2 - m1.pow(2)).clamp(min=0)
+        mean, var = loc + scale * m1, scale.pow(2) * var_u
+        eta_grad = (mean - y.double())
+        if not self.unknown:
+            grads = [(eta_grad.T @ X.double()) / X.size(0), eta_grad.mean(0)]
+            return [g.to(p) for g, p in zip(grads, params)], (var,)
+        mean_sq = var + mean.pow(2)
+        cov_u = m3 - m1 * m2
+        # covariances of (z, z^2), written with the central moments of u to avoid cancellation in the tails
+        cov = 2 * loc * var + scale.pow(3) * cov_u
+        var_sq = 4 * loc.pow(2) * var + 4 * loc * scale.pow(3) * cov_u + scale.pow(4) * (m4 - m2.pow(2)).clamp(min=0)
+        lambda_grad = .5 * (y.double().pow(2) - mean_sq)
+        grads = [(eta_grad.T @ X.double()) / X.size(0), eta_grad.mean(0), lambda_grad.mean(0, keepdim=True)]
+        # Hessian of the sufficient statistics (z, -z^2 / 2)
+        return [g.to(p) for g, p in zip(grads, params)], (var, -.5 * cov, .25 * var_sq)
+
+    def _hvp(self, curv, X, u):
+        '''
+        Hessian-vector product of the mean negative log likelihood.
+        '''
+        d_eta = (X.double() @ u[0].double().T + u[1].double())
+        if not self.unknown:
+            h_eta = curv[0] * d_eta
+            return [((h_eta.T @ X.double()) / X.size(0)).to(u[0]), h_eta.mean(0).to(u[1])]
+        d_lambda = u[2].double()
+        h_eta = curv[0] * d_eta + curv[1] * d_lambda
+        h_lambda = curv[1] * d_eta + curv[2] * d_lambda
+        return [((h_eta.T @ X.double()) / X.size(0)).to(u[0]), h_eta.mean(0).to(u[1]), h_lambda.mean(0, keepdim=True).to(u[2])]
+
+    def _chunk(self, numel):
+        '''
+        Number of Monte Carlo draws per chunk, that fits the memory budget.
+        '''
+        temporaries = MC_TEMPORARIES if getattr(self.phi, 'intervals', None) is not None or not self.args.packed_masks else PACKED_MC_TEMPORARIES
+        if self.args.max_memory is None:
+            return self.args.num_samples
+        return int(max(1, min(self.args.num_samples, self.args.max_memory // (numel * 8 * temporaries))))
+
+    def _moments(self, loc, scale):
+        '''
+        First four moments of the standardized noise u = (z - loc) / scale for each row, where z is
+        N(loc, scale^2) truncated to the oracle's set.
+        '''
+        intervals = getattr(self.phi, 'intervals', None)
+        if self.args.analytic and intervals is not None:
+            return standard_truncated_moments((intervals.lower.to(loc) - loc.double()) / scale.double(),
+                                              (intervals.upper.to(loc) - loc.double()) / scale.double())
+        num_samples, packed, chunk = self.args.num_samples, bool(self.args.packed_masks), self._chunk(loc.numel())
+        # every gradient on the same rows sees the same draws
+        noise_ = self.noise if self.noise is not None else make_noise(self.args.noise)
+        if isinstance(noise_, NoiseBank):
+            noise_.rewind()
+        sums = [ch.zeros_like(loc, dtype=ch.double) for _ in range(4)]
+        count = ch.zeros_like(loc, dtype=ch.double)
+        for start in range(0, num_samples, chunk):
+            size = (min(chunk, num_samples - start),) + loc.size()
+            if intervals is not None:
+                # every inverse CDF draw is accepted
+                u = (truncated_sample(loc.double(), scale.double(), intervals, noise_.uniform(size, loc.device)) - loc.double()) / scale.double()
+                mask = ch.ones((), dtype=ch.double, device=loc.device)
+                count += size[0]
+                for p in range(4):
+                    sums[p] += u.pow(p + 1).sum(0)
+            else:
+                u = noise_.normal(size, loc.device)
+                mask = pack_oracle(self.phi, ch.addcmul(loc[None, ...], u, scale), packed)
+                count += masked_count(mask).double()
+                for p in range(4):
+                    sums[p] += masked_sum(u, mask, power=p + 1).double()
+        count = count + (self.args.eps if self.args.eps is not None else 0.0)
+        return tuple(s / count for s in sums)
+
+
+def standard_truncated_moments(a, b):
+    """
+    First four moments of the standard normal distribution truncated to a union of disjoint
+    intervals, from the recurrence m_k = (k - 1) m_{k - 2} + sum(a^{k - 1} pdf(a) - b^{k - 1} pdf(b)) / alpha,
+    with the densities taken relative to the truncation set's mass alpha in log space.
+    Args:
+        a (torch.Tensor) : B x k standardized lower bounds
+        b (torch.Tensor) : B x k standardized upper bounds
+    Returns:
+        Tuple with the B x 1 first, second, third and fourth moments
+    """
+    log_alpha = ch.logsumexp(log_ndtr_diff(a, b), dim=-1, keepdim=True)
+    pdf_a = ch.where(ch.isinf(a), ch.zeros_like(a), ch.exp(-.5 * a.pow(2) - LOG_SQRT_2PI - log_alpha))
+    pdf_b = ch.where(ch.isinf(b), ch.zeros_like(b), ch.exp(-.5 * b.pow(2) - LOG_SQRT_2PI - log_alpha))
+    a, b = ch.where(ch.isinf(a), ch.zeros_like(a), a), ch.where(ch.isinf(b), ch.zeros_like(b), b)
+    moments = [ch.ones_like(log_alpha)]
+    for k in range(1, 5):
+        boundary = (a.pow(k - 1) * pdf_a - b.pow(k - 1) * pdf_b).sum(-1, keepdim=True)
+        moments.append((k - 1) * (moments[k - 2] if k > 1 else 0) + boundary)
+    return tuple(moments[1:])
+
+
+def _norm(tensors):
+    return ch.sqrt(sum(t.double().pow(2).sum() for t in tensors))
+
+
+def _cg(A, b, tol, max_steps):
+    """
+    Conjugate gradients for A x = b, over lists of tensors.
+    """
+    x = [ch.zeros_like(b_) for b_ in b]
+    r = [b_.clone() for b_ in b]
+    p = [r_.clone() for r_ in r]
+    rr = sum((r_.double() * r_.double()).sum() for r_ in r)
+    for _ in range(max_steps):
+        if math.sqrt(float(rr)) <= tol:
+            break
+        Ap = A(p)
+        alpha = rr / sum((p_.double() * Ap_.double()).sum() for p_, Ap_ in zip(p, Ap))
+        x = [x_ + (alpha * p_).to(x_) for x_, p_ in zip(x, p)]
+        r = [r_ - (alpha * Ap_).to(r_) for r_, Ap_ in zip(r, Ap)]
+        rr_ = sum((r_.double() * r_.double()).sum() for r_ in r)
+        p = [r_ + (rr_ / rr * p_).to(r_) for r_, p_ in zip(r, p)]
+        rr = rr_
+    return x
@@ -0,0 +1,132 @@
+"""
+Sufficient statistics of linear regression, for OLS estimates without refitting.
+"""
+
+import torch as ch
+from torch import Tensor
+
+from .utils.helpers import Bounds
+
+
+# default number of rows per chunk when accumulating the statistics
+CHUNK_SIZE = 100000
+
+
+class SufficientStatistics:
+    """
+    Sufficient statistics of a linear regression with intercept, ie. X^T X, X^T y and y^T y of
+    the covariates augmented by a column of ones, and the number of samples. The three blocks
+    are accumulated with one gram matrix of [X, 1, y] in a single pass over the data, in chunks
+    of chunk_size rows, and are kept in double precision, so that the residual sum of squares
+    y^T y - 2 w^T X^T y + w^T X^T X w does not lose its precision to cancellation. Statistics of
+    disjoint samples add up, so the statistics of a split of the data (ie. the training set) are
+    those of the whole data minus those of the rest (ie. the validation set).
+    """
+    def __init__(self, X: Tensor=None, y: Tensor=None, chunk_size: int=CHUNK_SIZE):
+        """
+        Args:
+            X (torch.Tensor) : n x d covariates
+            y (torch.Tensor) : n x k dependent variables
+            chunk_size (int) : number of rows per chunk of the single pass
+        """
+        self.chunk_size = chunk_size
+        self.gram, self.n, self.dtype = None, 0, None
+        if X is not None:
+            self.update(X, y)
+
+    def update(self, X: Tensor, y: Tensor):
+        """
+        Adds samples to the statistics.
+        Args:
+            X (torch.Tensor) : n x d covariates
+            y (torch.Tensor) : n x k dependent variables
+        """
+        y = y.reshape(y.size(0), -1)
+        if self.gram is None:
+            size = X.size(1) + 1 + y.size(1)
+            self.gram = ch.zeros(size, size, dtype=ch.double, device=X.device)
+            self.d, self.k, self.dtype = X.size(1), y.size(1), X.dtype
+        for start in range(0, X.size(0), self.chunk_size):
+            X_, y_ = X[start:start + self.chunk_size].double(), y[start:start + self.chunk_size].double()
+            Z = ch.cat([X_, ch.ones(X_.size(0), 1, dtype=ch.double, device=X.device), y_], dim=1)
+            self.gram.addmm_(Z.T, Z)
+        self.n += X.size(0)
+        return self
+
+    def _combine(self, other, sign):
+        out = SufficientStatistics(chunk_size=self.chunk_size)
+        out.gram, out.n = self.gram + sign * other.gram, self.n + sign * other.n
+        out.d, out.k, out.dtype = self.d, self.k, self.dtype
+        return out
+
+    def __add__(self, other):
+        return self._combine(other, 1)
+
+    def __sub__(self, other):
+        return self._combine(other, -1)
+
+    @property
+    def XtX(self):
+        """
+        (d + 1) x (d + 1) gram matrix of the covariates augmented by a column of ones.
+        """
+        return self.gram[:self.d + 1, :self.d + 1]
+
+    @property
+    def Xty(self):
+        """
+        (d + 1) x k products of the augmented covariates and the dependent variables.
+        """
+        return self.gram[:self.d + 1, self.d + 1:]
+
+    @property
+    def yty(self):
+        """
+        k x k gram matrix of the dependent variables.
+        """
+        return self.gram[self.d + 1:, self.d + 1:]
+
+    def ols(self):
+        """
+        OLS estimates from the normal equations, solved by least squares, so that collinear
+        covariates get the minimum norm solution.
+        Returns:
+            Tuple with the k x d weights and (k,) intercepts, as in sklearn's coef_ and intercept_
+        """
+        coef = ch.linalg.lstsq(self.XtX, self.Xty).solution
+        return coef[:self.d].T.to(self.dtype), coef[self.d].to(self.dtype)
+
+    def variance(self, weight: Tensor=None, bias: Tensor=None):
+        """
+        Residual variance of a linear model, with one degree of freedom for the intercept,
+        defaults to the OLS estimates.
+        Args:
+            weight (torch.Tensor) : k x d weights
+            bias (torch.Tensor) : (k,) intercepts
+        Returns:
+            k x 1 residual variance
+        """
+        if weight is None:
+            weight, bias = self.ols()
+        coef = ch.cat([weight.T, bias.reshape(1, -1)]).double()
+        rss = self.yty.diagonal() - 2 * (coef * self.Xty).sum(0) + (coef * (self.XtX @ coef)).sum(0)
+        return (rss.clamp(min=0) / (self.n - 1))[..., None].to(self.dtype)
+
+    def projection_set(self, alpha: Tensor, r: float, unknown: bool):
+        """
+        Projection set of truncated regression around the OLS estimates.
+        Args:
+            alpha (torch.Tensor) : survival probability
+            r (float) : projection set radius multiplier
+            unknown (bool) : unknown noise variance
+        Returns:
+            Tuple with the weight, bias and noise variance bounds, the latter None for known noise variance
+        """
+        weight, bias = self.ols()
+        var = self.variance(weight, bias)
+        alpha = ch.as_tensor(alpha, dtype=self.dtype)
+        radius = r * (12.0 + 4.0 * ch.log(2.0 / alpha)) if unknown else r * (4.0 * ch.log(2.0 / alpha) + 7.0)
+        weight_bounds = Bounds(weight.flatten() - radius, weight.flatten() + radius)
+        bias_bounds = Bounds(float(bias.flatten() - radius), float(bias.flatten() + radius))
+        var_bounds = Bounds(float(var.flatten() / r), float(var.flatten() / alpha.pow(2))) if unknown else None
+        return weight_bounds, bias_bounds, var_bounds
@@ -0,0 +1,171 @@
+"""
+Survival probability (alpha) of truncation sets under gaussian and regression models.
+"""
+
+import torch as ch
+from torch import Tensor
+from scipy.stats import chi2, ncx2
+import math
+
+from . import oracle
+from .grad import log_ndtr_diff
+from .noise import make_noise
+
+
+class SurvivalProbability:
+    """
+    Estimates the survival probability alpha of a truncation set, ie. the probability mass
+    that a gaussian or regression model puts on the set of a membership oracle. One dimensional
+    interval oracles (Left, Right, Interval, KIntervalUnion), vector intervals under a diagonal
+    covariance matrix and single spheres whose covariance matrix is proportional to the model's
+    are computed in closed form. Every other oracle is estimated by Monte Carlo in batches of
+    batch_size samples, until the confidence interval's half width drops below tol or max_samples
+    samples have been drawn. The confidence interval comes from the spread of the batch means,
+    which stays valid for quasi-random noise, since each batch is an independently shifted
+    point set.
+    """
+    def __init__(self, batch_size=10000, max_samples=10000000, tol=1e-3, confidence=.95, noise='iid', min_batches=4):
+        """
+        Args:
+            batch_size (int) : number of samples per batch
+            max_samples (int) : maximum number of samples
+            tol (float) : half width of the confidence interval at which sampling stops
+            confidence (float) : confidence level of the interval
+            noise (str or delphi.noise.noise) : noise source, 'iid', 'sobol' or 'halton'
+            min_batches (int) : minimum number of batches before checking the confidence interval
+        """
+        self.batch_size = batch_size
+        self.max_samples = max_samples
+        self.tol = tol
+        self.confidence = confidence
+        self.noise = make_noise(noise)
+        self.min_batches = min_batches
+        # statistics of the last estimate
+        self.stderr, self.num_samples, self.exact = None, None, None
+
+    def __call__(self, phi, loc, covariance_matrix):
+        """
+        Survival probability under a multivariate normal distribution.
+        Args:
+            phi (delphi.oracle.oracle) : membership oracle
+            loc (torch.Tensor) : (d,) mean
+            covariance_matrix (torch.Tensor) : d x d covariance matrix
+        Returns:
+            survival probability
+        """
+        loc = ch.as_tensor(loc, dtype=ch.float).flatten()
+        covariance_matrix = ch.as_tensor(covariance_matrix, dtype=ch.float).reshape(loc.numel(), loc.numel())
+        alpha = self._closed_form(phi, loc, covariance_matrix)
+        if alpha is not None:
+            return alpha
+        scale_tril = ch.linalg.cholesky(covariance_matrix)
+        return self._monte_carlo(lambda z: phi_rows(phi, loc + z @ scale_tril.T), (loc.numel(),))
+
+    def regression(self, phi, X, weight, bias=0.0, variance=1.0):
+        """
+        Survival probability under a linear regression model y = Xw + b + N(0, variance), averaged
+        over the covariates. Each Monte Carlo sample draws a covariate row uniformly along with its
+        noise, so that a batch holds batch_size samples, whatever the number of rows.
+        Args:
+            phi (delphi.oracle.oracle) : membership oracle on the dependent variable
+            X (torch.Tensor) : n x d covariates
+            weight (torch.Tensor) : (d,) regression weights
+            bias (float or torch.Tensor) : regression intercept
+            variance (float or torch.Tensor) : noise variance
+        Returns:
+            survival probability
+        """
+        pred = X @ ch.as_tensor(weight, dtype=X.dtype).reshape(-1, 1) + ch.as_tensor(bias, dtype=X.dtype).reshape(1, 1)
+        scale = ch.as_tensor(variance, dtype=X.dtype).sqrt()
+        intervals = getattr(phi, 'intervals', None)
+        if intervals is not None:
+            self.stderr, self.num_samples, self.exact = 0.0, 0, True
+            return interval_mass(pred.double(), scale.double(), intervals).mean().float()
+        def accept(z):
+            rows = ch.randint(pred.size(0), (z.size(0),), device=pred.device)
+            return phi_rows(phi, pred[rows] + scale * z)
+        return self._monte_carlo(accept, (1,))
+
+    def _closed_form(self, phi, loc, covariance_matrix):
+        """
+        Closed form survival probability, None if the oracle has none.
+        """
+        self.stderr, self.num_samples, self.exact = 0.0, 0, True
+        std = covariance_matrix.diagonal().sqrt()
+        intervals = getattr(phi, 'intervals', None)
+        if intervals is not None and loc.numel() == 1:
+            return interval_mass(loc.double().reshape(1, 1), std.double(), intervals).flatten()[0].float()
+        diagonal = ch.allclose(covariance_matrix, ch.diag(covariance_matrix.diagonal()))
+        if isinstance(phi, oracle.Interval) and diagonal:
+            # independent coordinates, the box's mass is the product of the coordinate masses
+            lower = ch.as_tensor(phi.bounds.lower, dtype=ch.double).expand(loc.numel())
+            upper = ch.as_tensor(phi.bounds.upper, dtype=ch.double).expand(loc.numel())
+            std, loc = std.double(), loc.double()
+            return log_ndtr_diff((lower - loc) / std, (upper - loc) / std).sum().exp().float()
+        if isinstance(phi, (oracle.Left, oracle.Right)) and diagonal:
+            bound = ch.as_tensor(phi.left if isinstance(phi, oracle.Left) else phi.right, dtype=ch.double).expand(loc.numel())
+            inf = ch.full_like(bound, float('inf'))
+            lower, upper = (bound, inf) if isinstance(phi, oracle.Left) else (-inf, bound)
+            std, loc = std.double(), loc.double()
+            return log_ndtr_diff((lower - loc) / std, (upper - loc) / std).sum().exp().float()
+        if isinstance(phi, oracle.Sphere) and phi._whitened_centroid.size(0) == 1:
+            # whitened by the sphere's covariance matrix, the model's covariance is k * I if they are proportional,
+            # so that the squared distance over k is a noncentral chi square with d degrees of freedom
+            inv_scale_tril = phi._inv_scale_tril[0].double()
+            whitened = inv_scale_tril @ covariance_matrix.double() @ inv_scale_tril.T
+            k = whitened.diagonal().mean()
+            if ch.allclose(whitened, k * ch.eye(loc.numel(), dtype=ch.double), rtol=1e-4, atol=1e-6):
+                nc = float((inv_scale_tril @ loc.double() - phi._whitened_centroid[0].double()).pow(2).sum() / k)
+                x, d = float(phi._radius_sq[0]) / float(k), loc.numel()
+                return ch.tensor(chi2.cdf(x, d) if nc == 0 else ncx2.cdf(x, d, nc), dtype=ch.float)
+        self.exact = None
+        return None
+
+    def _monte_carlo(self, accept, size):
+        """
+        Batched Monte Carlo estimate with early stopping.
+        Args:
+            accept (callable) : maps batch_size x size standard normal samples to their (batch_size,) acceptance fractions
+            size (tuple) : size of a standard normal sample
+        """
+        z_crit = math.sqrt(2) * float(ch.erfinv(ch.tensor(self.confidence, dtype=ch.double)))
+        means, drawn = [], 0
+        while drawn < self.max_samples:
+            batch_size = min(self.batch_size, self.max_samples - drawn)
+            means.append(accept(self.noise.normal((batch_size,) + tuple(size))).float().mean())
+            drawn += batch_size
+            if len(means) >= self.min_batches:
+                means_ = ch.stack(means)
+                # floor the error at one sample per draw, so that sets without any hits so far do not stop at once
+                self.stderr = max(float(means_.std() / math.sqrt(len(means))), 1.0 / drawn)
+                if z_crit * self.stderr < self.tol:
+                    break
+        means_ = ch.stack(means)
+        if len(means) < self.min_batches:
+            self.stderr = float(means_.std() / math.sqrt(len(means))) if len(means) > 1 else None
+        self.num_samples, self.exact = drawn, False
+        return means_.mean()
+
+    def __str__(self):
+        return 'survival probability'
+
+
+def phi_rows(phi, x):
+    """
+    Membership of the samples along the last dimension of x, as a ... bool tensor.
+    """
+    return oracle.row_mask(phi, x.reshape(-1, x.size(-1))).reshape(x.size()[:-1])
+
+
+def interval_mass(loc, scale, intervals):
+    """
+    Probability mass that N(loc, scale^2) puts on a union of disjoint one dimensional intervals.
+    Args:
+        loc (torch.Tensor) : B x 1 means
+        scale (float or torch.Tensor) : standard deviation
+        intervals (delphi.utils.helpers.Bounds) : (k,) lower and upper bounds
+    Returns:
+        B x 1 masses
+    """
+    lower, upper = intervals.lower.to(loc), intervals.upper.to(loc)
+    return ch.logsumexp(log_ndtr_diff((lower - loc) / scale, (upper - loc) / scale), dim=-1, keepdim=True).exp()
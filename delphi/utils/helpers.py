@@ -223,6 +223,35 @@ class Bounds(NamedTuple):
     upper: Tensor
 
 
+def project_regression_(weight, bias, weight_bounds, bias_bounds, lambda_=None, var_bounds=None):
+    """
+    Projects truncated regression parameters into their projection set in place. The bounds
+    are tensors broadcastable with the parameters they bound, so that each parameter is
+    clamped with one kernel, instead of one per coordinate. For unknown noise variance, the
+    parameters are reparameterized by the inverse variance lambda_, ie. weight = w * lambda_,
+    so the variance is clamped first and the regression parameters are clamped in the
+    original parameterization and then rescaled by the projected lambda_.
+    Args:
+        weight (torch.Tensor) : regression weights
+        bias (torch.Tensor) : regression bias
+        weight_bounds (delphi.utils.helpers.Bounds) : weight bounds
+        bias_bounds (delphi.utils.helpers.Bounds) : bias bounds
+        lambda_ (torch.Tensor) : inverse noise variance, None for known noise variance
+        var_bounds (delphi.utils.helpers.Bounds) : noise variance bounds, for unknown noise variance
+    """
+    with ch.no_grad():
+        if lambda_ is None:
+            weight.clamp_(weight_bounds.lower, weight_bounds.upper)
+            bias.clamp_(bias_bounds.lower, bias_bounds.upper)
+            return
+        var = lambda_.reciprocal()
+        lambda_.reciprocal_().clamp_(var_bounds.lower, var_bounds.upper).reciprocal_()
+        for param, bounds in ((weight, weight_bounds), (bias, bias_bounds)):
+            # drop leading dimensions of lambda_ that the parameter does not have, ie. a 1 x 1 lambda_ for a (1,) bias
+            var_, lambda__ = (var.reshape(var.size()[var.dim() - param.dim():]), lambda_.reshape(lambda_.size()[lambda_.dim() - param.dim():])) if lambda_.dim() > param.dim() else (var, lambda_)
+            param.mul_(var_).clamp_(bounds.lower, bounds.upper).mul_(lambda__)
+
+
 class FakeReLU(ch.autograd.Function):
     @staticmethod
     def forward(ctx, input):
@@ -9,7 +9,6 @@ import os
 import cox
 from cox.utils import Parameters
 from cox.store import Store
-import config
 
 try: 
     from delphi.trainer import Trainer
@@ -125,9 +124,7 @@ if __name__ == '__main__':
 
     args.__setattr__('num_samples', 1000)
 
-    # set global 
-    config.args = args 
-    final_model = main(config.args, store=store)
+    final_model = main(args, store=store)
 
 
 
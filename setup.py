@@ -40,5 +40,5 @@ setuptools.setup(
     install_requires=['tqdm', 'grpcio', 'psutil', 'gitpython','py3nvml', 'cox',
                     'scikit-learn', 'seaborn', 'torch', 'torchvision', 'pandas',
                     'numpy', 'scipy', 'GPUtil', 'dill', 'tensorboardX', 'tables',
-                    'matplotlib', 'orthnet', 'config'],
+                    'matplotlib'],
 )
@@ -0,0 +1,76 @@
+import pytest
+import torch as ch
+from cox.utils import Parameters
+
+from delphi import oracle
+from delphi.sufficient_statistics import SufficientStatistics
+from delphi.utils.helpers import LinearUnknownVariance, ProcedureComplete
+
+linear_regression = pytest.importorskip('delphi.stats.linear_regression')
+
+
+def truncated_data(n, d, seed=0):
+    g = ch.Generator().manual_seed(seed)
+    w, X = ch.randn(1, d, generator=g), ch.randn(n, d, generator=g)
+    y = X @ w.T + 1.0 + ch.randn(n, 1, generator=g)
+    keep = (y > 0).flatten()
+    return X[keep], y[keep], keep.float().mean()
+
+
+def test_unknown_variance_fit_terminates_early():
+    ch.manual_seed(0)
+    X, y, alpha = truncated_data(20000, 3)
+    X_val, y_val, X, y = X[:200], y[:200], X[200:], y[200:]
+    phi, steps, tol = oracle.Left(ch.zeros(1)), 5000, 5e-2
+    args = Parameters({'num_samples': 100, 'eps': 1e-5, 'analytic': True, 'noise': 'iid', 'ema': .9, 'check_ratio': 10.0, 'score_every': 10})
+    criterion = linear_regression.TruncatedUnknownVarianceMSE.apply
+    stats = SufficientStatistics(X, y)
+    hook = linear_regression.TruncatedRegressionIterationHook(stats, X_val, y_val, phi, tol, 2.0, alpha, True, True, 10, criterion, args)
+    M = LinearUnknownVariance(3, 1)
+    with ch.no_grad():
+        M.lambda_.data = stats.variance().inverse()
+        M.weight.data = hook.emp_weight * M.lambda_
+        M.bias.data = (hook.emp_bias * M.lambda_).flatten()
+    optimizer = ch.optim.SGD([{'params': [M.weight, M.bias]}, {'params': M.lambda_}], lr=1e-1)
+    with pytest.raises(ProcedureComplete):
+        for i in range(steps):
+            rows = ch.randint(X.size(0), (10,))
+            loss = criterion(M(X[rows]), y[rows], M.lambda_, phi, args)
+            optimizer.zero_grad()
+            loss.sum().backward()
+            optimizer.step()
+            hook(M, optimizer, i, 'train', X[rows], y[rows])
+    assert hook.steps < steps
+
+
+class StreamingRegression(linear_regression.TruncatedRegression):
+    """
+    Truncated regression with the trainer's hooks stubbed out, for partial fits.
+    """
+    def __init__(self, *args, **kwargs):
+        ch.nn.Module.__init__(self)
+        super().__init__(*args, **kwargs)
+
+    def pretrain_hook(self): pass
+    def train_step(self, i, batch): pass
+    def val_step(self, i, batch): pass
+    def iteration_hook(self, i, loop_type, loss, prec1, prec5, batch): pass
+    def epoch_hook(self, i, loop_type, loss, prec1, prec5, batch): pass
+    def post_train_hook(self): pass
+
+
+def test_partial_fit_keeps_improving():
+    ch.manual_seed(0)
+    X, y, alpha = truncated_data(200000, 3, seed=1)
+    # the regression is initialized with the OLS estimates of the first chunk, which truncation biases
+    M = StreamingRegression(oracle.Left(ch.zeros(1)), alpha, unknown=True)
+    g = ch.Generator().manual_seed(1)
+    w = ch.randn(1, 3, generator=g)
+    errors = []
+    for start in range(0, X.size(0), 500):
+        M.partial_fit(X[start:start + 500], y[start:start + 500])
+        errors.append(float((M.weight.flatten() - w.flatten()).norm()))
+    assert errors[-1] < .25 * errors[0]
+    # the chunks after the first hundred still move the estimates towards the truth
+    assert errors[-1] < .75 * errors[100]
+    assert M._optimizer.param_groups[0]['lr'] > 1e-3 * M.lr
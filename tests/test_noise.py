@@ -0,0 +1,29 @@
+import torch as ch
+
+from delphi.noise import NoiseBank
+
+
+def test_noise_bank_serves_prefix_for_changing_batch_sizes():
+    bank = NoiseBank('iid', rotations=2)
+    first = bank.normal((10, 5, 1)).clone()
+    for batch_size in (8, 3, 12, 5):
+        bank.rewind()
+        samples = bank.normal((10, batch_size, 1))
+        assert samples.size() == (10, batch_size, 1)
+        k = min(5, batch_size)
+        assert ch.equal(samples[:, :k], first[:, :k])
+    # more samples per element extend the draws, the first ones stay
+    bank.rewind()
+    assert ch.equal(bank.normal((30, 5, 1))[:10], first)
+    # one pool per distribution, event size and device
+    assert len(bank._pools) == 1
+
+
+def test_noise_bank_rotates_and_rewinds():
+    bank = NoiseBank('sobol', rotations=3)
+    draws = [bank.uniform((4, 6, 2)).clone() for _ in range(4)]
+    assert not ch.equal(draws[0], draws[1])
+    # the pool holds three slices, the fourth call wraps around
+    assert ch.equal(draws[3], draws[0])
+    bank.rewind()
+    assert ch.equal(bank.uniform((4, 6, 2)), draws[0])
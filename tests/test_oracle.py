@@ -0,0 +1,21 @@
+import torch as ch
+
+from delphi import oracle
+
+
+def test_sphere_broadcasts_one_centroid_to_many_covariances():
+    covariances = ch.stack([ch.diag(ch.tensor([4.0, .25])), ch.diag(ch.tensor([.25, 4.0]))])
+    phi = oracle.Sphere(covariances, ch.zeros(2), 1.0)
+    x = ch.tensor([[1.5, 0.0], [0.0, 1.5], [1.5, 1.5], [0.0, 0.0]])
+    assert phi(x).tolist() == [1.0, 1.0, 0.0, 1.0]
+    # each ellipsoid on its own
+    for covariance in covariances:
+        single = oracle.Sphere(covariance, ch.zeros(2), 1.0)
+        assert (phi(x) >= single(x)).all()
+
+
+def test_sphere_broadcasts_radii_and_centroids():
+    phi = oracle.Sphere(ch.eye(2), ch.tensor([[0.0, 0.0], [5.0, 0.0]]), ch.tensor([1.0, 2.0]))
+    x = ch.tensor([[.5, 0.0], [3.5, 0.0], [2.0, 0.0]])
+    assert phi(x).tolist() == [1.0, 1.0, 0.0]
+    assert oracle.Sphere(ch.eye(2).expand(3, 2, 2), ch.zeros(2), ch.tensor([1.0, 2.0, 3.0]))(ch.tensor([[2.5, 0.0]])).tolist() == [1.0]
@@ -0,0 +1,46 @@
+import pytest
+import torch as ch
+
+from delphi import oracle
+from delphi.samplers import AdaptiveSampler, RejectionSampler
+
+
+def test_rejection_sampler_fills_request():
+    ch.manual_seed(0)
+    sampler = RejectionSampler(100)
+    samples = sampler(ch.zeros(2), ch.eye(2), oracle.Polytope(ch.tensor([[-1.0, 0.0]]), ch.zeros(1)), 1000)
+    assert samples.size() == (1000, 2)
+    assert (samples[:, 0] >= 0).all()
+
+
+def test_rejection_sampler_bounds_rounds_on_null_set():
+    ch.manual_seed(0)
+    sampler = RejectionSampler(100, max_num_samples=100000)
+    with pytest.raises(ValueError, match='survival probability'):
+        sampler(ch.zeros(2), ch.eye(2), oracle.Polytope(ch.tensor([[-1.0, 0.0]]), ch.full((1,), -50.0)), 10)
+    assert sampler.drawn == 100000
+    # no round is larger than the cap
+    assert sampler.rounds >= 100000 // sampler.max_round
+
+
+def test_adaptive_sampler_draws_intervals_by_inverse_cdf():
+    ch.manual_seed(0)
+    pred = ch.zeros(50, 1)
+    # a tight interval far in the tail, where rejection would hardly accept a draw
+    phi = oracle.KIntervalUnion([(ch.tensor([3.0]), ch.tensor([3.1]))])
+    sampler = AdaptiveSampler(target=20, max_samples=1000)
+    z, z_sq, count = sampler(pred, 1.0, phi, 10, second_moment=True)
+    assert (sampler.draws == 20).all()
+    assert ch.equal(count, ch.full_like(pred, 20))
+    mean = z / count
+    assert ((mean > 3.0) & (mean < 3.1)).all()
+
+
+def test_adaptive_sampler_rejects_without_intervals():
+    ch.manual_seed(0)
+    pred = ch.zeros(50, 1)
+    sampler = AdaptiveSampler(target=20, max_samples=1000)
+    z, _, count = sampler(pred, 1.0, oracle.Lambda(lambda x: x > 0), 10)
+    assert (count >= 20).all()
+    assert (z / count > 0).all()
+    assert (sampler.draws >= 30).any()